@@ -6,7 +6,6 @@
 ## Import libraries
 import os
 import sys
-import json
 import pandas as pd
 import numpy as np
 import matplotlib
@@ -17,7 +16,6 @@ from scipy.signal import find_peaks
 from scipy import signal
 from scipy.fft import fft
 from scipy import interpolate
-from scipy.stats import linregress
 from pathlib import Path
 
 
@@ -26,6 +24,8 @@ pd.set_option('display.width', desired_width)
 np.set_printoptions(linewidth=desired_width)
 
 CurrentWorkingDirectory = Path.cwd() / '../..'
+sys.path.append(str(CurrentWorkingDirectory / '03_Scripts'))
+from Utils import Signal, Read
 SampleList = pd.read_csv(str(CurrentWorkingDirectory / '02_Data/SampleList.csv'))
 
 
@@ -42,9 +42,8 @@ ARAPath = os.path.join(CurrentWorkingDirectory,DataPath,MachineData[1])
 
 #%%
 # Open MTS data and get keys
-with open(MTSPath+'/AO_data_MTS.json') as DictFile:
-  MTSData = json.load(DictFile)
-SamplesNames = [*MTSData]
+MTSFile = MTSPath+'/AO_data_MTS.json'
+SamplesNames = Read.MTSSamples(MTSFile)
 
 MTSPeaks = pd.read_csv(os.path.join(ResultsPath,'MTSPeaks.csv'))
 
@@ -69,24 +68,19 @@ CSVFile = CSVFiles[CSVSamples.index(SampleName)]
 
 #%%
 # Load data
-MTSSampleData = pd.DataFrame.from_dict(MTSData[SampleName])
+MTSSampleData = Read.MTS(MTSFile, SampleName)
 Time = 'Time UTC'
-ARASampleData = pd.read_csv(os.path.join(ARAPath,CSVFile),sep=';',header=1,parse_dates=[Time])
+ARASampleData = Read.ARAMIS(os.path.join(ARAPath,CSVFile)).reset_index(drop=True)
 
 
 #%%
 # 02 Import MTS data
-MTSTimes = MTSSampleData['time'].values
 MTSDisplacements = MTSSampleData['disp'].values
 MTSForces = MTSSampleData['force'].values
 
-MTSTimeSteps = np.zeros(len(MTSTimes)-1)
-for i in range(len(MTSTimeSteps)-1):
-  MTSTimeSteps[i]=MTSTimes[i+1]-MTSTimes[i]
-StartIndex = np.where(abs(MTSTimeSteps)==max(abs(MTSTimeSteps)))[0][0]
-
-for Index in range(StartIndex+1,len(MTSTimes)):
-  MTSTimes[Index] = MTSTimes[Index] + MTSTimes[StartIndex]
+# Monotonic time (time stamps are reset at protocols junction)
+MTSTimes, Junctions, _ = Signal.TimeBase(MTSSampleData['time'].values)
+StartIndex = Junctions[0]
 
 ## Plot adjusted time
 # Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5),dpi=100)
@@ -389,14 +383,9 @@ UltimateForce = min(ShiftedMTSForces)
 UltimateForceIndex = np.where(ShiftedMTSForces==min(ShiftedMTSForces))[0][0]
 RegressionRange = int((UltimateForceIndex-MTSFirstCycleTroughs[-1])/3)
 
-InitialStiffness = np.zeros(UltimateForceIndex-MTSFirstCycleTroughs[-1]-RegressionRange)
-for Index in range(UltimateForceIndex-MTSFirstCycleTroughs[-1]-RegressionRange):
-    Index = Index + MTSFirstCycleTroughs[-1]
-
-    RegressionDisplacementData = ShiftedARADisplacement[Index:Index+RegressionRange]
-    RegressionForceData = ShiftedMTSForces[Index:Index+RegressionRange]
-
-    InitialStiffness[Index-MTSFirstCycleTroughs[-1]], Interception, RValue, PValue, StdError = linregress(RegressionDisplacementData,RegressionForceData)
+RegressionDisplacementData = ShiftedARADisplacement[MTSFirstCycleTroughs[-1]:UltimateForceIndex-1]
+RegressionForceData = ShiftedMTSForces[MTSFirstCycleTroughs[-1]:UltimateForceIndex-1]
+InitialStiffness = Signal.RollingRegression(RegressionDisplacementData,RegressionForceData,RegressionRange)['Slope'].values
 
 # Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5),dpi=100)
 # Axes.plot(InitialStiffness,color=(0,0,0),label='Regression results')
@@ -430,14 +419,9 @@ MaxDisplacement = min(ShiftedARADisplacement)
 MaxDisplacementIndex = np.where(ShiftedARADisplacement==MaxDisplacement)[0][0]
 RegressionRange = int((Junction-MaxDisplacementIndex)/10)
 
-DamagedStiffness = np.zeros(Junction - MaxDisplacementIndex - RegressionRange)
-for Index in range(Junction - MaxDisplacementIndex - RegressionRange):
-    Index = Index + MaxDisplacementIndex
-
-    RegressionDisplacementData = ShiftedARADisplacement[Index:Index + RegressionRange]
-    RegressionForceData = ShiftedMTSForces[Index:Index + RegressionRange]
-
-    DamagedStiffness[Index - MaxDisplacementIndex], Interception, RValue, PValue, StdError = linregress(RegressionDisplacementData, RegressionForceData)
+RegressionDisplacementData = ShiftedARADisplacement[MaxDisplacementIndex:Junction-1]
+RegressionForceData = ShiftedMTSForces[MaxDisplacementIndex:Junction-1]
+DamagedStiffness = Signal.RollingRegression(RegressionDisplacementData,RegressionForceData,RegressionRange)['Slope'].values
 
 # Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5),dpi=100)
 # Axes.plot(DamagedStiffness,color=(0,0,0),label='Regression results')
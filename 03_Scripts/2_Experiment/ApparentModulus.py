@@ -1,6 +1,12 @@
 import os
+import sys
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from Utils import Signal
 
 
 ResultsPath = '/home/mathieu/Documents/MscThesis/04_Results/FractureZoneAssessment'
@@ -26,14 +32,11 @@ for Sample in SamplesData['Sample']:
     # plt.close(Figure)
 
     RegressionRange = int((CurveEnd - CurveStart) / 3)
-    ApparentModulus = np.zeros((CurveEnd - CurveStart) - RegressionRange)
-
-    for Index in range(CurveStart, CurveEnd - RegressionRange):
-        RegressionStrainData = SampleCurves['Mean Strain (-)'].iloc[Index:Index + RegressionRange]
-        RegressionStressData = SampleCurves['Apparent Stress (MPa)'].iloc[Index:Index + RegressionRange]
-
-        ApparentModulus[Index - CurveStart], Interception, RValue, PValue, StdError = linregress(RegressionStrainData,
-                                                                                                 RegressionStressData)
+    # Regressions for all start indices in range(CurveStart, CurveEnd - RegressionRange)
+    RegressionStrainData = SampleCurves['Mean Strain (-)'].values[CurveStart:CurveEnd - 1]
+    RegressionStressData = SampleCurves['Apparent Stress (MPa)'].values[CurveStart:CurveEnd - 1]
+    Regressions = Signal.RollingRegression(RegressionStrainData, RegressionStressData, RegressionRange)
+    ApparentModulus = Regressions['Slope'].values
 
     # Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5),dpi=100)
     # Axes.plot(ApparentModulus,
@@ -36,7 +36,7 @@ from numba.typed import List
 import matplotlib.pyplot as plt
 from matplotlib import image as im
 from vtk.numpy_interface import dataset_adapter as dsa
-from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, numpy_to_vtkIdTypeArray
 
 from Utils import *
 Show = Show()
@@ -2790,11 +2790,61 @@ def Compute_EigenValues_EigenVectors(i, elem, MSL_kernel_list, BVseg, projection
 def Change_Ext(FileName, New_Ext):
     """changes the file extension"""
     return FileName.replace("." + FileName.split(".")[-1], New_Ext)
+def Numpy2VTU(Points, Cells, CellType, PointData={}, CellData={}):
+
+    """
+    Builds a vtk unstructured grid sharing the memory of numpy arrays
+    Cells are given in vtk legacy layout (number of points, ids...)
+    """
+
+    def Array(Values, Name):
+        VTK_Array = numpy_to_vtk(np.ascontiguousarray(Values), deep=False)
+        VTK_Array.SetName(Name)
+        return VTK_Array
+
+    VTK_Points = vtk.vtkPoints()
+    VTK_Points.SetData(Array(Points, 'Points'))
+
+    VTK_Cells = vtk.vtkCellArray()
+    VTK_Cells.SetCells(len(Cells), numpy_to_vtkIdTypeArray(Cells.astype('int64').ravel(), deep=True))
+
+    Grid = vtk.vtkUnstructuredGrid()
+    Grid.SetPoints(VTK_Points)
+    Grid.SetCells(CellType, VTK_Cells)
+
+    for Name, Values in PointData.items():
+        Grid.GetPointData().AddArray(Array(Values, Name))
+    for Name, Values in CellData.items():
+        Grid.GetCellData().AddArray(Array(Values, Name))
+
+    return Grid
+def Write_VTU(Grid, FileName, Compress=True):
+
+    """
+    Writes a vtk unstructured grid in binary XML format
+    with raw appended data, zlib compressed
+    """
+
+    Writer = vtk.vtkXMLUnstructuredGridWriter()
+    Writer.SetFileName(FileName)
+    Writer.SetInputData(Grid)
+    Writer.SetDataModeToAppended()
+    Writer.EncodeAppendedDataOff()
+    Writer.SetHeaderTypeToUInt64()
+    if Compress:
+        Writer.SetCompressorTypeToZLib()
+    else:
+        Writer.SetCompressorTypeToNone()
+    Writer.Write()
+
+    return
 def Fabric2VTK(INPname, m, mm, Phis_Cort, Phis_Trab):
 
     """
-    Writes vtk files displaying the eigenvectors computed
-    for a mesh (only for elements with fabric)
+    Writes binary vtk files displaying the eigenvectors computed
+    for a mesh (only for elements with fabric) and a file with the
+    fabric tensors at elements center, displayed as instanced
+    ellipsoids with the Paraview Tensor Glyph filter
     """
 
     # Read abaqus input file
@@ -2803,71 +2853,39 @@ def Fabric2VTK(INPname, m, mm, Phis_Cort, Phis_Trab):
     Elements = Input_Data[3]
 
     # Calculate center of gravity of each element with fabric
-    COG = {Element: np.mean([np.asarray(Nodes[Node].get_coord())
+    Fabric_Elements = list(m.keys())
+    COG = np.array([np.mean([np.asarray(Nodes[Node].get_coord())
                              for Node in Elements[Element].get_nodes()],axis=0)
-           for Element in m.keys()}
-
-    # Write vtk files for each eigenvector
-    for i in [0, 1, 2]:
-        if i == 0:
-            vtkname = Change_Ext(INPname, "_FABmin.vtk")
-        elif i == 1:
-            vtkname = Change_Ext(INPname, "_FABmid.vtk")
-        elif i == 2:
-            vtkname = Change_Ext(INPname, "_FABmax.vtk")
+                    for Element in Fabric_Elements])
+    eValues = np.array([m[Element] for Element in Fabric_Elements])
+    eVectors = np.array([mm[Element] for Element in Fabric_Elements])
+    N = len(Fabric_Elements)
+
+    CellData = {'DOA_max': eValues[:, 0] / eValues[:, 2],
+                'PHIc': np.array([Phis_Cort[Element] for Element in Fabric_Elements], 'float'),
+                'PHIt': np.array([Phis_Trab[Element] for Element in Fabric_Elements], 'float')}
+
+    # Write vtk files for each eigenvector (lines centered on element)
+    Lines = np.stack([np.full(N, 2), np.arange(N), np.arange(N) + N], axis=1)
+    for i, Ext in enumerate(["_FABmin.vtu", "_FABmid.vtu", "_FABmax.vtu"]):
+        vtkname = Change_Ext(INPname, Ext)
         print(" ... write vtk file: " + vtkname)
-        with open(vtkname, "w") as vtkFile:
-            vtkFile.write("# vtk DataFile Version 2.0\n")
-            vtkFile.write("Reconstructed Lagrangian Field Data\n")
-            vtkFile.write("ASCII\n")
-            vtkFile.write("DATASET UNSTRUCTURED_GRID\n")
-            vtkFile.write("\nPOINTS " + str(2 * len(m.keys())) + " float\n")
-            for Element in m.keys():
-                vtkFile.write(
-                    str(COG[Element][0] - m[Element][i] * mm[Element][0][i])
-                    + " "
-                    + str(COG[Element][1] - m[Element][i] * mm[Element][1][i])
-                    + " "
-                    + str(COG[Element][2] - m[Element][i] * mm[Element][2][i])
-                    + "\n"
-                )
-            for Element in m.keys():
-                vtkFile.write(
-                    str(COG[Element][0] + m[Element][i] * mm[Element][0][i])
-                    + " "
-                    + str(COG[Element][1] + m[Element][i] * mm[Element][1][0])
-                    + " "
-                    + str(COG[Element][2] + m[Element][i] * mm[Element][2][i])
-                    + "\n"
-                )
-            vtkFile.write(
-                "\nCELLS " + str(len(m.keys())) + " " + str(3 * len(m.keys())) + "\n"
-            )
-            count = -1
-            for Element in m.keys():
-                count = count + 1
-                vtkFile.write(
-                    "2 " + str(count) + " " + str(count + len(m.keys())) + "\n"
-                )
-            vtkFile.write("\nCELL_TYPES " + str(len(m.keys())) + "\n")
-            for Element in m.keys():
-                vtkFile.write("3\n")
-
-            vtkFile.write("\nCELL_DATA " + str(len(m.keys())) + "\n")
-            vtkFile.write("scalars DOA_max float\n")
-            vtkFile.write("LOOKUP_TABLE default\n")
-            for Element in m.keys():
-                vtkFile.write(str(m[Element][0] / m[Element][2]) + "\n")
-
-            vtkFile.write("scalars PHIc float\n")
-            vtkFile.write("LOOKUP_TABLE default\n")
-            for Element in m.keys():
-                vtkFile.write(str(Phis_Cort[Element]) + "\n")
-
-            vtkFile.write("scalars PHIt float\n")
-            vtkFile.write("LOOKUP_TABLE default\n")
-            for Element in m.keys():
-                vtkFile.write(str(Phis_Trab[Element]) + "\n")
+        Vector = eValues[:, i:i+1] * eVectors[:, :, i]
+        Points = np.concatenate([COG - Vector, COG + Vector])
+        Grid = Numpy2VTU(Points, Lines, vtk.VTK_LINE, CellData=CellData)
+        Write_VTU(Grid, vtkname)
+
+    # Write fabric tensors for instanced ellipsoid glyphs
+    vtkname = Change_Ext(INPname, "_FAB.vtu")
+    print(" ... write vtk file: " + vtkname)
+    Tensors = np.einsum('nij,nj,nkj->nik', eVectors, eValues, eVectors).reshape(N, 9)
+    Vertices = np.stack([np.ones(N), np.arange(N)], axis=1)
+    PointData = dict(CellData, Fabric=Tensors)
+    Grid = Numpy2VTU(COG, Vertices, vtk.VTK_VERTEX, PointData=PointData)
+    Grid.GetPointData().SetActiveTensors('Fabric')
+    Write_VTU(Grid, vtkname)
+
+    return
 def PSL_Material_Mapping_Copy_Layers_Accurate(Bone, Config, FileNames):
 
     """
@@ -2,6 +2,10 @@ import os
 import sys
 import pandas as pd
 import matplotlib.pyplot as plt
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from Utils import Read
 
 
 ## List csv files
@@ -12,7 +16,7 @@ SamplesFiles.sort()
 ## Read a defined sample
 SampleNumber = 1
 Time = 'Time UTC'
-ARASampleData = pd.read_csv(os.path.join(ARAPath,SamplesFiles[SampleNumber-1]),sep=';',header=1,parse_dates=[Time])
+ARASampleData = Read.ARAMIS(os.path.join(ARAPath,SamplesFiles[SampleNumber-1])).reset_index(drop=True)
 
 
 ## Compare the 3 Coordinate systems
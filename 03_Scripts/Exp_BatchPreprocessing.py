@@ -0,0 +1,211 @@
+#%% #!/usr/bin/env python3
+# Initialization
+
+Version = '01'
+
+Description = """
+    Script used to preprocess the experiments of all samples in
+    parallel. For each sample, MTS and ARAMIS signals are matched,
+    stress and strain are computed and the ultimate load, stiffness
+    and apparent modulus are extracted. Curves are stored in compressed
+    .npz files and the sample values in a consolidated ExperimentData
+    table. Samples whose inputs did not change are skipped.
+
+    Version Control:
+        01 - Original script
+
+    Author: Mathieu Simon
+            ARTORG Center for Biomedical Engineering Research
+            SITEM Insel, University of Bern
+
+    Date: October 2026
+    """
+
+#%% Imports
+# Modules import
+
+import json
+import hashlib
+import argparse
+from types import SimpleNamespace
+
+from Utils import *
+import Exp_MatchSignals
+
+#%% Functions
+# Define functions
+
+def InputsHash(Files, Extra=''):
+
+    """
+    Hash of input files size and modification time and of
+    additional information (e.g. parameters, script version)
+    """
+
+    Hash = hashlib.sha1((Extra + Version).encode())
+    for File in Files:
+        Stat = os.stat(File)
+        Hash.update(str((str(File), Stat.st_size, Stat.st_mtime_ns)).encode())
+
+    return Hash.hexdigest()
+
+def MonotonicPart(Matched, DeltaTime=10):
+
+    """
+    Truncate matched signals to the monotonic loading part
+    (last force peak before ultimate load to first peak after
+    maximum displacement) and set them to 0 at its start
+    """
+
+    Peaks, Properties = sig.find_peaks(Matched['FZ'], prominence=1)
+    MaxForce = Matched['FZ'].idxmin()
+    MaxDisp = Matched['Z'].idxmax()
+    DeltaIndex = np.argmin(np.abs(Matched['T'] - DeltaTime))
+    Start = Peaks[Peaks < MaxForce - DeltaIndex][-1]
+    Stop = Peaks[Peaks > MaxDisp][0]
+
+    Curve = Matched[Start:Stop].reset_index(drop=True)
+    Curve = Curve - Curve.loc[0]
+
+    return Curve
+
+def PreprocessSample(Sample, Arguments):
+
+    """
+    Match signals and extract the mechanical properties of one sample,
+    writes curves (Sample.npz) and values (Sample.json) in OutDir
+    """
+
+    Folder, Thicknesses, Areas, Hashes, OutDir = Arguments
+
+    # Match MTS and ARAMIS signals
+    Matched = Exp_MatchSignals.Main(SimpleNamespace(Folder=Folder, Sample=Sample))
+
+    # Monotonic loading curve, strain and stress
+    Curve = MonotonicPart(Matched)
+    Force = -Curve['FZ'].values
+    Displacement = Curve['Z'].values
+    Strain = Displacement / Thicknesses[Sample]
+    Stress = Force / Areas.get(Sample, np.nan)
+
+    # Ultimate load, stiffness and apparent modulus
+    Ultimate = int(np.argmax(Force))
+    Width = max(Ultimate // 3, 3)
+    Stiffness = Signal.RollingRegression(Displacement[:Ultimate+1], Force[:Ultimate+1], Width)
+    Modulus = Signal.RollingRegression(Strain[:Ultimate+1], Stress[:Ultimate+1], Width)
+
+    Values = {'Sample':Sample,
+              'Hash':Hashes[Sample],
+              'Thickness (mm)':Thicknesses[Sample],
+              'Mean Area (mm2)':Areas.get(Sample, np.nan),
+              'Ultimate Load (N)':Force[Ultimate],
+              'Ultimate Load Index':Ultimate,
+              'Displacement Ultimate Load (mm)':Displacement[Ultimate],
+              'Strain at Ultimate Load (-)':Strain[Ultimate],
+              'Max Displacement (mm)':Displacement.max(),
+              'Max Strain (-)':Strain.max(),
+              'Stiffness (N/mm)':np.nanmax(Stiffness['Slope']),
+              'Apparent Modulus (MPa)':np.nanmax(Modulus['Slope']),
+              'Apparent Strength (MPa)':Stress[Ultimate]}
+    Values = {K: V.item() if isinstance(V, np.generic) else V for K, V in Values.items()}
+
+    # Write curves in compressed binary format and values
+    Curves = {C: Matched[C].values for C in Matched.columns}
+    np.savez_compressed(str(Path(OutDir) / (Sample + '.npz')),
+                        Strain=Strain, Stress=Stress, Force=Force,
+                        Displacement=Displacement, **Curves)
+    with open(Path(OutDir) / (Sample + '.json'), 'w') as File:
+        json.dump(Values, File, indent=2)
+
+    return
+
+#%% Main
+# Main code
+
+def Main(Arguments):
+
+    # Set directories and read sample list
+    WD, DD, SD, RD = SetDirectories(Arguments.Folder)
+    SampleList = pd.read_csv(str(DD / 'SampleList.csv'))
+    DataDir = DD / '03_Experiment'
+    OutDir = RD / '02_Experiment' / 'Curves'
+    os.makedirs(OutDir, exist_ok=True)
+
+    if Arguments.Samples:
+        Samples = Arguments.Samples
+    else:
+        Samples = list(SampleList['Internal ID'])
+
+    # Sample thickness and mean area for strain and stress
+    Columns = ['Thickness Point %i (mm)' % i for i in range(1, 4)]
+    Thicknesses = SampleList.set_index('Internal ID')[Columns].mean(axis=1).to_dict()
+    AreasFile = RD / 'ApparentProps.csv'
+    Areas = {}
+    if AreasFile.exists():
+        Areas = pd.read_csv(str(AreasFile), index_col=0)['Mean Area (mm2)'].to_dict()
+
+    # Skip samples whose inputs did not change
+    MTSFile = DataDir / '1_MTS' / 'AO_data_MTS.json'
+    Hashes, ToRun = {}, []
+    for Sample in Samples:
+        ARAMISFile = DataDir / '2_ARAMIS' / (Sample + '.csv')
+        if not ARAMISFile.exists():
+            print('No ARAMIS data for ' + Sample)
+            continue
+        Extra = str((Thicknesses.get(Sample), Areas.get(Sample)))
+        Hashes[Sample] = InputsHash([MTSFile, ARAMISFile], Extra)
+
+        ValuesFile = OutDir / (Sample + '.json')
+        if ValuesFile.exists() and not Arguments.Restart:
+            with open(ValuesFile) as File:
+                if json.load(File).get('Hash') == Hashes[Sample]:
+                    continue
+        ToRun.append(Sample)
+
+    print(f'\n{len(Hashes) - len(ToRun)} sample(s) up to date, {len(ToRun)} to preprocess')
+
+    # Build MTS cache once before starting the workers
+    Read.MTSCache(str(MTSFile))
+
+    # Run preprocessing in parallel
+    Batch.Threads = 1
+    Batch.Processes = Arguments.Processes
+    Jobs = (Arguments.Folder, Thicknesses, Areas, Hashes, OutDir)
+    Batch.Run(PreprocessSample, ToRun, Jobs, OutDir / 'Batch', Resume=False)
+
+    # Consolidate sample values
+    Data = []
+    for Sample in Samples:
+        ValuesFile = OutDir / (Sample + '.json')
+        if ValuesFile.exists():
+            with open(ValuesFile) as File:
+                Data.append(json.load(File))
+    Data = pd.DataFrame(Data)
+    Data.to_csv(str(RD / '02_Experiment' / 'ExperimentData.csv'), index=False)
+
+    print(Data.describe())
+
+    return
+
+#%% Execution part
+# Execution as main
+if __name__ == '__main__':
+
+    # Initiate the parser with a description
+    FC = argparse.RawDescriptionHelpFormatter
+    Parser = argparse.ArgumentParser(description=Description, formatter_class=FC)
+
+    # Add long and short argument
+    SV = Parser.prog + ' version ' + Version
+    Parser.add_argument('-V', '--Version', help='Show script version', action='version', version=SV)
+
+    # Add defaults arguments
+    Parser.add_argument('Samples', help='Samples to preprocess (default all)', type=str, nargs='*')
+    Parser.add_argument('-F', '--Folder', help='Root folder name', type=str, default='FRACTIB')
+    Parser.add_argument('-P', '--Processes', help='Number of samples in parallel (default cores)', type=int, default=None)
+    Parser.add_argument('-R', '--Restart', help='Preprocess all samples again', action='store_true')
+
+    # Read arguments from the command line
+    Arguments = Parser.parse_args()
+
+    Main(Arguments)
@@ -1,7 +1,7 @@
 #%% Script initialization
 # Initialization
 
-Version = '03'
+Version = '06'
 
 Description = """
     Match data recorded by MTS with records of the ARAMIS device
@@ -11,6 +11,9 @@ Description = """
         01 - Original script
         02 - Adapt peak detection with empirical criteria
         03 - Drop nan values in original measurement
+        04 - Read MTS and ARAMIS data from binary cache
+        05 - Interpolate and filter all channels at once
+        06 - Align signals by cross-correlation, peaks as fallback
 
     Author: Mathieu Simon
             ARTORG Center for Biomedical Engineering Research
@@ -27,6 +30,146 @@ import argparse
 
 from Utils import *
 
+#%% Functions
+# Define functions
+
+def PeakShifts(MTS, ARAMIS, Prominence=0.02):
+
+    """
+    Shifts between MTS and ARAMIS displacement signals of protocol 1
+    and 2 obtained by matching displacement peaks. Prominence is
+    decreased until enough peaks are found (at most 20 steps).
+    Protocol 1 peaks are matched from the start and protocol 2
+    peaks from the end when both signals have different peak counts
+    """
+
+    # V02 - Adapt prominence to match empirical criteria for peak detection
+    ARAMISPeaks, Properties = sig.find_peaks(-ARAMIS, prominence=Prominence)
+    TruePeaks = ARAMISPeaks[ARAMIS[ARAMISPeaks] < 0.9*ARAMIS[ARAMISPeaks].min()]
+    
+    i = 0
+    Decrease = 0.05 * Prominence
+    if len(ARAMISPeaks) < 9:
+        while (len(ARAMISPeaks) < 9 or sum(ARAMISPeaks < 18000) < 5) and i < 20:
+            P = Prominence - i*Decrease
+            ARAMISPeaks, Properties = sig.find_peaks(-ARAMIS, prominence=P)
+            i += 1
+
+    if len(ARAMISPeaks) > 9:
+        C1 = ARAMISPeaks[ARAMISPeaks < 18000][-5:]
+        ARAMISPeaks = np.concatenate([C1, TruePeaks])
+
+    MTSPeaks, Properties = sig.find_peaks(-MTS, prominence=Prominence)
+    i = 0
+    while len(MTSPeaks) < 9 and i < 20:
+        P = Prominence - i*Decrease
+        MTSPeaks, Properties = sig.find_peaks(-MTS, prominence=P)
+        i += 1
+
+    if len(MTSPeaks) > 9:
+        MTSPeaks = np.concatenate([MTSPeaks[:5], MTSPeaks[-4:]])
+
+    N1 = min(5, len(ARAMISPeaks), len(MTSPeaks))
+    N2 = min(len(ARAMISPeaks[6:]), len(MTSPeaks[6:]))
+    if N1 == 0 or N2 == 0:
+        raise ValueError('Not enough displacement peaks to match protocols')
+
+    Shift1 = np.mean(ARAMISPeaks[:N1] - MTSPeaks[:N1])
+    Shift2 = np.mean(ARAMISPeaks[len(ARAMISPeaks)-N2:] - MTSPeaks[len(MTSPeaks)-N2:])
+
+    return Shift1, Shift2
+
+def AlignSignals(MTS, ARAMIS, Junction, MinCorrelation=0.5, MinConfidence=0.05):
+
+    """
+    Shifts (in samples) of the ARAMIS displacement with respect to
+    the MTS displacement for protocol 1 (MTS[:Junction+1]) and
+    protocol 2 (MTS[Junction+1:]) by FFT cross-correlation of each
+    protocol. Peak matching is used when correlation is ambiguous
+    :return Shifts: ARAMIS index - MTS index for both protocols
+            Report: Lags, correlations, confidences and method used
+    """
+
+    # Protocol 1, ARAMIS recording starts before MTS
+    Lag1, Correlation1, Confidence1 = Signal.Align(MTS[:Junction+1], ARAMIS, MinLag=0)
+
+    # Protocol 2, after protocol 1 in ARAMIS signal
+    # Lag2 is the ARAMIS index at which MTS[Junction+1:] starts
+    Lag2, Correlation2, Confidence2 = Signal.Align(MTS[Junction+1:], ARAMIS, MinLag=int(Lag1) + Junction)
+    Shift2 = Lag2 - (Junction + 1)
+
+    Report = {'Shift 1':Lag1, 'Correlation 1':Correlation1, 'Confidence 1':Confidence1,
+              'Shift 2':Shift2, 'Correlation 2':Correlation2, 'Confidence 2':Confidence2,
+              'Method':'Cross-correlation'}
+
+    Ambiguous = min(Correlation1, Correlation2) < MinCorrelation
+    Ambiguous = Ambiguous or min(Confidence1, Confidence2) < MinConfidence
+    if Ambiguous:
+        Lag1, Shift2 = PeakShifts(MTS, ARAMIS)
+        Report.update({'Shift 1':Lag1, 'Shift 2':Shift2, 'Method':'Peaks'})
+
+    return (Lag1, Shift2), Report
+
+def Synthetic(Cyclic, Junction, N, Seed):
+
+    """
+    Synthetic MTS displacement, either a smoothed random walk with
+    a ramp or cyclic protocols (5 cycles for protocol 1, 3 cycles
+    followed by a ramp to failure for protocol 2) with noise
+    """
+
+    Random = np.random.default_rng(Seed)
+
+    if Cyclic:
+        T1 = np.arange(Junction + 1)
+        Protocol1 = -(1 - np.cos(2 * np.pi * 5 * T1 / len(T1))) / 2
+        T2 = np.arange(N - Junction - 1)
+        Cycles = int(0.6 * len(T2))
+        Protocol2 = -1.5 * (1 - np.cos(2 * np.pi * 3 * T2[:Cycles] / Cycles)) / 2
+        Ramp = -np.linspace(0, 3, len(T2) - Cycles)
+        MTS = np.concatenate([Protocol1, Protocol2, Ramp])
+        MTS = MTS + Random.normal(scale=0.01, size=N)
+    else:
+        MTS = np.cumsum(Random.normal(size=N))
+        MTS = np.convolve(MTS, np.ones(5) / 5, mode='same') - np.linspace(0, 50, N)
+
+    return MTS
+
+def CheckAlignment(Shifts=(700, 1000), Junction=3000, N=6000, Seed=0):
+
+    """
+    Check AlignSignals on synthetic displacement records with known
+    shifts (ARAMIS index - MTS index) for both protocols, aperiodic
+    and cyclic. ARAMIS records a constant displacement before
+    protocol 1 and between both protocols, and an offset with
+    respect to MTS
+    """
+
+    Reports = {}
+    for Cyclic in [False, True]:
+
+        MTS = Synthetic(Cyclic, Junction, N, Seed)
+
+        # ARAMIS record of both protocols with known shifts
+        ARAMIS = np.full(Shifts[1] + N + 200, MTS[-1])
+        ARAMIS[:Shifts[0]] = MTS[0]
+        ARAMIS[Shifts[0]:Shifts[0]+Junction+1] = MTS[:Junction+1]
+        ARAMIS[Shifts[0]+Junction+1:Shifts[1]+Junction+1] = MTS[Junction]
+        ARAMIS[Shifts[1]+Junction+1:Shifts[1]+N] = MTS[Junction+1:]
+        ARAMIS = ARAMIS + 2.0
+
+        Case = 'cyclic' if Cyclic else 'aperiodic'
+        Found, Report = AlignSignals(MTS, ARAMIS, Junction)
+        Found = tuple(round(float(F), 2) for F in Found)
+        Errors = np.abs(np.array(Found) - np.array(Shifts))
+        if np.any(Errors >= 1):
+            raise ValueError(f'Alignment check failed ({Case}), shifts {Found} instead of {Shifts}')
+
+        print(f'Alignment check passed ({Case}), shifts {Found} for {Shifts} ({Report["Method"]})')
+        Reports[Case] = Report
+
+    return Reports
+
 #%%
 class Arguments():
 
@@ -49,14 +192,14 @@ def Main(Arguments):
     ResultsDir = Results / '02_Experiment' / Arguments.Sample
     os.makedirs(ResultsDir, exist_ok=True)
 
+    # V04 - Read data from binary cache (built at first reading)
     MTSFile = str(DataDir / '1_MTS' / 'AO_data_MTS.json')
-    with open(MTSFile) as File:
-        Data = json.load(File)
-    MTSData = pd.DataFrame(Data[Arguments.Sample])
+    MTSData = Read.MTS(MTSFile, Arguments.Sample, ['time', 'disp', 'force'])
     MTSData.columns = ['T', 'D', 'F'] # rename time displacement and force
 
+    Variable = 'TopPlate_Csys→AnatomicalCsys.'
     ARAMISFile = str(DataDir / '2_ARAMIS' / (Arguments.Sample + '.csv'))
-    ARAMISData = pd.read_csv(ARAMISFile, index_col=0, sep=';', header=1, parse_dates=['Time UTC'])
+    ARAMISData = Read.ARAMIS(ARAMISFile, Systems=Variable[:-1])
 
     # V03 - Drop nan data and re-index
     ARAMISData.dropna(inplace=True)
@@ -66,27 +209,29 @@ def Main(Arguments):
     # Preprocessing of ARAMIS data
     Time.Update(1/5, 'Preprocessing')
 
-    Variable = 'TopPlate_Csys→AnatomicalCsys.' 
     Z = Variable + 'LZ [mm]'
     ARAMISData['D'] = ARAMISData[Z][0] - ARAMISData[Z]
     ARAMISData['T'] = (ARAMISData['Time UTC'] - ARAMISData.loc[0,'Time UTC']).dt.total_seconds()
 
-    # Interpolate signal for regular sampling frequency and match MTS frequency
+    # Regular sampling matching MTS frequency
     Sampling = 1 / (MTSData.loc[1,'T'] - MTSData.loc[0,'T'])
     NPoints = int(round(ARAMISData['T'].max() * Sampling))
-    Time = np.linspace(0, (NPoints-1) / Sampling, NPoints)
-    Interpolated = np.interp(Time, ARAMISData['T'], ARAMISData['D'])
+    Regular = np.linspace(0, (NPoints-1) / Sampling, NPoints)
 
-    # Signals filtering
+    # V05 - Signals filtering, all channels of each device at once
     Time.Update(2/5, 'Filtering')
-    FilteredMTS = pd.DataFrame()
     CutOff = 2.5 # Cut-off frequency in Hz
-    FilteredMTS['D'] = Signal.Filter(MTSData['D'], Sampling, CutOff)
-    FilteredMTS['F'] = Signal.Filter(MTSData['F'], Sampling, CutOff)
+    Filtered = Signal.Filter(MTSData[['D', 'F']].values.T, Sampling, CutOff)
+    FilteredMTS = pd.DataFrame(Filtered.T, columns=['D', 'F'])
 
-    FilteredARAMIS = pd.DataFrame()
+    # Interpolate and filter displacement and relevant ARAMIS signals
+    Variables = ['LX [mm]', 'LY [mm]', 'LZ [mm]', 'Phi(X) [°]', 'Theta(Y) [°]', 'Psi(Z) [°]']
+    Channels = ARAMISData[['D'] + [Variable + V for V in Variables]].values.T
     CutOff = 1 # Cut-off frequency in Hz
-    FilteredARAMIS['D'] = Signal.Filter(Interpolated, Sampling, CutOff)
+    Conditioned = Signal.Condition(Regular, ARAMISData['T'], Channels, Sampling, CutOff)
+
+    FilteredARAMIS = pd.DataFrame()
+    FilteredARAMIS['D'] = Conditioned[0]
 
     # Trunkate ARAMIS signal for non-sense positive displacement
     Last = FilteredARAMIS[FilteredARAMIS['D'] < 0].index[-1]
@@ -94,54 +239,28 @@ def Main(Arguments):
     if Last > 0:
         FilteredARAMIS = FilteredARAMIS.iloc[:Last]
 
-    # Peaks detection (use prominence for stability)
+    # V06 - Signals alignment by cross-correlation of each protocol
     Time.Update(3/5, 'Signals alignment')
 
-    # V02 - Adapt prominence to match empirical criteria for peak detection
-    Prominence = 0.02
-    
-    ARAMISPeaks, Properties = sig.find_peaks(-FilteredARAMIS['D'], prominence=Prominence)
-    TruePeaks = ARAMISPeaks[FilteredARAMIS['D'][ARAMISPeaks] < 0.9*FilteredARAMIS['D'][ARAMISPeaks].min()]
-    
-    i = 0
-    Decrease = 0.05 * Prominence
-    if len(ARAMISPeaks) < 9:
-        while len(ARAMISPeaks) < 9 or sum(ARAMISPeaks < 18000) < 5:
-            P = Prominence - i*Decrease
-            ARAMISPeaks, Properties = sig.find_peaks(-FilteredARAMIS['D'], prominence=P)
-            i += 1
-
-    if len(ARAMISPeaks) > 9:
-        C1 = ARAMISPeaks[ARAMISPeaks < 18000][-5:]
-        ARAMISPeaks = np.concatenate([C1, TruePeaks])
-
-    MTSPeaks, Properties = sig.find_peaks(-FilteredMTS['D'], prominence=0.02)
-    i = 0
-    Decrease = 0.05 * Prominence
-    while len(MTSPeaks) < 9:
-        P = Prominence - i*Decrease
-        MTSPeaks, Properties = sig.find_peaks(-FilteredMTS['D'], prominence=P)
-        i += 1
-
-    if len(MTSPeaks) > 9:
-        MTSPeaks = np.concatenate([MTSPeaks[:5], MTSPeaks[-4:]])
-
-    # Show.Signal([np.arange(len(FilteredMTS))], [FilteredMTS['D']], [MTSPeaks])
-    # Show.Signal([np.arange(len(FilteredARAMIS))], [FilteredARAMIS['D']], [ARAMISPeaks])
+    # Artificial junction in MTS data (time reset)
+    Junction = Signal.TimeBase(MTSData['T'])[1][0]
 
-    # Signals alignment of protocol 1
-    Protocol1_Shift = int(round(np.mean(ARAMISPeaks[:5] - MTSPeaks[:5])))
-    Time_Shifted = Time[Protocol1_Shift:] - Time[Protocol1_Shift]
+    Shifts, Report = AlignSignals(FilteredMTS['D'].values, FilteredARAMIS['D'].values, Junction)
+    with open(str(ResultsDir / 'Alignment.json'), 'w') as File:
+        json.dump(Report, File, indent=2)
 
-    # Artificial junction in MTS data
-    Junction = sig.find_peaks(MTSData['T'])[0][0]
+    # Signals alignment of protocol 1 (sub-sample shift)
+    Protocol1_Shift = int(round(Shifts[0]))
+    Shifted = Regular + Shifts[0] / Sampling
+    Shifted = Shifted[Shifted <= Regular[-1]]
+    Time_Shifted = Regular[:len(Shifted)]
 
     # Artificial data points to compensate shift
     LinkD = [FilteredMTS.loc[Junction, 'D'], FilteredMTS.loc[Junction+1, 'D']]
     LinkF = [FilteredMTS.loc[Junction, 'F'], FilteredMTS.loc[Junction+1, 'F']]
 
     # Signals alignment for protocol 2
-    Protocol2_Shift = int(round(np.mean(ARAMISPeaks[6:] - MTSPeaks[6:])))
+    Protocol2_Shift = int(round(Shifts[1]))
     Protocol2_Shift -= Protocol1_Shift
 
     NewForces = np.linspace(LinkF[0], LinkF[1], Protocol2_Shift+1)
@@ -159,19 +278,16 @@ def Main(Arguments):
 
     Time.Update(4/5)
 
-    # Interpolate and filter relevant signals and store in dataframe
-    Variables = ['LX [mm]', 'LY [mm]', 'LZ [mm]', 'Phi(X) [°]', 'Theta(Y) [°]', 'Psi(Z) [°]']
-
+    # Store relevant signals shifted by protocol 1 alignment in dataframe
     Matched = pd.DataFrame({'T':Time_Shifted})
+    ShiftedData = Signal.Interpolate(Shifted, Regular, Conditioned[1:])
     for iV, V in enumerate(Variables):
-        Data2Interpolate = ARAMISData[Variable + V]
-        Interpolated = np.interp(Time, ARAMISData['T'], Data2Interpolate)
-        NewData = Signal.Filter(Interpolated, Sampling, CutOff)
+        NewData = ShiftedData[iV]
 
         if iV < 3:
-            Matched[V[1]] = NewData[Protocol1_Shift:] - NewData[Protocol1_Shift]
+            Matched[V[1]] = NewData - NewData[0]
         else:
-            Matched[V[:-7]] = NewData[Protocol1_Shift:] - NewData[Protocol1_Shift]
+            Matched[V[:-7]] = NewData - NewData[0]
 
     # Add force data and write csv
     MissingPoints = len(Matched) - len(Forces)
@@ -192,7 +308,7 @@ def Main(Arguments):
 
     Time.Process(0, Text)
 
-    return
+    return Matched
 
 
 #%% Execution part
@@ -206,12 +322,18 @@ if __name__ == '__main__':
     # Add long and short argument
     SV = Parser.prog + ' version ' + Version
     Parser.add_argument('-V', '--Version', help='Show script version', action='version', version=SV)
-    Parser.add_argument('Sample', help='Sample to process (required)', type=str)
+    Parser.add_argument('Sample', help='Sample to process (required unless --Check)', type=str, nargs='?')
 
     # Add defaults arguments
     Parser.add_argument('-F', '--Folder', help='Root folder name', type=str, default='FRACTIB')
+    Parser.add_argument('-C', '--Check', help='Check alignment on synthetic signals', action='store_true')
 
     # Read arguments from the command line
     Arguments = Parser.parse_args()
 
-    Main(Arguments)
\ No newline at end of file
+    if Arguments.Check:
+        CheckAlignment()
+    elif Arguments.Sample:
+        Main(Arguments)
+    else:
+        Parser.error('Sample is required')
\ No newline at end of file
@@ -0,0 +1,252 @@
+#%% #!/usr/bin/env python3
+# Initialization
+
+Version = '01'
+
+Description = """
+    Script used to run the morphometric analyses of all samples in
+    parallel. Each (image, mask, ROI, analysis) job is run on a pool
+    of processes and results are stored in a single tidy Parquet table
+    together with their provenance (input hash, parameters, timing).
+    Only jobs whose inputs or parameters changed are recomputed.
+
+    Version Control:
+        01 - Original script
+
+    Author: Mathieu Simon
+            ARTORG Center for Biomedical Engineering Research
+            SITEM Insel, University of Bern
+
+    Date: October 2026
+    """
+
+#%% Imports
+# Modules import
+
+import json
+import argparse
+
+from Utils import *
+
+Read.Echo = False
+Morphometry.Echo = False
+
+#%% Functions
+# Define functions
+
+def FileHash(File, Digests):
+
+    """
+    Hash of the content of an input file, computed once per
+    file and kept in Digests (indexed by file path)
+    """
+
+    File = str(File)
+    if File not in Digests:
+        Hash = hashlib.sha1()
+        with open(File, 'rb') as F:
+            for Chunk in iter(lambda: F.read(2**24), b''):
+                Hash.update(Chunk)
+        Digests[File] = Hash.hexdigest()
+
+    return Digests[File]
+
+def JobHash(Files, Extra, Digests):
+
+    """
+    Hash of the input files digests and of additional
+    information (e.g. ROI and parameters) used as job provenance
+    """
+
+    Hash = hashlib.sha1(Extra.encode())
+    for File in Files:
+        Hash.update(FileHash(File, Digests).encode())
+
+    return Hash.hexdigest()
+
+def BuildJobs(SampleList, DataDir, Analyses, nROIs, Parameters):
+
+    """
+    List the (image, mask, ROI, analysis) jobs of all samples
+    ROIs are consecutive sub-volumes along Z (nROIs per sample)
+    :return Jobs: Dictionary of jobs description indexed by job name
+    """
+
+    Jobs = {}
+    Digests = {}
+    for iS, Sample in enumerate(SampleList['Internal ID']):
+
+        FilePath = DataDir / Sample
+        FileNumber = SampleList.loc[iS, 'MicroCT pretest file number']
+        FileName = 'C000' + str(FileNumber) + '_DOWNSCALED'
+
+        for Analysis in Analyses:
+
+            if Analysis == 'Cortical':
+                Image = FilePath / (FileName + '_CORT_MASK.AIM')
+                Mask = None
+            else:
+                Image = FilePath / (FileName + '_SEG.AIM')
+                Mask = FilePath / (FileName + '_TRAB_MASK.AIM')
+
+            Files = [F for F in [Image, Mask] if F]
+            for ROI in range(nROIs):
+                Name = '_'.join([Sample, Analysis, str(ROI)])
+                Extra = json.dumps([Analysis, ROI, nROIs, Parameters, Version])
+                Jobs[Name] = {'Sample':Sample,
+                              'Analysis':Analysis,
+                              'ROI':ROI,
+                              'nROIs':nROIs,
+                              'Image':str(Image),
+                              'Mask':str(Mask) if Mask else None,
+                              'Hash':JobHash(Files, Extra, Digests)}
+
+    return Jobs
+
+def CropROI(Image, ROI, nROIs):
+
+    """
+    Extract the ROI-th of nROIs consecutive sub-volumes along Z
+    """
+
+    Size = Image.GetSize()
+    Limits = np.linspace(0, Size[2], nROIs+1).astype(int)
+    Start, Stop = Limits[ROI], Limits[ROI+1]
+
+    return Image[:, :, int(Start):int(Stop)]
+
+def AnalyseJob(Name, Arguments):
+
+    """
+    Run one morphometric analysis and write its tidy results
+    (one row per metric) with provenance into StoreDir/Name.parquet
+    """
+
+    Jobs, Parameters, StoreDir = Arguments
+    Job = Jobs[Name]
+
+    Tic = time.time()
+    Image = Read.AIM(Job['Image'])[0]
+    Image = CropROI(Image, Job['ROI'], Job['nROIs'])
+    Array = sitk.GetArrayFromImage(Image)
+
+    if Job['Mask']:
+        Mask = Read.AIM(Job['Mask'])[0]
+        Mask = CropROI(Mask, Job['ROI'], Job['nROIs'])
+        Mask = sitk.Cast((Mask > 0) * 255, sitk.sitkUInt8)
+        Mask.CopyInformation(Image)
+
+    if Job['Analysis'] == 'Cortical':
+        Bin = sitk.GetImageFromArray(((Array == 127) * 255).astype('uint8'))
+        Bin.CopyInformation(Image)
+        Data = Morphometry.Cortical(Bin, Method=Parameters['Thickness'], Processes=1)
+
+    elif Job['Analysis'] == 'Trabecular':
+        Bin = sitk.GetImageFromArray(((Array == 1) * 255).astype('uint8'))
+        Bin.CopyInformation(Image)
+        Data = Morphometry.Trabecular(Bin, Mask, DA=False, Backend=Parameters['Backend'])
+
+    elif Job['Analysis'] == 'MIL':
+        Bin = sitk.GetImageFromArray(((Array == 1) * 255).astype('uint8'))
+        Bin.CopyInformation(Image)
+        Values, Vectors = Morphometry.MIL(sitk.Mask(Bin, Mask), Power=Parameters['Power'])
+        Values = np.sort(np.real(Values))[::-1]
+        Data = pd.DataFrame({'m1 (-)':Values[0], 'm2 (-)':Values[1], 'm3 (-)':Values[2],
+                             'DA (-)':Values[0] / Values[2]}, index=[0])
+
+    # Tidy results with provenance
+    Results = pd.DataFrame({'Name':Name,
+                            'Sample':Job['Sample'],
+                            'Analysis':Job['Analysis'],
+                            'ROI':Job['ROI'],
+                            'Metric':Data.columns,
+                            'Value':Data.loc[0].values.astype(float)})
+    Results['Hash'] = Job['Hash']
+    Results['Parameters'] = json.dumps(Parameters)
+    Results['Version'] = Version
+    Results['Time'] = round(time.time() - Tic, 1)
+    Results['Date'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    Results.to_parquet(str(Path(StoreDir) / (Name + '.parquet')), index=False)
+
+    return
+
+#%% Main
+# Main code
+
+def Main(Arguments):
+
+    # Set directories and read sample list
+    WD, DD, SD, RD = SetDirectories('FRACTIB')
+    SampleList = pd.read_csv(str(DD / 'SampleList.csv'))
+    if Arguments.Samples:
+        SampleList = SampleList[SampleList['Internal ID'].isin(Arguments.Samples)]
+        SampleList = SampleList.reset_index(drop=True)
+
+    ResultsDir = RD / '01_Morphometry'
+    StoreDir = ResultsDir / 'Batch'
+    StoreFile = ResultsDir / 'Morphometry.parquet'
+
+    # Describe jobs and their provenance
+    Parameters = {'Thickness':Arguments.Thickness,
+                  'Backend':Arguments.Backend,
+                  'Power':Arguments.Power}
+    Jobs = BuildJobs(SampleList, DD / '02_uCT', Arguments.Analyses, Arguments.ROIs, Parameters)
+
+    # Keep stored results whose inputs and parameters did not change
+    if StoreFile.exists() and not Arguments.Restart:
+        Store = pd.read_parquet(str(StoreFile))
+        Done = set(zip(Store['Name'], Store['Hash']))
+    else:
+        Store = pd.DataFrame()
+        Done = set()
+    Names = [N for N in Jobs if (N, Jobs[N]['Hash']) not in Done]
+    print(f'\n{len(Jobs) - len(Names)} job(s) up to date, {len(Names)} to compute')
+
+    # Run analyses in parallel
+    Batch.Threads = Arguments.Threads
+    Batch.Processes = Arguments.Processes
+    Report = Batch.Run(AnalyseJob, Names, (Jobs, Parameters, StoreDir), StoreDir, Resume=False)
+
+    # Update store with the new results
+    New = [pd.read_parquet(str(StoreDir / (N + '.parquet')))
+           for N in Report[Report['Status'] == 'Done']['Name']] if len(Names) > 0 else []
+    if len(Store) > 0:
+        Store = Store[~Store['Name'].isin(Names)]
+    Store = pd.concat([Store] + New, ignore_index=True)
+    Store.to_parquet(str(StoreFile), index=False)
+
+    # Summary table, one row per sample and ROI
+    if len(Store) > 0:
+        Table = Store.pivot_table(index=['Sample', 'ROI'], columns='Metric', values='Value')
+        print(Table.groupby(level='Sample').mean())
+
+    return
+
+#%% Execution part
+# Execution as main
+if __name__ == '__main__':
+
+    # Initiate the parser with a description
+    FC = argparse.RawDescriptionHelpFormatter
+    Parser = argparse.ArgumentParser(description=Description, formatter_class=FC)
+
+    # Add long and short argument
+    SV = Parser.prog + ' version ' + Version
+    Parser.add_argument('-V', '--Version', help='Show script version', action='version', version=SV)
+
+    # Add defaults arguments
+    Parser.add_argument('Samples', help='Samples to analyse (default all)', type=str, nargs='*')
+    Parser.add_argument('-A', '--Analyses', help='Analyses to run', type=str, nargs='+',
+                        default=['Trabecular', 'Cortical', 'MIL'])
+    Parser.add_argument('-R', '--ROIs', help='Number of ROIs along Z per sample', type=int, default=1)
+    Parser.add_argument('-T', '--Thickness', help='Cortical thickness method (2D or 3D)', type=str, default='2D')
+    Parser.add_argument('-B', '--Backend', help='Trabecular backend (PyPore3D or Native)', type=str, default='Native')
+    Parser.add_argument('-P', '--Power', help='Sphere power for MIL directions', type=int, default=2)
+    Parser.add_argument('-N', '--Threads', help='Number of threads per job', type=int, default=2)
+    Parser.add_argument('--Processes', help='Number of jobs in parallel (default cores/threads)', type=int, default=None)
+    Parser.add_argument('--Restart', help='Recompute all jobs', action='store_true')
+
+    # Read arguments from the command line
+    Arguments = Parser.parse_args()
+
+    Main(Arguments)
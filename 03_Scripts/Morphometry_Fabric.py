@@ -0,0 +1,114 @@
+#%% #!/usr/bin/env python3
+# Initialization
+
+Version = '01'
+
+Description = """
+    Script used to compare the fabric obtained by mean intercept
+    length (MIL) and by gradient structure tensor (GST) in terms
+    of degree of anisotropy, main direction and computation time
+
+    Version Control:
+        01 - Original script
+
+    Author: Mathieu Simon
+            ARTORG Center for Biomedical Engineering Research
+            SITEM Insel, University of Bern
+
+    Date: October 2026
+    """
+
+#%% Imports
+# Modules import
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+from Utils import SetDirectories, Show, Time, Read, Morphometry
+
+Read.Echo = False
+Morphometry.Echo = False
+Show.ShowPlot = False
+
+#%% Main
+# Main code
+
+def Main(Arguments):
+
+    # Set directories and read sample list
+    WD, DD, SD, RD = SetDirectories('FRACTIB')
+    SampleList = pd.read_csv(str(DD / 'SampleList.csv'))
+
+    Columns = ['DA MIL (-)', 'DA GST (-)', 'Time MIL (s)', 'Time GST (s)', 'Angle (deg)']
+    Data = pd.DataFrame(index=SampleList['Internal ID'], columns=Columns)
+
+    for iS, Sample in enumerate(SampleList['Internal ID']):
+
+        Time.Process(1, Sample)
+
+        # Read segmented image and trabecular mask
+        FilePath = DD / '02_uCT' / Sample
+        FileNumber = SampleList.loc[iS, 'MicroCT pretest file number']
+        FileName = 'C000' + str(FileNumber) + '_DOWNSCALED'
+        Seg = Read.AIM(str(FilePath / (FileName + '_SEG.AIM')))[0]
+        Trab = Read.AIM(str(FilePath / (FileName + '_TRAB_MASK.AIM')))[0]
+
+        Bin = sitk.Cast((Seg == 1) * 255, sitk.sitkUInt8)
+        Mask = sitk.Cast((Trab > 0) * 255, sitk.sitkUInt8)
+
+        # Mean intercept length
+        Time.Update(1/3, 'MIL')
+        Tic = time.time()
+        MILValues, MILVectors = Morphometry.MIL(sitk.Mask(Bin, Mask), Power=Arguments.Power)
+        Data.loc[Sample, 'Time MIL (s)'] = time.time() - Tic
+        Data.loc[Sample, 'DA MIL (-)'] = max(MILValues) / min(MILValues)
+
+        # Gradient structure tensor
+        Time.Update(2/3, 'GST')
+        Tic = time.time()
+        GST = Morphometry.GST(Bin, Sigma=Arguments.Sigma, Mask=Mask)
+        GSTValues, GSTVectors = Morphometry.GSTFabric(GST)
+        Data.loc[Sample, 'Time GST (s)'] = time.time() - Tic
+        Data.loc[Sample, 'DA GST (-)'] = max(GSTValues) / min(GSTValues)
+
+        # Angle between main fabric directions
+        MILMain = np.real(MILVectors[:, np.argmax(MILValues)])
+        GSTMain = GSTVectors[:, np.argmax(GSTValues)]
+        Cos = min(abs(np.dot(MILMain, GSTMain)), 1.0)
+        Data.loc[Sample, 'Angle (deg)'] = np.degrees(np.arccos(Cos))
+
+        Time.Process(0, Sample)
+
+    Data.to_csv(str(RD / 'Fabric.csv'))
+
+    # Compare degrees of anisotropy and timing
+    Show.FName = str(RD / 'Fabric_DA')
+    Show.OLS(Data['DA MIL (-)'].astype(float), Data['DA GST (-)'].astype(float), Labels=['DA MIL (-)', 'DA GST (-)'])
+    Show.FName = None
+
+    print(Data[['Time MIL (s)', 'Time GST (s)', 'Angle (deg)']].astype(float).describe())
+
+    return
+
+#%% Execution part
+# Execution as main
+if __name__ == '__main__':
+
+    # Initiate the parser with a description
+    FC = argparse.RawDescriptionHelpFormatter
+    Parser = argparse.ArgumentParser(description=Description, formatter_class=FC)
+
+    # Add long and short argument
+    SV = Parser.prog + ' version ' + Version
+    Parser.add_argument('-V', '--Version', help='Show script version', action='version', version=SV)
+
+    # Add defaults arguments
+    Parser.add_argument('-P', '--Power', help='Sphere power for MIL directions', type=int, default=2)
+    Parser.add_argument('-S', '--Sigma', help='GST Gaussian derivatives scale (voxels)', type=float, default=1.0)
+
+    # Read arguments from the command line
+    Arguments = Parser.parse_args()
+
+    Main(Arguments)
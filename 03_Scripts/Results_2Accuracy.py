@@ -27,6 +27,7 @@ from Utils import *
 Show.ShowPlot = False
 Read.Echo = False
 Write.Echo = False
+Histogram.Echo = False
 from skimage import morphology
 
 #%% Functions
@@ -222,19 +223,9 @@ def Main():
         Time.Update(1/6,'Compute Dice')
         Reg = sitk.ReadImage(str(RegDir / Sample / 'NonRigid.mhd'))
         Org = sitk.ReadImage(str(RegDir / Sample / 'Rigid.mhd'))
-        Otsu = sitk.OtsuMultipleThresholdsImageFilter()
-        Otsu.SetNumberOfThresholds(2)
-        BinReg = Otsu.Execute(Reg)
-        BinOrg = Otsu.Execute(Org)
-        BinIm = Otsu.Execute(PreI)
-
-        Binary = sitk.BinaryThresholdImageFilter()
-        Binary.SetUpperThreshold(1.5)
-        Binary.SetInsideValue(0)
-        Binary.SetOutsideValue(1)
-        BinReg = Binary.Execute(BinReg)
-        BinOrg = Binary.Execute(BinOrg)
-        BinIm = Binary.Execute(BinIm)
+        BinReg = Histogram.Binarize(Reg, 2)
+        BinOrg = Histogram.Binarize(Org, 2)
+        BinIm = Histogram.Binarize(PreI, 2)
 
         Measure = sitk.LabelOverlapMeasuresImageFilter()
         Measure.Execute(BinIm, BinOrg)
@@ -265,15 +256,9 @@ def Main():
         elif Delta[2] > 0:
             Dice = np.pad(Dice, ((0, 0), (0, 0), (bDelta[2], aDelta[2])), 'reflect')
         
-        Shape = (BVTV.shape[0], BVTV.shape[1], BVTV.shape[2], CF, CF, CF)
-        Convolve = np.ones(Shape) / CF**3
-
-        for i in range(BVTV.shape[0]):
-            for j in range(BVTV.shape[1]):
-                for k in range(BVTV.shape[2]):
-                    Convolve[i,j,k] = Convolve[i,j,k] * Dice[i*CF:(i+1)*CF,j*CF:(j+1)*CF,k*CF:(k+1)*CF]
-
-        Convolve = np.sum(Convolve, axis=(-1,-2,-3))
+        # Mean Dice value of each element block
+        Convolve = BlockReduce(Dice, CF, 'mean', SlabSize=8)
+        Convolve = Convolve[:BVTV.shape[0], :BVTV.shape[1], :BVTV.shape[2]]
         ImageConv = sitk.GetImageFromArray(Convolve)
         ImageConv.SetSpacing(Spacing)
         ImageConv.SetOrigin(Origin)
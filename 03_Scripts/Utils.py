@@ -24,28 +24,40 @@ Description = """
 import os
 import vtk
 import time
+import json
+import numba
+import shutil
 import struct
+import inspect
+import hashlib
+import functools
 import argparse
+import tempfile
+import traceback
 import numpy as np
 import sympy as sp
 import pandas as pd
-from numba import njit
+from numba import njit, prange
 import SimpleITK as sitk
 from pathlib import Path
 import scipy.signal as sig
-from numba.core import types
+import scipy.ndimage as ndi
 import matplotlib.pyplot as plt
-from multiprocessing import Pool
-from numba.typed import Dict, List
+from multiprocessing import Pool, current_process
 import statsmodels.formula.api as smf
 from skimage import measure, morphology
 from matplotlib.colors import ListedColormap
 from scipy.stats.distributions import t, norm
-from vtk.util.numpy_support import vtk_to_numpy # type: ignore
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, numpy_to_vtkIdTypeArray # type: ignore
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from pypore3d.p3dSITKPy import py_p3dReadRaw8 as ReadRaw8
 from pypore3d.p3dBlobPy import py_p3dMorphometricAnalysis as MA
 
+if os.name == 'posix':
+    import resource
+elif os.name == 'nt':
+    import psutil
+
 
 
 #%% Tuning
@@ -76,93 +88,29 @@ def SetDirectories(Name):
 
 def GetSlice(Image, Slice=None, Axis='Z', Slice2D=True):
 
-    # Get image attributes
-    Size = Image.GetSize()
-    Spacing = np.array(Image.GetSpacing())
-    Origin = np.array(Image.GetOrigin())
-    Direction = np.array(Image.GetDirection()).reshape((3,3))
+    """
+    Extract a plane (index or middle plane if None) or a range of
+    planes ([Start, Stop]) of a 3D image along Axis using sitk.Extract,
+    only the extracted voxels are copied
+    :param Slice2D: Return single planes as 2D images
+    """
+
+    iAxis = 'XYZ'.index(Axis)
+    Size = list(Image.GetSize())
+    Index = [0, 0, 0]
 
     if type(Slice) == list:
         Start, Stop = Slice
-
-        if Axis == 'Z':
-            Sliced = sitk.Slice(Image, (0, 0, Start), (Size[0], Size[1], Stop))
-        elif Axis == 'Y':
-            Sliced = sitk.Slice(Image, (0, Start, 0), (Size[0], Stop, Size[2]))
-        elif Axis == 'X':
-            Sliced = sitk.Slice(Image, (Start, 0, 0), (Stop, Size[1], Size[2]))
-
-    elif type(Slice) == int:
-
-        if Axis == 'Z':
-            Sliced = sitk.Slice(Image, (0, 0, Slice), (Size[0], Size[1], Slice+1))
-
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[0]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[:2])
-                Sliced2D.SetSpacing(Spacing[:2])
-                Sliced2D.SetDirection(Direction[:2,:2].flatten())
-
-        elif Axis == 'Y':
-            Sliced = sitk.Slice(Image, (0, Slice, 0), (Size[0], Slice+1, Size[2]))
-
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[1]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[::2])
-                Sliced2D.SetSpacing(Spacing[::2])
-                Sliced2D.SetDirection(Direction[::2,::2].flatten())
-
-        elif Axis == 'X':
-            Sliced = sitk.Slice(Image, (Slice, 0, 0), (Slice+1, Size[1], Size[2]))
-
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[2]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[1:])
-                Sliced2D.SetSpacing(Spacing[1:])
-                Sliced2D.SetDirection(Direction[1:,1:].flatten())
+        Index[iAxis] = int(Start)
+        Size[iAxis] = int(Stop) - int(Start)
 
     else:
+        if Slice is None:
+            Slice = Size[iAxis] // 2
+        Index[iAxis] = int(Slice)
+        Size[iAxis] = 0 if Slice2D else 1
 
-        if Axis == 'Z':
-            Sliced = sitk.Slice(Image, (0, 0, int(Size[2]/2)), (Size[0], Size[1], int(Size[2]/2)+1))
-        
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[2]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[:2])
-                Sliced2D.SetSpacing(Spacing[:2])
-                Sliced2D.SetDirection(Direction[:2,:2].flatten())
-
-
-        elif Axis == 'Y':
-            Sliced = sitk.Slice(Image, (0, int(Size[1]/2), 0), (Size[0], int(Size[1]/2)+1, Size[2]))
-        
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[1]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[::2])
-                Sliced2D.SetSpacing(Spacing[::2])
-                Sliced2D.SetDirection(Direction[::2,::2].flatten())
-
-
-        elif Axis == 'X':
-            Sliced = sitk.Slice(Image, (int(Size[0]/2), 0, 0), (int(Size[0]/2)+1, Size[1], Size[2]))
-
-            if Slice2D:
-                Array = sitk.GetArrayFromImage(Sliced)[2]
-                Sliced2D = sitk.GetImageFromArray(Array)
-                Sliced2D.SetOrigin(Origin[1:])
-                Sliced2D.SetSpacing(Spacing[1:])
-                Sliced2D.SetDirection(Direction[1:,1:].flatten())
-
-
-    if Sliced2D:
-        Sliced = Sliced2D
-        
-    return Sliced
+    return sitk.Extract(Image, Size, Index)
 
 def RotationMatrix(Phi=0.0, Theta=0.0, Psi=0.0, V=np.zeros(3), A=0):
 
@@ -321,6 +269,56 @@ def Resample(Image, Factor=None, Size=[None], Spacing=[None], Order=0):
     Resampled = sitk.Resample(Image, NewImage, Transform, Order+1)
     
     return Resampled
+def BlockReduce(Array, Factor, Function='mean', SlabSize=None, Pad=None):
+
+    """
+    Reduce an array by non-overlapping blocks (e.g. voxels to elements)
+    The array is viewed as (Z,CF,Y,CF,X,CF) and reduced over the block axes
+    :param Array: 2D or 3D numpy array
+    :param Factor: Block size, single integer or one per array axis
+    :param Function: Reduction function, 'mean', 'sum', 'max' or 'min'
+    :param SlabSize: Number of blocks along first axis reduced at once
+                     to limit temporary memory (None for all)
+    :param Pad: None to crop voxels not filling a complete block
+                or numpy pad mode ('constant', 'edge', ...) to complete them
+    :return Reduced: Reduced array
+    """
+
+    Functions = {'mean':np.mean, 'sum':np.sum, 'max':np.max, 'min':np.min}
+    Reduce = Functions[Function]
+
+    Factor = np.broadcast_to(np.array(Factor, int), Array.ndim)
+    Remainder = np.array(Array.shape) % Factor
+    if Pad and Remainder.any():
+        Width = [(0, (F - R) % F) for F, R in zip(Factor, Remainder)]
+        Array = np.pad(Array, Width, Pad)
+
+    # Crop incomplete blocks
+    Shape = np.array(Array.shape) // Factor
+    Array = Array[tuple([slice(0, S*F) for S, F in zip(Shape, Factor)])]
+    BlockShape = np.stack([Shape, Factor], axis=1).ravel()
+    Axes = tuple(range(1, 2*Array.ndim, 2))
+
+    # Output type, avoid overflow of integer sums
+    if Function == 'mean':
+        DType = float
+    elif Function == 'sum' and not np.issubdtype(Array.dtype, np.floating):
+        DType = np.int64
+    else:
+        DType = Array.dtype
+    Kwargs = {'dtype':DType} if Function in ['mean', 'sum'] else {}
+
+    if not SlabSize:
+        SlabSize = max(Shape[0], 1)
+
+    Reduced = np.zeros(Shape, DType)
+    for Start in range(0, Shape[0], SlabSize):
+        Stop = min(Start + SlabSize, Shape[0])
+        Slab = Array[Start*Factor[0]:Stop*Factor[0]]
+        BlockShape[0] = Stop - Start
+        Reduced[Start:Stop] = Reduce(Slab.reshape(BlockShape), axis=Axes, **Kwargs)
+
+    return Reduced
 
 
 #%% Time functions
@@ -403,12 +401,129 @@ class Time():
 
 Time = Time()
 #%% Ploting functions
+def Renderable(Method):
+
+    """
+    Decorator deferring a Show method to the rendering workers
+    when Show.Async is set and the figure is written to a file
+    (self.FName, or the FName argument of methods having one)
+    """
+
+    Signature = inspect.signature(Method)
+
+    @functools.wraps(Method)
+    def Wrapper(self, *Args, **Kwargs):
+        if 'FName' in Signature.parameters:
+            FName = Signature.bind(self, *Args, **Kwargs).arguments.get('FName')
+        else:
+            FName = self.FName
+        if self.Async and FName and not self.ShowPlot:
+            return Render.Submit(Method.__name__, FName, *Args, **Kwargs)
+        return Method(self, *Args, **Kwargs)
+
+    return Wrapper
+
+def RenderInitializer(Settings):
+
+    """
+    Initialize a rendering worker: headless Agg backend, no display,
+    figures and axes kept between jobs and Show settings of the parent
+    """
+
+    plt.switch_backend('Agg')
+    for Key, Value in Settings.items():
+        setattr(Show, Key, Value)
+    Show.Async = False
+    Show.ShowPlot = False
+    Show.Reuse = True
+
+    return
+
+def RenderWorker(Job):
+
+    """
+    Render a single figure job and write it to file(s)
+    :param Job: Tuple (Method, FName, Args, Kwargs)
+    :return Status: Dictionary with file name, status and time
+    """
+
+    Method, FName, Args, Kwargs = Job
+
+    Status = {'FName':FName, 'Method':Method}
+    Tic = time.time()
+    try:
+        Show.FName = FName
+        getattr(Show, Method)(*Args, **Kwargs)
+        Status['Status'] = 'Done'
+    except Exception:
+        Status['Status'] = 'Failed'
+        Status['Error'] = traceback.format_exc()
+    Status['Time'] = round(time.time() - Tic, 2)
+
+    return Status
+
 class Show():
 
     def __init__(self):
         self.FName = None
         self.ShowPlot = True
         self.IRange = [0.8, 1.2]
+        self.Formats = ['png']
+        self.Async = False
+        self.Reuse = False
+        self.Figures = {}
+
+    def Subplots(self, *Args, **Kwargs):
+
+        """
+        Create figure and axes as plt.subplots, or reuse the figure created
+        with the same size if self.Reuse (e.g. in rendering workers)
+        The reused figure is cleared (axes, colorbars, texts) and its
+        layout reset before creating the axes
+        """
+
+        if not self.Reuse:
+            return plt.subplots(*Args, **Kwargs)
+
+        # Figure level arguments identify the reused figure
+        FigureKeys = ['figsize', 'dpi', 'facecolor', 'edgecolor', 'frameon', 'layout']
+        FigureKwargs = {K: Kwargs.pop(K) for K in FigureKeys if K in Kwargs}
+        Key = repr(sorted(FigureKwargs.items()))
+
+        if Key not in self.Figures:
+            self.Figures[Key] = plt.figure(**FigureKwargs)
+        Figure = self.Figures[Key]
+
+        Figure.clf()
+        Parameters = ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']
+        Figure.subplots_adjust(**{P: plt.rcParams['figure.subplot.' + P] for P in Parameters})
+        plt.figure(Figure.number)
+        Axes = Figure.subplots(*Args, **Kwargs)
+
+        return Figure, Axes
+
+    def Close(self, Figure, FName, Pad=0.02):
+
+        """
+        Write figure into FName, in each of self.Formats if FName
+        has no known extension, then show or close it
+        """
+
+        if (FName):
+            Root, Extension = os.path.splitext(str(FName))
+            if Extension[1:].lower() in Figure.canvas.get_supported_filetypes():
+                Files = [str(FName)]
+            else:
+                Files = [str(FName) + '.' + F for F in self.Formats]
+            for File in Files:
+                Figure.savefig(File, bbox_inches='tight', pad_inches=Pad)
+
+        if self.ShowPlot:
+            plt.show()
+        elif not self.Reuse:
+            plt.close(Figure)
+
+        return
 
     def Normalize(self, Array, uint=False):
 
@@ -421,7 +536,8 @@ class Show():
 
         return N_Array
 
-    def ROI3D(self, Image, Color=None, Title=None, Angles=[30, 45, 15]):
+    @Renderable
+    def ROI3D(self, Image, Color=None, Title=None, Angles=[30, 45, 15], FName=None):
 
         Array = sitk.GetArrayFromImage(Image)
 
@@ -433,8 +549,7 @@ class Show():
         # Get x, y, z coordinate
         Z, Y, X = np.where(Array)
 
-        Figure = plt.figure(figsize=(5.5, 4))
-        Axis = Figure.add_subplot(111, projection='3d')
+        Figure, Axis = self.Subplots(figsize=(5.5, 4), subplot_kw={'projection':'3d'})
         
         # scaling hack
         Bbox_min = np.min([X, Y, Z])
@@ -463,175 +578,70 @@ class Show():
         # Rotate plot
         Axis.view_init(elev=Angles[0], azim=Angles[1])
 
-        plt.show()
+        self.Close(Figure, FName)
 
+    @Renderable
     def Slice(self, Image, Slice=None, Title=None, Axis='Z'):
 
-        try:
-            Array = sitk.GetArrayFromImage(Image)
-            Dimension = Image.GetDimension()
-        except:
-            Array = Image
-            Dimension = len(Array.shape)
-
-        if Dimension == 3:
-            
-            if Axis == 'Z':
-                if Slice:
-                    Array = Array[Slice,:,:]
-                else:
-                    Array = Array[Array.shape[0]//2,:,:]
-            if Axis == 'Y':
-                if Slice:
-                    Array = Array[:,Slice,:]
-                else:
-                    Array = Array[:,Array.shape[1]//2,:]
-            if Axis == 'X':
-                if Slice:
-                    Array = Array[:,:,Slice]
-                else:
-                    Array = Array[:,:,Array.shape[2]//2]
+        Array = Slicer.Extract(Image, Slice, Axis)
 
-        Figure, Axis = plt.subplots()
+        Figure, Axis = self.Subplots()
         Axis.imshow(Array,interpolation=None, cmap='binary_r')
         Axis.axis('Off')
         
         if (Title):
             Axis.set_title(Title)
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0)
-
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName, Pad=0)
 
         return
 
+    @Renderable
     def Overlay(self, Fixed, Moving, Slice=None, Title=None, Axis='Z', AsBinary=False):
 
-        FixedArray = sitk.GetArrayFromImage(Fixed)
-        MovingArray = sitk.GetArrayFromImage(Moving)
-
-        if AsBinary:
-            Otsu = sitk.OtsuMultipleThresholdsImageFilter()
-            Otsu.SetNumberOfThresholds(2)
-            
-            if len(np.unique(FixedArray)) > 2:
-                Fixed_Bin = Otsu.Execute(Fixed)
-                FixedArray = sitk.GetArrayFromImage(Fixed_Bin)
-                FixedArray = (FixedArray == 2) * 1
-            
-            if len(np.unique(MovingArray)) > 2:
-                Moving_Bin = Otsu.Execute(Moving)
-                MovingArray = sitk.GetArrayFromImage(Moving_Bin)
-                MovingArray = (MovingArray == 2) * 1
-
-        FixedArray = self.Normalize(FixedArray.astype(float))
-        MovingArray = self.Normalize(MovingArray.astype(float))
-
-
-        if Fixed.GetDimension() == 3:
-            Array = np.zeros((Fixed.GetSize()[2], Fixed.GetSize()[1], Fixed.GetSize()[0], 3), 'uint8')
-            Array[:,:,:,0] = FixedArray
-            Array[:,:,:,1] = MovingArray
-            Array[:,:,:,2] = MovingArray
-            
-            if Axis == 'Z':
-                if Slice:
-                    Array = Array[Slice,:,:]
-                else:
-                    Array = Array[Array.shape[0]//2,:,:]
-            if Axis == 'Y':
-                if Slice:
-                    Array = Array[:,Slice,:]
-                else:
-                    Array = Array[:,Array.shape[1]//2,:]
-            if Axis == 'X':
-                if Slice:
-                    Array = Array[:,:,Slice]
-                else:
-                    Array = Array[:,:,Array.shape[2]//2]
+        # Extract planes only and scale them with whole image statistics
+        Planes = []
+        for Image in [Fixed, Moving]:
+            Plane = Slicer.Extract(Image, Slice, Axis, Factor=1)
+            if AsBinary:
+                Plane = Slicer.Binarize(Plane, Image)
+            else:
+                Plane = Slicer.Normalize(Plane, Image)
+            Planes.append(Plane)
 
-        else:
-            Array = np.zeros((Fixed.GetSize()[1], Fixed.GetSize()[0], 3), 'uint8')
-            Array[:,:,0] = FixedArray
-            Array[:,:,1] = MovingArray
-            Array[:,:,2] = MovingArray
+        Array = np.stack([Planes[0], Planes[1], Planes[1]], axis=-1)
+        Array = Slicer.Downsample(Array, Slicer.Factor(Array.shape[:2]))
+        Array = Array.astype('uint8')
 
-        Figure, Axis = plt.subplots()
+        Figure, Axis = self.Subplots()
         Axis.imshow(Array,interpolation=None)
         Axis.axis('Off')
         
         if (Title):
             Axis.set_title(Title)
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0)
-
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName, Pad=0)
 
         return
 
+    @Renderable
     def Intensity(self, Structure, Deformations, Mask=None, Slice=None, Axis='Z', Title=None):
 
-        Array = sitk.GetArrayFromImage(Structure)
-        Values = sitk.GetArrayFromImage(Deformations)
-
-        if Mask:
-            MaskArray = sitk.GetArrayFromImage(Mask).astype('bool')
-
-        if Structure.GetDimension() == 3:
-            
-            if Axis == 'Z':
-                if Slice:
-                    Array = Array[Slice,:,:]
-                    Values = Values[Slice,:,:]
-                    if Mask:
-                        MaskArray = MaskArray[Slice,:,:]
-                else:
-                    Array = Array[Array.shape[0]//2,:,:]
-                    Values = Values[Values.shape[0]//2,:,:]
-                    if Mask:
-                        MaskArray = MaskArray[MaskArray.shape[0]//2,:,:]
-
-            if Axis == 'Y':
-                if Slice:
-                    Array = Array[:,Slice,:]
-                    Values = Values[:,Slice,:]
-                    if Mask:
-                        MaskArray = MaskArray[:,Slice,:]
-                else:
-                    Array = Array[:,Array.shape[1]//2,:]
-                    Values = Values[:,Values.shape[1]//2,:]
-                    if Mask:
-                        MaskArray = MaskArray[:,MaskArray.shape[1]//2,:]
-
-            if Axis == 'X':
-                if Slice:
-                    Array = Array[:,:,Slice]
-                    Values = Values[:,:,Slice]
-                    if Mask:
-                        MaskArray = MaskArray[:,:,Slice]
-                else:
-                    Array = Array[:,:,Array.shape[2]//2]
-                    Values = Values[:,:,Values.shape[2]//2]
-                    if Mask:
-                        MaskArray = MaskArray[:,:,MaskArray.shape[2]//2]
+        Array = Slicer.Extract(Structure, Slice, Axis)
+        Array = Slicer.Normalize(Array, Structure)
+        Values = Slicer.Extract(Deformations, Slice, Axis).astype('float')
 
         Structure = np.zeros((Array.shape[0], Array.shape[1], 4))
-        Structure[:,:,3] = self.Normalize(Array.astype(float)) / 255
-        
+        Structure[:,:,3] = Array / 255
+
         if Mask:
+            MaskArray = Slicer.Extract(Mask, Slice, Axis)
+            MaskArray = MaskArray > MaskArray.max() / 2
             Values[~MaskArray] = np.nan
         else:
             Values[Values == 0] = np.nan
 
-        Figure, Axis = plt.subplots(1,1)
+        Figure, Axis = self.Subplots(1,1)
         Plot = Axis.imshow(Values, cmap='jet', vmin=self.IRange[0], vmax=self.IRange[1], interpolation=None)
         Axis.imshow(Structure)
         Axis.axis('Off')
@@ -644,16 +654,11 @@ class Show():
         if (Title):
             Axis.set_title(Title)
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0)
-
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName, Pad=0)
 
         return
 
+    @Renderable
     def Signal(self, X, Y=[], Points=[], Normalize=False, Axes=[], Labels=[], Legend=True):
 
         if len(X) > 6:
@@ -671,7 +676,7 @@ class Show():
         else:
             Colors = [(1,0,0), (0,0,1), (0,0,0), (0,1,0), (0,1,1), (1,0,1)]
 
-        Figure, Axis = plt.subplots(1,1)
+        Figure, Axis = self.Subplots(1,1)
 
         if len(Y) == 0:
             self.Y = []
@@ -710,18 +715,14 @@ class Show():
         if Legend:
             plt.legend(loc='upper center', bbox_to_anchor=(0.5,1.12), ncol=Cols)
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0.02)
-
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName)
 
         return
 
     def OLS(self, X, Y, Cmap=np.array(None), Labels=None, Alpha=0.95, Annotate=['N','R2','SE','Slope','Intercept']):
 
+        Arguments = (X, Y, Cmap, Labels, Alpha, Annotate)
+
         if Labels == None:
             Labels = ['X', 'Y']
         
@@ -733,6 +734,11 @@ class Show():
         FitResults = smf.ols('Y ~ X', data=Data).fit()
         Slope = FitResults.params[1]
 
+        # Fit results are returned, only the figure is deferred
+        if self.Async and self.FName and not self.ShowPlot:
+            Render.Submit('OLS', self.FName, *Arguments)
+            return FitResults
+
         # Build arrays and matrices
         Y_Obs = FitResults.model.endog
         Y_Fit = FitResults.fittedvalues
@@ -763,7 +769,7 @@ class Show():
 
         ## Plots
         DPI = 100
-        Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5), dpi=DPI, sharey=True, sharex=True)
+        Figure, Axes = self.Subplots(1, 1, figsize=(5.5, 4.5), dpi=DPI, sharey=True, sharex=True)
 
         if Cmap.any():
             Colors = plt.cm.winter((Cmap-min(Cmap))/(max(Cmap)-min(Cmap)))
@@ -848,18 +854,14 @@ class Show():
         Axes.set_ylabel(Labels[1])
         plt.subplots_adjust(left=0.15, bottom=0.15)
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0.02)
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName)
 
         return FitResults
 
+    @Renderable
     def BoxPlot(self, ArraysList, Labels=['', 'Y'], SetsLabels=None, Vertical=True):
 
-        Figure, Axis = plt.subplots(1,1)
+        Figure, Axis = self.Subplots(1,1)
 
         for i, Array in enumerate(ArraysList):
             RandPos = np.random.normal(i,0.02,len(Array))
@@ -889,14 +891,10 @@ class Show():
         plt.legend(loc='upper center', ncol=2, bbox_to_anchor=(0.5, 1.125))
         plt.subplots_adjust(left=0.25, right=0.75)
         
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0.02)
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName)
 
-    def Fabric(self, eValues, eVectors, nPoints=32, Title=None, Angles=[30, 45]):
+    @Renderable
+    def Fabric(self, eValues, eVectors, nPoints=32, Title=None, Angles=[30, 45], FName=None):
 
         # New coordinate system
         Q = np.array(eVectors)
@@ -918,8 +916,7 @@ class Show():
         NormedColor = nNorm - nNorm.min()
         NormedColor = NormedColor / NormedColor.max()
 
-        Figure = plt.figure(figsize=(5.5, 4))
-        Axis = Figure.add_subplot(111, projection='3d')
+        Figure, Axis = self.Subplots(figsize=(5.5, 4), subplot_kw={'projection':'3d'})
         Axis.plot_surface(X, Y, Z, facecolors=plt.cm.jet(NormedColor), rstride=1, cstride=1, alpha=0.2, shade=False)
         Axis.plot_wireframe(X, Y, Z, color='k', rstride=1, cstride=1, linewidth=0.1)
         
@@ -972,29 +969,23 @@ class Show():
         # Rotate plot
         Axis.view_init(elev=Angles[0], azim=Angles[1])
 
-        plt.show()
+        self.Close(Figure, FName)
 
-    def Stiffness(self, S4, NPoints=32, Angles=[30, 45]):
+    @Renderable
+    def Stiffness(self, S4, Power=3, Angles=[30, 45], FName=None):
 
         I = np.eye(3)
 
-        ## Build data for plotting tensor
-        u = np.arange(0, 2 * np.pi + 2 * np.pi / NPoints, 2 * np.pi / NPoints)
-        v = np.arange(0, np.pi + np.pi / NPoints, np.pi / NPoints)
-        X = np.outer(np.cos(u), np.sin(v))
-        Y = np.outer(np.sin(u), np.sin(v))
-        Z = np.outer(np.ones_like(u), np.cos(v))
-        Color = np.zeros(X.shape)
-        for i in range(len(X)):
-            for j in range(len(X)):
-                n = np.array([X[i, j], Y[i, j], Z[i, j]])
-                N = Tensor.DyadicProduct(n, n)
+        ## Build data for plotting tensor on the geodesic unit sphere
+        Vertices, Faces = Morphometry.SphereMesh(Power)
+        N = Tensor.DyadicProduct(Vertices, Vertices, Orders=(1,1))
+        Transformed = Tensor.Transform(S4, N, Orders=(4,2))
 
-                Elongation = Tensor.FrobeniusProduct(N, Tensor.Transform(S4, N))
-                X[i, j], Y[i, j], Z[i, j] = np.array([X[i, j], Y[i, j], Z[i, j]]) * Elongation
+        Elongation = Tensor.FrobeniusProduct(N, Transformed, Order=2)
+        X, Y, Z = (Vertices * Elongation[:,None]).T
 
-                BulkModulus = Tensor.FrobeniusProduct(I, Tensor.Transform(S4, N))
-                Color[i, j] = BulkModulus
+        # Bulk modulus
+        Color = Tensor.FrobeniusProduct(I, Transformed, Order=2)
 
         MinX, MaxX = int(X.min()), int(X.max())
         MinY, MaxY = int(Y.min()), int(Y.max())
@@ -1007,10 +998,10 @@ class Show():
             NormedColor = np.round(Color / Color.max()) / 2
 
         ## Plot tensor in image coordinate system
-        Figure = plt.figure(figsize=(5.5, 4))
-        Axis = Figure.add_subplot(111, projection='3d')
-        Axis.plot_surface(X, Y, Z, facecolors=plt.cm.jet(NormedColor), rstride=1, cstride=1, alpha=0.2, shade=False)
-        Axis.plot_wireframe(X, Y, Z, color='k', rstride=1, cstride=1, linewidth=0.2)
+        Figure, Axis = self.Subplots(figsize=(5.5, 4), subplot_kw={'projection':'3d'})
+        Surface = Axis.plot_trisurf(X, Y, Z, triangles=Faces, edgecolor='k', linewidth=0.2, shade=False)
+        Surface.set_facecolor(plt.cm.jet(NormedColor[Faces].mean(axis=1)))
+        Surface.set_alpha(0.2)
         # scaling hack
         Bbox_min = np.min([X, Y, Z])
         Bbox_max = np.max([X, Y, Z])
@@ -1049,32 +1040,26 @@ class Show():
         else:
             ColorBar = plt.colorbar(ColorMap)
         ColorBar.set_label('Bulk modulus (MPa)')
-        plt.show()
+        self.Close(Figure, FName)
 
         return
 
-    def Compliance(self, C4, NPoints=32, Angles=[30, 45]):
+    @Renderable
+    def Compliance(self, C4, Power=3, Angles=[30, 45], FName=None):
 
         C4 = C4 * 1E3
         I = np.eye(3)
 
-        ## Build data for plotting tensor
-        u = np.arange(0, 2 * np.pi + 2 * np.pi / NPoints, 2 * np.pi / NPoints)
-        v = np.arange(0, np.pi + np.pi / NPoints, np.pi / NPoints)
-        X = np.outer(np.cos(u), np.sin(v))
-        Y = np.outer(np.sin(u), np.sin(v))
-        Z = np.outer(np.ones_like(u), np.cos(v))
-        Color = np.zeros(X.shape)
-        for i in range(len(X)):
-            for j in range(len(X)):
-                n = np.array([X[i, j], Y[i, j], Z[i, j]])
-                N = Tensor.DyadicProduct(n, n)
+        ## Build data for plotting tensor on the geodesic unit sphere
+        Vertices, Faces = Morphometry.SphereMesh(Power)
+        N = Tensor.DyadicProduct(Vertices, Vertices, Orders=(1,1))
+        Transformed = Tensor.Transform(C4, N, Orders=(4,2))
 
-                Elongation = Tensor.FrobeniusProduct(N, Tensor.Transform(C4, N))
-                X[i, j], Y[i, j], Z[i, j] = np.array([X[i, j], Y[i, j], Z[i, j]]) * Elongation
+        Elongation = Tensor.FrobeniusProduct(N, Transformed, Order=2)
+        X, Y, Z = (Vertices * Elongation[:,None]).T
 
-                BulkModulus = Tensor.FrobeniusProduct(I, Tensor.Transform(C4, N))
-                Color[i, j] = BulkModulus
+        # Bulk modulus
+        Color = Tensor.FrobeniusProduct(I, Transformed, Order=2)
 
         MinX, MaxX = round(X.min(),3), round(X.max(),3)
         MinY, MaxY = round(Y.min(),3), round(Y.max(),3)
@@ -1087,10 +1072,10 @@ class Show():
             NormedColor = np.round(Color / Color.max()) / 2
 
         ## Plot tensor in image coordinate system
-        Figure = plt.figure(figsize=(5.5, 4))
-        Axis = Figure.add_subplot(111, projection='3d')
-        Axis.plot_surface(X, Y, Z, facecolors=plt.cm.jet(NormedColor), rstride=1, cstride=1, alpha=0.2, shade=False)
-        Axis.plot_wireframe(X, Y, Z, color='k', rstride=1, cstride=1, linewidth=0.2)
+        Figure, Axis = self.Subplots(figsize=(5.5, 4), subplot_kw={'projection':'3d'})
+        Surface = Axis.plot_trisurf(X, Y, Z, triangles=Faces, edgecolor='k', linewidth=0.2, shade=False)
+        Surface.set_facecolor(plt.cm.jet(NormedColor[Faces].mean(axis=1)))
+        Surface.set_alpha(0.2)
         # scaling hack
         Bbox_min = np.min([X, Y, Z])
         Bbox_max = np.max([X, Y, Z])
@@ -1129,10 +1114,11 @@ class Show():
         else:
             ColorBar = plt.colorbar(ColorMap)
         ColorBar.set_label('Bulk modulus (kPa)')
-        plt.show()
+        self.Close(Figure, FName)
 
         return
 
+    @Renderable
     def Histogram(self, Arrays, Labels=[], Density=False, Norm=False):
 
         if len(Arrays) > 6:
@@ -1150,7 +1136,7 @@ class Show():
         else:
             Colors = [(1,0,0), (0,0,1), (0,0,0), (0,1,0), (0,1,1), (1,0,1)]
 
-        Figure, Axes = plt.subplots(1, 1, figsize=(5.5, 4.5), dpi=300)
+        Figure, Axes = self.Subplots(1, 1, figsize=(5.5, 4.5), dpi=300)
         for i, Array in enumerate(Arrays):
 
             X = pd.DataFrame(Array)
@@ -1193,14 +1179,109 @@ class Show():
         # plt.legend(loc='upper center', ncol=3, bbox_to_anchor=(0.5, 1.15), prop={'size': 10})
         # plt.legend(loc='upper left')
 
-        if (self.FName):
-            plt.savefig(self.FName, bbox_inches='tight', pad_inches=0.02)
-        if self.ShowPlot:
-            plt.show()
-        else:
-            plt.close()
+        self.Close(Figure, self.FName)
 
 Show = Show()
+class Render():
+
+    def __init__(self):
+        self.Echo = True
+        self.Processes = 2
+        self.Workers = None
+        self.Jobs = []
+
+    def Start(self, Processes=None):
+
+        """
+        Start the pool of headless rendering workers, it inherits the
+        current Show settings (IRange, Formats)
+        :param Processes: Number of rendering processes (default self.Processes)
+        """
+
+        if self.Workers:
+            return
+
+        if Processes:
+            self.Processes = Processes
+
+        Settings = {'IRange':Show.IRange, 'Formats':Show.Formats}
+        self.Workers = Pool(self.Processes, RenderInitializer, (Settings,))
+
+        return
+
+    def Submit(self, Method, FName, /, *Args, **Kwargs):
+
+        """
+        Queue a figure job rendered and written asynchronously
+        Inside daemonic processes (e.g. batch workers) the figure
+        is rendered directly as children can't be created
+        :param Method: Name of the Show method (e.g. 'Slice', 'OLS')
+        :param FName: File name of the figure, written in Show.Formats
+                      if it has no extension
+        :param Args, Kwargs: Arguments of the Show method, which may
+                             include its own FName argument
+        :return Job: Asynchronous result of the job
+        """
+
+        if current_process().daemon:
+            Async = Show.Async
+            Show.Async = False
+            try:
+                getattr(Show, Method)(*Args, **Kwargs)
+            finally:
+                Show.Async = Async
+            return
+
+        self.Start()
+        Job = self.Workers.apply_async(RenderWorker, ((Method, FName, Args, Kwargs),))
+        self.Jobs.append(Job)
+
+        return Job
+
+    def Wait(self):
+
+        """
+        Wait for all queued figures to be written
+        :return Report: Pandas data frame with file, status and time of each job
+        """
+
+        if self.Echo and len(self.Jobs) > 0:
+            Text = 'Rendering'
+            Time.Process(1, Text)
+
+        Status = []
+        for i, Job in enumerate(self.Jobs):
+            Status.append(Job.get())
+            if self.Echo:
+                Time.Update((i+1) / len(self.Jobs), Text)
+        self.Jobs = []
+
+        Report = pd.DataFrame(Status)
+        if self.Echo and len(Report) > 0:
+            Time.Process(0, Text)
+            Failed = Report[Report['Status'] != 'Done']
+            for Index in Failed.index:
+                print('Failed figure ' + str(Failed.loc[Index, 'FName']))
+                print(Failed.loc[Index, 'Error'])
+
+        return Report
+
+    def Stop(self):
+
+        """
+        Wait for queued figures and close the rendering workers
+        :return Report: Pandas data frame of the last jobs
+        """
+
+        Report = self.Wait()
+        if self.Workers:
+            self.Workers.close()
+            self.Workers.join()
+            self.Workers = None
+
+        return Report
+
+Render = Render()
 #%% Reading functions
 class Read():
 
@@ -1599,6 +1680,119 @@ class Read():
 
         return Image, AdditionalData
 
+    def Cached(self, Source, Cache):
+
+        """
+        Check if a cache file exists and is newer than its source
+        """
+
+        Source, Cache = Path(Source), Path(Cache)
+        if not Cache.exists():
+            return False
+
+        return Cache.stat().st_mtime >= Source.stat().st_mtime
+
+    def ARAMIS(self, File, Systems=None, Variables=None):
+
+        """
+        Read ARAMIS csv export. The csv is parsed once (with time stamps
+        conversion) and stored in a Parquet file next to it, which is
+        used as long as it is newer than the csv
+        :param File: Path to the ARAMIS csv file
+        :param Systems: Coordinate systems to keep, e.g.
+                        'TopPlate_Csys→AnatomicalCsys' (None for all)
+                        - Type: str or list of str
+        :param Variables: Variables to keep, e.g. 'LZ [mm]' (None for all)
+                          - Type: str or list of str
+        :return Data: Time stamps ('Time UTC') and selected columns
+                      - Type: pandas data frame
+        """
+
+        Cache = Path(str(File) + '.parquet')
+
+        if not self.Cached(File, Cache):
+            Data = pd.read_csv(File, index_col=0, sep=';', header=1)
+            Data['Time UTC'] = pd.to_datetime(Data['Time UTC'])
+            Data.columns = [str(C) for C in Data.columns]
+            Data.to_parquet(str(Cache))
+
+        # Select columns by coordinate system and variable
+        Columns = None
+        if Systems or Variables:
+            if isinstance(Systems, str):
+                Systems = [Systems]
+            if isinstance(Variables, str):
+                Variables = [Variables]
+
+            # Only the Parquet readers need pyarrow
+            import pyarrow.parquet as pq
+
+            Columns = ['Time UTC']
+            for Column in pq.read_schema(str(Cache)).names:
+                if '.' not in Column:
+                    continue
+                System, Variable = Column.rsplit('.', 1)
+                if Systems and System not in Systems:
+                    continue
+                if Variables and Variable not in Variables:
+                    continue
+                Columns.append(Column)
+
+        Data = pd.read_parquet(str(Cache), columns=Columns)
+
+        return Data
+
+    def MTSCache(self, File):
+
+        """
+        Split MTS json file into one Parquet file per sample (done
+        once, redone if the json is modified) and return cache folder
+        """
+
+        CacheDir = Path(File).parent / (Path(File).stem + '_Cache')
+        Index = CacheDir / 'Samples.json'
+
+        if not self.Cached(File, Index):
+            os.makedirs(CacheDir, exist_ok=True)
+            with open(File) as F:
+                Data = json.load(F)
+            for Sample in Data:
+                Frame = pd.DataFrame(Data[Sample]).astype(float)
+                Frame.to_parquet(str(CacheDir / (Sample + '.parquet')), index=False)
+            with open(Index, 'w') as F:
+                json.dump(list(Data.keys()), F)
+
+        return CacheDir
+
+    def MTSSamples(self, File):
+
+        """
+        List samples names stored in MTS json file
+        """
+
+        CacheDir = self.MTSCache(File)
+        with open(CacheDir / 'Samples.json') as F:
+            Samples = json.load(F)
+
+        return Samples
+
+    def MTS(self, File, Sample, Columns=None):
+
+        """
+        Read data of a single sample from the MTS json file
+        using the per sample Parquet cache
+        :param File: Path to the MTS json file
+        :param Sample: Sample name
+        :param Columns: Columns to read, e.g. ['time', 'disp', 'force']
+        :return Data: MTS recorded signals
+                      - Type: pandas data frame
+        """
+
+        CacheDir = self.MTSCache(File)
+        Data = pd.read_parquet(str(CacheDir / (Sample + '.parquet')), columns=Columns)
+
+        return Data
+
 Read = Read()
 #%% Writing functions
 class Write():
@@ -1606,7 +1800,7 @@ class Write():
     def __init__(self):
         self.Echo = True
         self.FName = 'Image'
-        pass
+        self.Compression = True
 
     def Raw(self, Image, PixelType):
 
@@ -1710,235 +1904,708 @@ class Write():
 
         return
 
-    def VectorFieldVTK(self, VectorField, SubSampling=1):
+    def VTKArray(self, Array, Name):
+
+        """
+        Wrap a numpy array into a vtk array without copy (the vtk
+        array keeps a reference to the numpy data)
+        """
+
+        Array = np.ascontiguousarray(Array)
+        VTKArray = numpy_to_vtk(Array, deep=False)
+        VTKArray.SetName(Name)
+
+        return VTKArray
+
+    def XML(self, Data):
+
+        """
+        Write a vtk data set in binary XML format, image data (self.FName.vti)
+        or unstructured grid (self.FName.vtu), with raw appended data
+        compressed with zlib if self.Compression
+        """
+
+        if isinstance(Data, vtk.vtkImageData):
+            Writer = vtk.vtkXMLImageDataWriter()
+            Extension = '.vti'
+        else:
+            Writer = vtk.vtkXMLUnstructuredGridWriter()
+            Extension = '.vtu'
+
+        Writer.SetFileName(str(self.FName) + Extension)
+        Writer.SetInputData(Data)
+        Writer.SetDataModeToAppended()
+        Writer.EncodeAppendedDataOff()
+        Writer.SetHeaderTypeToUInt64()
+        if self.Compression:
+            Writer.SetCompressorTypeToZLib()
+        else:
+            Writer.SetCompressorTypeToNone()
+        Writer.Write()
+
+        return
+
+    def VectorFieldVTK(self, VectorField, SubSampling=1, Spacing=(1, 1, 1), Origin=(0, 0, 0)):
+
+        """
+        Write a vector field (e.g. registration displacements) as binary
+        XML image data (self.FName.vti) with vectors and their magnitude
+        :param VectorField: 2D or 3D vector field
+                            - Type: numpy array (Y, X, 2) or (Z, Y, X, 3)
+        :param SubSampling: Write every SubSampling-th point along each axis
+        :param Spacing: Grid spacing (X, Y, Z)
+        :param Origin: Grid origin (X, Y, Z)
+        """
 
         if self.Echo:
             Text = 'Write VTK'
             Time.Process(1, Text)
 
-        # Determine 2D of 3D vector field
+        # Sub-sampled vectors as (Z, Y, X, 3) array
         Dimension = VectorField.shape[-1]
-        Size = VectorField.shape[:-1]
-
         if Dimension == 2:
+            Field = VectorField[::SubSampling, ::SubSampling]
+            Vectors = np.zeros((1,) + Field.shape[:-1] + (3,), 'float32')
+            Vectors[0, :, :, :2] = Field
+        else:
+            Field = VectorField[::SubSampling, ::SubSampling, ::SubSampling]
+            Vectors = np.ascontiguousarray(Field, 'float32')
 
-            Size = np.append(1,Size)
-
-            # Build Grid point
-            z, y, x = np.arange(0, Size[0], SubSampling), np.arange(0, Size[1], SubSampling), np.arange(0, Size[2], SubSampling)
-            NumberOfElements = len(x) * len(y) * len(z)
-
-            # Build vector arrays
-            u = VectorField[:, :, 0]
-            v = VectorField[:, :, 1]
-            w = np.zeros(NumberOfElements).reshape(Size[1:])
-
-        elif Dimension == 3:
-
-            # Build Grid point
-            z = np.arange(0, Size[0], SubSampling)
-            y = np.arange(0, Size[1], SubSampling)
-            x = np.arange(0, Size[2], SubSampling)
-            NumberOfElements = len(x) * len(y) * len(z)
-
-            # Build vector arrays
-            u = VectorField[:, :, :, 0]
-            v = VectorField[:, :, :, 1]
-            w = VectorField[:, :, :, 2]
-
-        File = open(self.FName + '.vtk','w')
-
-        # ASCII file header
-        File.write('# vtk DataFile Version 4.2\n')
-        File.write('VTK from Python\n')
-        File.write('ASCII\n\n')
-        File.write('DATASET RECTILINEAR_GRID\n')
-        File.write('DIMENSIONS ' + str(len(x)) + ' ' + str(len(y)) + ' ' + str(len(z)) + '\n\n')
-        File.close()
-
-        # Append ascii x,y,z
-        MaxLineWidth = Size[2]*Size[1]*Size[0]
-        File = open(self.FName + '.vtk','a')
-        File.write('X_COORDINATES ' + str(len(x)) + ' int\n')
-        File.write(np.array2string(x.astype('int'),
-                                max_line_width=MaxLineWidth,
-                                threshold=MaxLineWidth)[1:-1] + '\n')
-        File.write('\nY_COORDINATES ' + str(len(y)) + ' int\n')
-        File.write(np.array2string(y.astype('int'),
-                                max_line_width=MaxLineWidth,
-                                threshold=MaxLineWidth)[1:-1] + '\n')
-        File.write('\nZ_COORDINATES ' + str(len(z)) + ' int\n')
-        File.write(np.array2string(z.astype('int'),
-                                max_line_width=MaxLineWidth,
-                                threshold=MaxLineWidth)[1:-1] + '\n\n')
-        File.close()
-
-        # Append another subheader
-        File = open(self.FName + '.vtk','a')
-        File.write('\nPOINT_DATA ' + str(NumberOfElements) + '\n\n')
-        File.write('VECTORS Deformation float\n')
-        File.close()
-
-        # Append ascii u,v,w and build deformation magnitude array
-        Magnitude = np.zeros(VectorField.shape[:-1])
-        File = open(self.FName + '.vtk','a')
+        Size = Vectors.shape[:-1]
+        Vectors = Vectors.reshape(-1, 3)
+        Magnitude = np.linalg.norm(Vectors, axis=1)
 
-        if Dimension == 2:
-            for j in range(0,Size[1],SubSampling):
-                if self.Echo:
-                    Time.Update(j / Size[1], 'Write Vectors')
-                for i in range(0,Size[2],SubSampling):
-                    Magnitude[j,i] = np.sqrt(u[j,i]**2 + v[j,i]**2 + w[j,i]**2)
-                    File.write(str(u[j,i]) + ' ' + str(v[j,i]) + ' ' + str(w[j,i]) + ' ')
-
-        elif Dimension == 3:
-            for k in range(0,Size[0],SubSampling):
-                if self.Echo:
-                    Time.Update(k / Size[0], 'Write Vectors')
-                for j in range(0,Size[1],SubSampling):
-                    for i in range(0,Size[2],SubSampling):
-                        Magnitude[k,j,i] = np.sqrt(u[k,j,i] ** 2 + v[k,j,i] ** 2 + w[k,j,i] ** 2)
-                        File.write(str(u[k,j,i]) + ' ' + str(v[k,j,i]) + ' ' + str(w[k,j,i]) + ' ')
-
-        File.close()
-
-        # Append another subheader
-        File = open(self.FName + '.vtk', 'a')
-        File.write('\n\nSCALARS Magnitude float\n')
-        File.write('LOOKUP_TABLE default\n')
+        # Build image data sharing numpy memory
+        Image = vtk.vtkImageData()
+        Image.SetDimensions(Size[2], Size[1], Size[0])
+        Image.SetSpacing([S * SubSampling for S in Spacing])
+        Image.SetOrigin(Origin)
+        Image.GetPointData().AddArray(self.VTKArray(Vectors, 'Deformation'))
+        Image.GetPointData().SetActiveVectors('Deformation')
+        Image.GetPointData().AddArray(self.VTKArray(Magnitude, 'Magnitude'))
 
-        if Dimension == 2:
-            for j in range(0, Size[1], SubSampling):
-                if self.Echo:
-                    Time.Update(j / Size[1], 'Write Magnitudes')
-                for i in range(0, Size[2], SubSampling):
-                    File.write(str(Magnitude[j,i]) + ' ')
-
-        elif Dimension == 3:
-            for k in range(0, Size[0], SubSampling):
-                if self.Echo:
-                    Time.Update(k / Size[0], 'Write Magnitudes')
-                for j in range(0, Size[1], SubSampling):
-                    for i in range(0, Size[2], SubSampling):
-                        File.write(str(Magnitude[k,j,i]) + ' ')
-
-        File.close()
+        self.XML(Image)
 
         if self.Echo:
             Time.Process(0,Text)
 
         return
 
-    def FabricVTK(self, eValues, eVectors, nPoints=32, Scale=1, Origin=(0,0,0)):
+    def FabricGlyphs(self, Centers, eValues, eVectors, Scale=1, Data={}, Glyphs=False, nPoints=16):
+
+        """
+        Write fabric tensors of many points (e.g. hFE elements) as binary
+        XML unstructured grid (self.FName.vtu). By default, points carry the
+        fabric tensor which is displayed as instanced ellipsoids by the
+        Paraview Tensor Glyph filter. If Glyphs, the ellipsoids are built
+        from a single sphere source and written in the file.
+        :param Centers: Points coordinates
+                        - Type: numpy array (N, 3)
+        :param eValues: Fabric eigenvalues
+                        - Type: numpy array (N, 3)
+        :param eVectors: Fabric eigenvectors (columns)
+                         - Type: numpy array (N, 3, 3)
+        :param Scale: Ellipsoids diameter for unit eigenvalues
+        :param Data: Additional point data
+                     - Type: dict[Name] = numpy array (N) or (N, 3)
+        :param Glyphs: Write ellipsoids instead of points
+        :param nPoints: Sphere resolution of the ellipsoids
+        """
 
         if self.Echo:
             Text = 'Write Fabric VTK'
             Time.Process(1, Text)
 
-        ## New coordinate system
-        Q = np.array(eVectors)
-
-        ## Build data for fabric plotting
-        u = np.arange(0, 2 * np.pi + 2 * np.pi / nPoints, 2 * np.pi / nPoints)
-        v = np.arange(0, np.pi + np.pi / nPoints, np.pi / nPoints)
-        X = eValues[0] * np.outer(np.cos(u), np.sin(v))
-        Y = eValues[1] * np.outer(np.sin(u), np.sin(v))
-        Z = eValues[2] * np.outer(np.ones_like(u), np.cos(v))
-        nNorm = np.zeros(X.shape)
-
-        for i in range(len(X)):
-            for j in range(len(X)):
-                [X[i, j], Y[i, j], Z[i, j]] = np.dot([X[i, j], Y[i, j], Z[i, j]], Q)
-                n = np.array([X[i, j], Y[i, j], Z[i, j]])
-                nNorm[i, j] = np.linalg.norm(n)
-
-        # Scale the arrays
-        X = Scale/2 * X
-        Y = Scale/2 * Y
-        Z = Scale/2 * Z
-
-        # Translate origin to the center of ROI
-        X = Origin[2] + X + Scale/2
-        Y = Origin[1] + Y + Scale/2
-        Z = Origin[0] + Z + Scale/2
-
-        # Write VTK file
-        VTKFile = open(self.FName + '.vtk', 'w')
-
-        # Write header
-        VTKFile.write('# vtk DataFile Version 4.2\n')
-        VTKFile.write('VTK from Python\n')
-        VTKFile.write('ASCII\n')
-        VTKFile.write('DATASET UNSTRUCTURED_GRID\n')
-
-        # Write points coordinates
-        Points = int(X.shape[0] * X.shape[1])
-        VTKFile.write('\nPOINTS ' + str(Points) + ' floats\n')
-        for i in range(Points):
-            if self.Echo:
-                Time.Update(i / len(Points), 'Write Points')
-            VTKFile.write(str(X.reshape(Points)[i].round(3)))
-            VTKFile.write(' ')
-            VTKFile.write(str(Y.reshape(Points)[i].round(3)))
-            VTKFile.write(' ')
-            VTKFile.write(str(Z.reshape(Points)[i].round(3)))
-            VTKFile.write('\n')
-
-        # Write cells connectivity
-        Cells = int(nPoints**2)
-        ListSize = int(Cells*5)
-        VTKFile.write('\nCELLS ' + str(Cells) + ' ' + str(ListSize) + '\n')
-
-        ## Add connectivity of each cell
-        Connectivity = np.array([0, 1])
-        Connectivity = np.append(Connectivity,[nPoints+2,nPoints+1])
-
-        for i in range(Cells):
+        Centers = np.asarray(Centers, 'float64').reshape(-1, 3)
+        eValues = np.real(eValues).reshape(-1, 3)
+        eVectors = np.real(eVectors).reshape(-1, 3, 3)
+        Tensors = np.einsum('nij,nj,nkj->nik', eVectors, eValues, eVectors)
+        N = len(Centers)
+
+        # Points and vertex cells
+        Points = vtk.vtkPoints()
+        Points.SetData(self.VTKArray(Centers, 'Points'))
+        Cells = np.stack([np.ones(N), np.arange(N)], axis=1).astype('int64')
+        CellArray = vtk.vtkCellArray()
+        CellArray.SetCells(N, numpy_to_vtkIdTypeArray(Cells.ravel(), deep=True))
+
+        Grid = vtk.vtkUnstructuredGrid()
+        Grid.SetPoints(Points)
+        Grid.SetCells(vtk.VTK_VERTEX, CellArray)
+
+        # Fabric point data
+        PointData = Grid.GetPointData()
+        PointData.AddArray(self.VTKArray(Tensors.reshape(N, 9), 'Fabric'))
+        PointData.SetActiveTensors('Fabric')
+        PointData.AddArray(self.VTKArray(eValues, 'Eigenvalues'))
+        DA = eValues.max(axis=1) / eValues.min(axis=1)
+        PointData.AddArray(self.VTKArray(DA, 'DA'))
+        PointData.SetActiveScalars('DA')
+        for Name, Values in Data.items():
+            PointData.AddArray(self.VTKArray(Values, Name))
+
+        # Instantiate ellipsoids from a single sphere
+        if Glyphs:
             if self.Echo:
-                Time.Update(i / len(Cells), 'Write Cells')
+                Time.Update(1/2, 'Build glyphs')
+
+            Sphere = vtk.vtkSphereSource()
+            Sphere.SetRadius(1)
+            Sphere.SetThetaResolution(nPoints)
+            Sphere.SetPhiResolution(nPoints)
+            Sphere.Update()
+
+            Glyph = vtk.vtkTensorGlyph()
+            Glyph.SetInputData(Grid)
+            Glyph.SetSourceConnection(Sphere.GetOutputPort())
+            Glyph.SetScaleFactor(Scale / 2)
+            Glyph.ExtractEigenvaluesOn()
+            Glyph.ColorGlyphsOn()
+            Glyph.SetColorModeToScalars()
+
+            Append = vtk.vtkAppendFilter()
+            Append.AddInputConnection(Glyph.GetOutputPort())
+            Append.Update()
+            Grid = Append.GetOutput()
+
+            # Fabric value along each ellipsoid point direction
+            nSphere = Sphere.GetOutput().GetNumberOfPoints()
+            Coordinates = vtk_to_numpy(Grid.GetPoints().GetData())
+            Radius = np.linalg.norm(Coordinates - np.repeat(Centers, nSphere, axis=0), axis=1)
+            Grid.GetPointData().AddArray(self.VTKArray(Radius / (Scale / 2), 'Radius'))
+
+        self.XML(Grid)
 
-            VTKFile.write('4')
+        if self.Echo:
+            Time.Process(0, Text)
 
-            if i > 0 and np.mod(i,nPoints) == 0:
-                Connectivity = Connectivity + 1
+        return
+
+    def FabricVTK(self, eValues, eVectors, nPoints=32, Scale=1, Origin=(0,0,0)):
+
+        """
+        Write a single fabric ellipsoid centered in a ROI as binary XML
+        unstructured grid (self.FName.vtu)
+        :param eValues: Fabric eigenvalues
+        :param eVectors: Fabric eigenvectors (rows)
+        :param nPoints: Ellipsoid resolution
+        :param Scale: ROI size
+        :param Origin: ROI origin (Z, Y, X)
+        """
+
+        Center = np.array(Origin, 'float')[::-1] + Scale/2
+        eVectors = np.transpose(np.array(eVectors))
+
+        self.FabricGlyphs(Center, np.array(eValues), eVectors, Scale, Glyphs=True, nPoints=nPoints)
 
-            for j in Connectivity:
-                VTKFile.write(' ' + str(j))
-            VTKFile.write('\n')
+        return
+
+Write = Write()
+#%% Multi-resolution functions
+class Pyramid():
+
+    def __init__(self):
+        self.Echo = True
+        self.Path = None
+        self.Levels = {}
+        self.Smooth = {}
+        self.Keys = {}
 
-            ## Update connectivity
-            Connectivity = Connectivity+1
+    def Key(self, Image, Smooth):
 
-        # Write cell types
-        VTKFile.write('\nCELL_TYPES ' + str(Cells) + '\n')
-        for i in range(Cells):
-            VTKFile.write('9\n')
+        """
+        Identify the levels of an image on disk by a hash of its voxels,
+        geometry and smoothing, so that files of another sample or of a
+        modified image are never reused
+        """
 
-        # Write MIL values
-        VTKFile.write('\nPOINT_DATA ' + str(Points) + '\n')
-        VTKFile.write('SCALARS MIL float\n')
-        VTKFile.write('LOOKUP_TABLE default\n')
+        Content = Histogram.Key(sitk.GetArrayViewFromImage(Image))
+        Geometry = (Image.GetSpacing(), Image.GetOrigin(), Image.GetDirection(), bool(Smooth))
+        Hash = hashlib.blake2b((Content + str(Geometry)).encode(), digest_size=6)
+
+        return Hash.hexdigest()
+
+    def Build(self, Name, Image, Factors=[1, 2, 4, 8], Smooth=True):
+
+        """
+        Compute the downsampled levels of an image once and keep them
+        in memory (and on disk if self.Path is set) so that the different
+        registration stages and plots can reuse them
+        Each level is computed from the closest finer level to avoid
+        smoothing and resampling the full resolution image several times
+
+        :param Name: Key used to retrieve the levels (e.g. 'PreI')
+                     - Type: str
+        :param Image: Full resolution image
+                      - Type: sitkImage
+        :param Factors: Downsampling factors of the levels
+                        - Type: list of int
+        :param Smooth: Gaussian smoothing before downsampling. Use False
+                       for masks to keep binary values (nearest neighbour)
+                       - Type: bool
+
+        :return Levels: Dictionary of the levels
+                        - Type: dict[Factor] = sitkImage
+        """
+
+        if self.Echo:
+            Text = 'Build pyramid'
+            Time.Process(1, Text)
+
+        # Start from already computed levels of the same image
+        Levels = {1: Image}
+        if Name in self.Levels and self.Levels[Name][1] is Image:
+            Levels.update(self.Levels[Name])
+
+        if self.Path:
+            if Name in self.Keys and Name in self.Levels and self.Levels[Name][1] is Image:
+                Key = self.Keys[Name]
+            else:
+                Key = self.Key(Image, Smooth)
+            self.Keys[Name] = Key
+
+        Factors = sorted(set([int(F) for F in Factors]))
+        for iF, Factor in enumerate(Factors):
 
-        for i in range(nPoints+1):
             if self.Echo:
-                Time.Update(i / len(nPoints+1), 'Write Values')
-            for j in range(nPoints+1):
-                VTKFile.write(str(nNorm.reshape(Points)[j + i * (nPoints+1)].round(3)))
-                VTKFile.write(' ')
-            VTKFile.write('\n')
-        VTKFile.close()
+                Time.Update(iF / len(Factors))
+
+            if Factor in Levels:
+                continue
+
+            # Look for cached level on disk
+            if self.Path:
+                FName = Path(self.Path, Name + '_' + Key + '_' + str(Factor) + '.mha')
+                if FName.exists():
+                    Levels[Factor] = sitk.ReadImage(str(FName))
+                    continue
+
+            # Use closest finer level as starting point
+            Finer = max([F for F in Levels if Factor % F == 0])
+            Relative = Factor // Finer
+            Level = Levels[Finer]
+
+            if Smooth:
+                Sigma = 0.5 * Relative * np.array(Level.GetSpacing())
+                Level = sitk.SmoothingRecursiveGaussian(Level, [float(S) for S in Sigma])
+                Level = Resample(Level, Factor=Relative, Order=1)
+            else:
+                Level = Resample(Level, Factor=Relative, Order=0)
+
+            Levels[Factor] = Level
+
+            if self.Path:
+                os.makedirs(self.Path, exist_ok=True)
+                sitk.WriteImage(Level, str(FName))
+
+        self.Levels[Name] = Levels
+        self.Smooth[Name] = Smooth
 
         if self.Echo:
             Time.Process(0, Text)
 
+        return self.Levels[Name]
+
+    def Get(self, Name, Factor):
+
+        """
+        Return the level of a given factor, computes it
+        from the stored levels if not built before
+        """
+
+        Levels = self.Levels[Name]
+        if Factor not in Levels:
+            Echo, self.Echo = self.Echo, False
+            self.Build(Name, Levels[1], list(Levels.keys()) + [Factor], self.Smooth[Name])
+            self.Echo = Echo
+
+        return self.Levels[Name][Factor]
+
+    def Schedule(self, Factors, Reference=1, Dimension=3):
+
+        """
+        Build elastix pyramid schedule of the given factors expressed
+        relatively to the level given to elastix (Reference factor)
+        """
+
+        Schedule = []
+        for Factor in sorted(Factors, reverse=True):
+            if Factor >= Reference:
+                Schedule += [str(Factor // Reference)] * Dimension
+
+        return Schedule
+
+    def Clear(self, Name=None, Remove=False):
+
+        """
+        Free the levels kept in memory, their files on disk (if
+        self.Path is set) are kept for later runs unless Remove is True
+        """
+
+        Names = [Name] if Name else list(self.Levels.keys())
+        for N in Names:
+            del self.Levels[N]
+            del self.Smooth[N]
+            Key = self.Keys.pop(N, None)
+            if Remove and self.Path and Key:
+                for FName in Path(self.Path).glob(N + '_' + Key + '_*.mha'):
+                    os.remove(FName)
+
         return
 
-Write = Write()
+Pyramid = Pyramid()
+#%% Histogram thresholding functions
+class Histogram():
+
+    def __init__(self):
+        self.Echo = True
+        self.Bins = 128
+        self.SlabSize = 64
+        self.CacheSize = 32
+        self.Cache = {}
+
+    def GetArray(self, Image):
+
+        """
+        Return a numpy view of an image without copy (sitkImage,
+        numpy array or memmap)
+        """
+
+        if isinstance(Image, sitk.Image):
+            return sitk.GetArrayViewFromImage(Image)
+        else:
+            return Image
+
+    def Key(self, Array):
+
+        """
+        Identify an image by its shape, type and a hash of all
+        its voxels, computed slab by slab
+        """
+
+        Hash = hashlib.blake2b(str((Array.shape, Array.dtype)).encode(), digest_size=20)
+        for Start in range(0, Array.shape[0], self.SlabSize):
+            Hash.update(np.ascontiguousarray(Array[Start:Start+self.SlabSize]))
+
+        return Hash.hexdigest()
+
+    def Store(self, Cache, Key, Value):
+
+        """
+        Store a value in a cache limited to self.CacheSize entries,
+        the least recently used ones are dropped first
+        """
+
+        Cache[Key] = Value
+        while len(Cache) > self.CacheSize:
+            Cache.pop(next(iter(Cache)))
+
+        return Value
+
+    def Compute(self, Image, Bins=None, Range=None):
+
+        """
+        Accumulate the global histogram slab by slab
+        :param Image: Image to analyse
+                      - Type: sitkImage or numpy array / memmap (Z, Y, X)
+        :param Bins: Number of histogram bins
+        :param Range: Histogram range, computed slab by slab if None
+        :return Hist: Voxel counts
+                      - Type: numpy array (Bins)
+                Edges: Bins edges
+                       - Type: numpy array (Bins+1)
+        """
+
+        Array = self.GetArray(Image)
+        if not Bins:
+            Bins = self.Bins
+        nZ = Array.shape[0]
+
+        if Range is None:
+            Min, Max = np.inf, -np.inf
+            for Start in range(0, nZ, self.SlabSize):
+                Slab = Array[Start:Start+self.SlabSize]
+                Min = min(Min, Slab.min())
+                Max = max(Max, Slab.max())
+            Range = (float(Min), float(Max) if Max > Min else float(Min) + 1)
+
+        Hist = np.zeros(Bins, 'int64')
+        for Start in range(0, nZ, self.SlabSize):
+            Slab = Array[Start:Start+self.SlabSize]
+            Hist += np.histogram(Slab, Bins, Range)[0]
+        Edges = np.linspace(Range[0], Range[1], Bins+1)
+
+        return Hist, Edges
+
+    def Otsu(self, Hist, Edges, nThresholds=2):
+
+        """
+        Multiple Otsu's thresholds from a histogram, classes maximizing
+        the between-class variance are found by dynamic programming
+        over the bins (exact, same criterion as OtsuMultipleThresholds)
+        :return Thresholds: Upper limits of the lower classes
+                            - Type: numpy array (nThresholds)
+        """
+
+        Centers = (Edges[1:] + Edges[:-1]) / 2
+        W = np.concatenate([[0], np.cumsum(Hist)]).astype('float')
+        S = np.concatenate([[0], np.cumsum(Hist * Centers)])
+
+        # Score of a class made of bins [i, j)
+        dW = W[None,:] - W[:,None]
+        dS = S[None,:] - S[:,None]
+        Score = np.full(dW.shape, -np.inf)
+        Valid = np.triu(np.ones(dW.shape, bool), 1)
+        Score[Valid] = 0
+        Filled = Valid & (dW > 0)
+        Score[Filled] = dS[Filled]**2 / dW[Filled]
+
+        # Best partition of bins [0, j) in k+1 classes
+        Best = Score[0]
+        Arguments = []
+        for k in range(nThresholds):
+            Total = Best[:,None] + Score
+            Arguments.append(np.argmax(Total, axis=0))
+            Best = Total.max(axis=0)
+
+        # Backtrack class limits
+        Cuts = []
+        j = len(Hist)
+        for Argument in Arguments[::-1]:
+            j = Argument[j]
+            Cuts.append(j)
+
+        return Edges[Cuts[::-1]]
+
+    def Thresholds(self, Image, nThresholds=2, Bins=None):
+
+        """
+        Otsu's thresholds of an image, computed once per image
+        content and kept in cache
+        """
+
+        if not Bins:
+            Bins = self.Bins
+
+        Array = self.GetArray(Image)
+        Key = (self.Key(Array), nThresholds, Bins)
+        if Key in self.Cache:
+            return self.Store(self.Cache, Key, self.Cache.pop(Key))
+
+        Hist, Edges = self.Compute(Array, Bins)
+
+        return self.Store(self.Cache, Key, self.Otsu(Hist, Edges, nThresholds))
+
+    def Slabs(self, Image, Thresholds):
+
+        """
+        Generator of labels (0 to len(Thresholds)) slab by slab,
+        labels are the number of thresholds below the voxel value
+        """
+
+        Array = self.GetArray(Image)
+        for Start in range(0, Array.shape[0], self.SlabSize):
+            Slab = Array[Start:Start+self.SlabSize]
+            yield Start, np.searchsorted(Thresholds, Slab, side='left').astype('uint8')
+
+    def Labels(self, Image, nThresholds=2, Bins=None):
+
+        """
+        Otsu's multiple thresholds segmentation computed slab by slab,
+        equivalent to sitk.OtsuMultipleThresholdsImageFilter
+        :param Image: Gray value image
+                      - Type: sitkImage or numpy array / memmap
+        :return Labels: Classes labels (0 to nThresholds)
+                        - Type: uint8 sitkImage
+        """
+
+        if self.Echo:
+            Text = 'Otsu labels'
+            Time.Process(1, Text)
+
+        Thresholds = self.Thresholds(Image, nThresholds, Bins)
+        Array = self.GetArray(Image)
+        Labels = np.zeros(Array.shape, 'uint8')
+        for Start, Slab in self.Slabs(Array, Thresholds):
+            Labels[Start:Start+len(Slab)] = Slab
+
+        Labels = self.ToImage(Labels, Image)
+
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return Labels
+
+    def Binarize(self, Image, nThresholds=2, Value=1, Bins=None):
+
+        """
+        Binary image of the upper Otsu's class computed slab by slab
+        :param Image: Gray value image
+                      - Type: sitkImage or numpy array / memmap
+        :param nThresholds: Number of Otsu's thresholds
+        :param Value: Value given to the upper class voxels
+        :return Binary: Binary image
+                        - Type: uint8 sitkImage
+        """
+
+        if self.Echo:
+            Text = 'Otsu binarization'
+            Time.Process(1, Text)
+
+        Thresholds = self.Thresholds(Image, nThresholds, Bins)
+        Array = self.GetArray(Image)
+        Binary = np.zeros(Array.shape, 'uint8')
+        for Start in range(0, Array.shape[0], self.SlabSize):
+            Slab = Array[Start:Start+self.SlabSize]
+            Binary[Start:Start+len(Slab)] = (Slab > Thresholds[-1]) * Value
+
+        Binary = self.ToImage(Binary, Image)
+
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return Binary
+
+    def ToImage(self, Array, Reference):
+
+        Image = sitk.GetImageFromArray(Array)
+        if isinstance(Reference, sitk.Image):
+            Image.CopyInformation(Reference)
+
+        return Image
+
+    def Clear(self):
+
+        self.Cache = {}
+
+        return
+
+Histogram = Histogram()
+#%% Slice extraction functions
+class Slicer():
+
+    def __init__(self):
+        self.MaxSize = 1024
+        self.Stats = {}
+
+    def Stat(self, Image):
+
+        """
+        Gray values statistics of an image, computed slab by slab
+        once per image content and kept in cache
+        :return Stats: Dictionary with Min, Max and Levels (number
+                       of non-empty histogram bins, 2 for binary images)
+        """
+
+        Array = Histogram.GetArray(Image)
+        Key = Histogram.Key(Array)
+        if Key in self.Stats:
+            return Histogram.Store(self.Stats, Key, self.Stats.pop(Key))
+
+        Hist, Edges = Histogram.Compute(Array)
+        Stats = {'Min':Edges[0], 'Max':Edges[-1], 'Levels':np.count_nonzero(Hist)}
+
+        return Histogram.Store(self.Stats, Key, Stats)
+
+    def Extract(self, Image, Slice=None, Axis='Z', Factor=None):
+
+        """
+        Extract a single plane of an image without copying the volume
+        :param Image: 2D or 3D image
+                      - Type: sitkImage or numpy array / memmap (Z, Y, X)
+        :param Slice: Plane index, middle plane if None
+        :param Axis: Plane normal ('X', 'Y' or 'Z')
+        :param Factor: Display downsampling factor, chosen to fit the plane
+                       in self.MaxSize pixels if None (1 for full resolution)
+        :return Array: Plane ordered as the volume numpy indexing
+                       (e.g. (Z, X) for Axis='Y')
+                       - Type: numpy array
+        """
+
+        if isinstance(Image, sitk.Image):
+            if Image.GetDimension() == 3:
+                Image = GetSlice(Image, Slice, Axis)
+            Array = sitk.GetArrayFromImage(Image)
+
+        else:
+            Array = Image
+            if Array.ndim == 3:
+                iAxis = 2 - 'XYZ'.index(Axis)
+                if Slice is None:
+                    Slice = Array.shape[iAxis] // 2
+                Index = [slice(None)] * 3
+                Index[iAxis] = int(Slice)
+                Array = Array[tuple(Index)]
+            Array = np.array(Array)
+
+        if Factor is None:
+            Factor = self.Factor(Array.shape)
+
+        return self.Downsample(Array, Factor)
+
+    def Factor(self, Shape):
+
+        return max(1, int(np.ceil(max(Shape) / self.MaxSize)))
+
+    def Downsample(self, Array, Factor):
+
+        """
+        Block average of a plane, equivalent to a pyramid level
+        used for display only
+        """
+
+        if Factor == 1:
+            return Array
+
+        Shape = np.array(Array.shape[:2]) // Factor
+        Array = Array[:Shape[0]*Factor, :Shape[1]*Factor].astype('float')
+        Array = Array.reshape(Shape[0], Factor, Shape[1], Factor, *Array.shape[2:])
+
+        return Array.mean(axis=(1,3))
+
+    def Normalize(self, Array, Image=None, Range=None):
+
+        """
+        Scale a plane to uint8 using the min/max of the whole image
+        (cached statistics) or the given range
+        """
+
+        if Range is None:
+            Stats = self.Stat(Image)
+            Range = (Stats['Min'], Stats['Max'])
+
+        Array = (Array.astype('float') - Range[0]) / (Range[1] - Range[0])
+        Array = np.clip(Array, 0, 1) * 255
+
+        return Array.astype('uint8')
+
+    def Binarize(self, Array, Image, nThresholds=2):
+
+        """
+        Binarize a plane of a gray value image with the Otsu's thresholds
+        of the whole image (cached), binary images are kept unchanged
+        """
+
+        if self.Stat(Image)['Levels'] <= 2:
+            return self.Normalize(Array, Image)
+
+        Threshold = Histogram.Thresholds(Image, nThresholds)[-1]
+
+        return (Array > Threshold).astype('uint8') * 255
+
+    def Clear(self):
+
+        self.Stats = {}
+
+        return
+
+Slicer = Slicer()
 #%% Registration funtions
 class Registration():
 
     def __init__(self):
         self.Echo = True
+        self.Threads = None
 
     def Register(self, FixedImage, MovingImage, Type, FixedMask=None, MovingMask=None, Path=None, Dictionary={}):
 
@@ -1971,6 +2638,10 @@ class Registration():
         # Set Elastix and perform registration
         EIF = sitk.ElastixImageFilter()
         EIF.SetParameterMap(PM)
+
+        if self.Threads:
+            EIF.SetNumberOfThreads(self.Threads)
+
         EIF.SetFixedImage(FixedImage)
         EIF.SetMovingImage(MovingImage)
 
@@ -1998,7 +2669,128 @@ class Registration():
             Time.Process(0, Text)
 
         return Result_Image, TransformParameters
-        
+
+    def BSpline(self, FixedImage, MovingImage, GridSpacing, FixedMask=None, Shrink=[8, 4, 2, 1], Sigmas=None, GridSchedule=None, Sampling=0.1, Iterations=200, Bins=32, Seed=42):
+
+        """
+        B-spline registration using SimpleITK ImageRegistrationMethod as an
+        alternative engine to elastix, giving explicit control on metric
+        sampling and number of threads (self.Threads)
+        :param FixedImage: Fixed sitk image
+        :param MovingImage: Moving sitk image
+        :param GridSpacing: Final control points spacing in physical units
+        :param FixedMask: Mask restricting metric sampling in fixed image
+        :param Shrink: Shrink factors of each resolution level
+        :param Sigmas: Smoothing sigmas (voxels) of each level, default half shrink factors
+        :param GridSchedule: Control points spacing of each level relative to the final
+                             one (as elastix GridSpacingSchedule), default halved at
+                             each level (e.g. 8, 4, 2, 1). The coarsest grid is rounded
+                             so that the final spacing is matched up to this rounding
+        :param Sampling: Fraction of voxels randomly sampled by the metric
+        :param Iterations: Maximum number of optimizer iterations per level
+        :param Bins: Number of histogram bins of Mattes mutual information
+        :param Seed: Random sampling seed for reproducibility
+        :return ResultImage: Moving image resampled on fixed image grid
+                TransformParameters: Elastix-like transform parameter map (list)
+                DisplacementField: sitk displacement vector field on fixed grid
+        """
+
+        if self.Echo:
+            Text = 'ITK B-spline reg.'
+            Time.Process(1, Text)
+
+        Fixed = sitk.Cast(FixedImage, sitk.sitkFloat32)
+        Moving = sitk.Cast(MovingImage, sitk.sitkFloat32)
+
+        if Sigmas is None:
+            Sigmas = [F / 2 for F in Shrink]
+
+        if GridSchedule is None:
+            GridSchedule = [2 ** (len(Shrink) - 1 - i) for i in range(len(Shrink))]
+
+        # Coarse control points grid refined at each level (mesh size
+        # multiplied by the scale factors) up to the required spacing
+        Size = np.array(Fixed.GetSize())
+        PhysicalSize = (Size - 1) * np.array(Fixed.GetSpacing())
+        MeshSize = [max(1, int(round(P / S))) for P, S in zip(PhysicalSize, GridSpacing)]
+        ScaleFactors = [int(GridSchedule[0] // G) for G in GridSchedule]
+        MeshSize = [max(1, int(round(M / ScaleFactors[-1]))) for M in MeshSize]
+        Transform = sitk.BSplineTransformInitializer(Fixed, MeshSize, 3)
+
+        # Set up registration method
+        Method = sitk.ImageRegistrationMethod()
+        Method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=Bins)
+        Method.SetMetricSamplingStrategy(Method.RANDOM)
+        Method.SetMetricSamplingPercentage(Sampling, Seed)
+        if FixedMask is not None:
+            Method.SetMetricFixedMask(sitk.Cast(FixedMask, sitk.sitkUInt8))
+
+        Method.SetInterpolator(sitk.sitkLinear)
+        Method.SetOptimizerAsLBFGSB(gradientConvergenceTolerance=1e-5,
+                                    numberOfIterations=Iterations,
+                                    maximumNumberOfCorrections=5,
+                                    maximumNumberOfFunctionEvaluations=4*Iterations)
+        Method.SetShrinkFactorsPerLevel(Shrink)
+        Method.SetSmoothingSigmasPerLevel(Sigmas)
+        Method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOff()
+        Method.SetInitialTransformAsBSpline(Transform, inPlace=True, scaleFactors=ScaleFactors)
+
+        if self.Threads:
+            Method.SetNumberOfThreads(self.Threads)
+
+        if self.Echo:
+            Update = lambda: Time.Update((Method.GetCurrentLevel()+1) / len(Shrink), Text)
+            Method.AddCommand(sitk.sitkMultiResolutionIterationEvent, Update)
+
+        Method.Execute(Fixed, Moving)
+
+        # Resample moving image and compute displacement field
+        ResultImage = sitk.Resample(Moving, Fixed, Transform, sitk.sitkLinear, 0.0)
+        DisplacementField = sitk.TransformToDisplacementField(Transform, sitk.sitkVectorFloat64,
+                                                              Fixed.GetSize(), Fixed.GetOrigin(),
+                                                              Fixed.GetSpacing(), Fixed.GetDirection())
+
+        # Build elastix/transformix compatible parameter map
+        D = Fixed.GetDimension()
+        FP = np.array(Transform.GetFixedParameters())
+        Float = lambda Values: ['%.12g' % V for V in Values]
+        PM = {'Transform':['BSplineTransform'],
+              'NumberOfParameters':[str(Transform.GetNumberOfParameters())],
+              'TransformParameters':Float(Transform.GetParameters()),
+              'InitialTransformParametersFileName':['NoInitialTransform'],
+              'HowToCombineTransforms':['Compose'],
+              'FixedImageDimension':[str(D)],
+              'MovingImageDimension':[str(D)],
+              'FixedInternalImagePixelType':['float'],
+              'MovingInternalImagePixelType':['float'],
+              'Size':[str(S) for S in Fixed.GetSize()],
+              'Index':['0'] * D,
+              'Spacing':Float(Fixed.GetSpacing()),
+              'Origin':Float(Fixed.GetOrigin()),
+              'Direction':Float(Fixed.GetDirection()),
+              'UseDirectionCosines':['true'],
+              'GridSize':[str(int(S)) for S in FP[:D]],
+              'GridIndex':['0'] * D,
+              'GridOrigin':Float(FP[D:2*D]),
+              'GridSpacing':Float(FP[2*D:3*D]),
+              'GridDirection':Float(FP[3*D:]),
+              'BSplineTransformSplineOrder':['3'],
+              'UseCyclicTransform':['false'],
+              'ResampleInterpolator':['FinalBSplineInterpolator'],
+              'FinalBSplineInterpolationOrder':['3'],
+              'Resampler':['DefaultResampler'],
+              'DefaultPixelValue':['0'],
+              'ResultImageFormat':['mhd'],
+              'ResultImagePixelType':['float'],
+              'CompressResultImage':['false']}
+        TransformParameters = [PM]
+
+        # Print elapsed time
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return ResultImage, TransformParameters, DisplacementField
+
     def ComputeInverse(self, FixedImage, TPMFileName, MovingImage=None, Path=None):
 
         """
@@ -2013,6 +2805,10 @@ class Registration():
         EF = sitk.ElastixImageFilter()
         EF.SetFixedImage(FixedImage)
         EF.SetMovingImage(FixedImage)
+
+        if self.Threads:
+            EF.SetNumberOfThreads(self.Threads)
+
         EF.SetInitialTransformParameterFileName(TPMFileName)
 
         EF.SetParameter('HowToCombineTransforms','Compose')
@@ -2056,6 +2852,9 @@ class Registration():
         TIF.ComputeDeterminantOfSpatialJacobianOff()
         TIF.SetTransformParameterMap(TransformParameterMap)
 
+        if self.Threads:
+            TIF.SetNumberOfThreads(self.Threads)
+
         if Jacobian:
             TIF.ComputeDeformationFieldOn()
             TIF.ComputeSpatialJacobianOn()
@@ -2082,6 +2881,39 @@ class Registration():
 
         return ResultImage
  
+    def DisplacementField(self, Image, TransformParameterMap):
+
+        """
+        Compute displacement field of an elastix transform in memory
+        (no deformation field or spatial Jacobian files written)
+        :param Image: sitk image defining the output grid
+        :param TransformParameterMap: Transform parameter map from elastix
+        :return Field: sitk displacement vector field
+        """
+
+        if self.Echo:
+            Text = 'Displacement'
+            Time.Process(1, Text)
+
+        TIF = sitk.TransformixImageFilter()
+        TIF.ComputeDeterminantOfSpatialJacobianOff()
+        TIF.ComputeSpatialJacobianOff()
+        TIF.ComputeDeformationFieldOn()
+        TIF.LogToConsoleOff()
+        TIF.SetTransformParameterMap(TransformParameterMap)
+
+        if self.Threads:
+            TIF.SetNumberOfThreads(self.Threads)
+
+        TIF.SetMovingImage(Image)
+        TIF.Execute()
+        Field = TIF.GetDeformationField()
+
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return Field
+
     def ApplyCustom(self, Image, TransformParameterMap):
 
         """
@@ -2151,11 +2983,251 @@ class Registration():
         return Image_T
 
 Registration = Registration()
+#%% Deformation functions
+class Deformation():
+
+    def __init__(self):
+        self.Echo = True
+
+    def Gradient(self, Field, Factor=None, SlabSize=32):
+
+        """
+        Compute deformation gradient F = I + grad(u) of a displacement field
+        using central finite differences, slab by slab in float32
+        :param Field: sitk displacement vector field (ux, uy, uz)
+        :param Factor: Optional integer block size used to average F
+                       (e.g. hFE element size / field spacing)
+        :param SlabSize: Number of slices computed at once
+        :return F: Array of shape (Z, Y, X, 3, 3)
+                Spacing: Spacing of F array (x, y, z)
+        """
+
+        if self.Echo:
+            Text = 'Def. gradient'
+            Time.Process(1, Text)
+
+        Array = sitk.GetArrayViewFromImage(Field)
+        Spacing = np.array(Field.GetSpacing())
+        Dimension = Field.GetDimension()
+        Shape = np.array(Array.shape[:Dimension])
+        Identity = np.eye(Dimension, dtype='float32')
+
+        if Factor:
+            SlabSize = int(np.ceil(SlabSize / Factor) * Factor)
+            BlockFactor = [Factor] * Dimension + [1, 1]
+            F = np.zeros(tuple(Shape // Factor) + (Dimension, Dimension), 'float32')
+        else:
+            F = np.zeros(tuple(Shape) + (Dimension, Dimension), 'float32')
+
+        for Start in range(0, Shape[0], SlabSize):
+
+            # Add one slice halo to keep central differences at slab borders
+            Stop = min(Start + SlabSize, Shape[0])
+            Low, High = max(Start - 1, 0), min(Stop + 1, Shape[0])
+            U = np.asarray(Array[Low:High], 'float32')
+
+            # F_ij = delta_ij + du_i/dx_j, array axes are ordered (z, y, x)
+            Slab = np.zeros((Stop - Start,) + U.shape[1:Dimension] + (Dimension, Dimension), 'float32')
+            for i in range(Dimension):
+                Gradients = np.gradient(U[..., i], *Spacing[::-1])
+                for j in range(Dimension):
+                    Slab[..., i, j] = Gradients[Dimension-1-j][Start-Low:Stop-Low]
+            Slab += Identity
+
+            if Factor:
+                Reduced = BlockReduce(Slab, BlockFactor, 'mean').astype('float32')
+                F[Start//Factor:Start//Factor + len(Reduced)] = Reduced
+            else:
+                F[Start:Stop] = Slab
+
+            if self.Echo:
+                Time.Update(Stop / Shape[0], Text)
+
+        if Factor:
+            Spacing = Spacing * Factor
+
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return F, Spacing
+
+    def Decompose(self, F):
+
+        """
+        Unimodular decomposition of deformation gradients
+        :param F: Array of deformation gradients (..., 3, 3) or (..., 9)
+        :return SphericalCompression: J = det(F)
+                IsovolumicDeformation: Norm of F~ = J^(-1/3) F, 0 where J <= 0
+        """
+
+        if F.shape[-1] == 9 or F.shape[-1] == 4:
+            Dimension = int(np.sqrt(F.shape[-1]))
+            F = F.reshape(F.shape[:-1] + (Dimension, Dimension))
+
+        SphericalCompression = np.linalg.det(F)
+
+        Norm = np.linalg.norm(F, axis=(-2, -1))
+        Positive = SphericalCompression > 0
+        IsovolumicDeformation = np.zeros(SphericalCompression.shape, SphericalCompression.dtype)
+        IsovolumicDeformation[Positive] = np.cbrt(1 / SphericalCompression[Positive]) * Norm[Positive]
+
+        return SphericalCompression, IsovolumicDeformation
+
+Deformation = Deformation()
+#%% Batch functions
+def BatchInitializer(Threads):
+
+    """
+    Limit the number of threads used by each worker process
+    to avoid oversubscription when several samples run in parallel
+    BLAS/OpenMP libraries are already loaded at this point, their
+    pools are limited with threadpoolctl when it is installed
+    :param Threads: Number of threads allowed per worker
+    """
+
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(Threads)
+    numba.set_num_threads(min(Threads, numba.config.NUMBA_NUM_THREADS))
+    Registration.Threads = Threads
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=Threads)
+    except ImportError:
+        pass
+
+    return
+
+def BatchWorker(Job):
+
+    """
+    Run a single batch job and write its status file
+    :param Job: Tuple (Function, Name, Arguments, StatusFile)
+    :return Status: Dictionary with job name, status, time and memory
+    """
+
+    Function, Name, Arguments, StatusFile = Job
+
+    Status = {'Name':Name, 'Status':'Running', 'PID':os.getpid(),
+              'Start':time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(StatusFile, 'w') as File:
+        json.dump(Status, File, indent=2)
+
+    Tic = time.time()
+    try:
+        Function(Name, Arguments)
+        Status['Status'] = 'Done'
+    except Exception:
+        Status['Status'] = 'Failed'
+        Status['Error'] = traceback.format_exc()
+
+    # Peak resident memory of the worker (MB)
+    if os.name == 'posix':
+        Memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    elif os.name == 'nt':
+        Memory = psutil.Process().memory_info().peak_wset / 1024**2
+    Status['Time'] = round(time.time() - Tic, 1)
+    Status['Memory'] = round(Memory, 1)
+
+    with open(StatusFile, 'w') as File:
+        json.dump(Status, File, indent=2)
+
+    return Status
+
+class Batch():
+
+    def __init__(self):
+        self.Echo = True
+        self.Threads = 1
+        self.Processes = None
+
+    def Status(self, StatusDir, Name):
+
+        """
+        Read status of a job from its status file
+        :param StatusDir: Directory containing the status files
+        :param Name: Job name
+        :return Status: Dictionary with job status, empty if never run
+        """
+
+        StatusFile = Path(StatusDir) / (str(Name) + '.json')
+        if not StatusFile.exists():
+            return {}
+
+        with open(StatusFile, 'r') as File:
+            Status = json.load(File)
+
+        return Status
+
+    def Run(self, Function, Names, Arguments, StatusDir, Resume=True):
+
+        """
+        Distribute independent jobs (e.g. samples) across a pool of processes
+        Each worker is limited to self.Threads threads, the number of processes
+        defaults to the number of cores divided by self.Threads.
+        Status of each job is stored in StatusDir/Name.json and a summary
+        in StatusDir/Report.csv
+        :param Function: Module level function called as Function(Name, Arguments)
+        :param Names: List of job names (e.g. samples ids)
+        :param Arguments: Arguments passed to each function call
+        :param StatusDir: Directory where status files and report are written
+        :param Resume: Skip jobs already successfully done
+        :return Report: Pandas data frame with status, time (s) and memory (MB) of each job
+        """
+
+        os.makedirs(StatusDir, exist_ok=True)
+
+        Processes = self.Processes
+        if not Processes:
+            Processes = max(1, os.cpu_count() // self.Threads)
+
+        # Collect jobs to run
+        Jobs = []
+        for Name in Names:
+            if Resume and self.Status(StatusDir, Name).get('Status') == 'Done':
+                continue
+            StatusFile = str(Path(StatusDir) / (str(Name) + '.json'))
+            Jobs.append((Function, Name, Arguments, StatusFile))
+        Processes = max(1, min(Processes, len(Jobs)))
+
+        if self.Echo:
+            Text = 'Batch'
+            Time.Process(1, Text)
+            print(f'\n{len(Jobs)} job(s) on {Processes} process(es) x {self.Threads} thread(s)')
+            Time.Update(0, Text)
+
+        # Run jobs, one fresh process per job to release memory
+        if len(Jobs) > 0:
+            with Pool(Processes, BatchInitializer, (self.Threads,), maxtasksperchild=1) as Workers:
+                for i, Status in enumerate(Workers.imap_unordered(BatchWorker, Jobs)):
+                    if self.Echo:
+                        Time.Update((i+1) / len(Jobs), Text)
+
+        # Aggregate status of all jobs (same columns if there is no job)
+        Statuses = []
+        for Name in Names:
+            Status = self.Status(StatusDir, Name)
+            Status['Name'] = Name
+            Status.setdefault('Status', 'Pending')
+            Statuses.append(Status)
+        Columns = ['Name', 'Status', 'PID', 'Start', 'Time', 'Memory']
+        Report = pd.DataFrame(Statuses, columns=Columns)
+        Report[['Time', 'Memory']] = Report[['Time', 'Memory']].astype(float)
+        Report.to_csv(str(Path(StatusDir) / 'Report.csv'), index=False)
+
+        if self.Echo:
+            Time.Process(0, Text)
+            Failed = Report[Report['Status'] != 'Done']
+            if len(Failed) > 0:
+                print('Failed jobs: ' + ', '.join([str(N) for N in Failed['Name']]))
+
+        return Report
+
+Batch = Batch()
 #%% Signal treatment functions
 class Signal():
 
     def __init__(self):
-        pass
+        self.SOS = {}
 
     def FFT(self, Signal, Sampling, Show=False):
 
@@ -2206,64 +3278,302 @@ class Signal():
 
         return
 
+    def Butterworth(self, Sampling, Frequency, Order=2):
+
+        """
+        Low-pass Butterworth filter second-order sections,
+        designed once for each set of parameters
+        """
+
+        Key = (float(Sampling), float(Frequency), int(Order))
+        if Key not in self.SOS:
+            self.SOS[Key] = sig.butter(Order, Frequency / Sampling, output='sos')
+
+        return self.SOS[Key]
+
     def Filter(self, Signal, Sampling, Frequency, Order=2, Show=False):
         
         """
         Filter signal and look filtering effect
 
-        :param Signal: signal to filter
+        :param Signal: signal(s) to filter, channels are filtered along
+                       their last axis
+                       - Type: numpy array (N) or (C, N)
         :param Sampling: signal sampling interval (in /s or /m)
         :param Frequency: cut-off frequency
         :param Order: filter order
         :param Show: plot results
         """
         
-        SOS = sig.butter(Order, Frequency / Sampling, output='sos')
-        FilteredSignal = sig.sosfiltfilt(SOS, Signal)
+        SOS = self.Butterworth(Sampling, Frequency, Order)
+        FilteredSignal = sig.sosfiltfilt(SOS, Signal, axis=-1)
 
         if Show:
             Figure, Axis = plt.subplots(1,1)
-            Axis.plot(Signal, color=(0,0,0))
-            Axis.plot(FilteredSignal, color=(1,0,0))
+            Axis.plot(np.transpose(Signal), color=(0,0,0))
+            Axis.plot(np.transpose(FilteredSignal), color=(1,0,0))
             plt.show()
 
         return FilteredSignal
 
-    def MaxSlope(self, X, Y=[], WindowWidth=1, StepSize=1):
+    def Interpolate(self, X, XData, YData):
 
-        if len(Y) == 0:
-            Y = X.copy()
-            X = np.arange(len(X))
+        """
+        Linear interpolation of several channels sampled at the same
+        points, bins and weights are computed once for all channels
+        (same result as np.interp on each channel)
+
+        :param X: Points where to interpolate
+                  - Type: numpy array (M)
+        :param XData: Increasing sampling points
+                      - Type: numpy array (N)
+        :param YData: Channels values
+                      - Type: numpy array (N) or (C, N)
+        :return Y: Interpolated channels
+                   - Type: numpy array (M) or (C, M)
+        """
 
-        Slope = NumbaMaxSlope(np.array(X), np.array(Y), int(WindowWidth), StepSize)
+        X = np.asarray(X, float)
+        XData = np.asarray(XData, float)
+        YData = np.asarray(YData, float)
 
-        return Slope
+        Index = np.clip(np.searchsorted(XData, X, side='right') - 1, 0, len(XData) - 2)
+        dX = XData[Index+1] - XData[Index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Weight = np.where(dX > 0, (X - XData[Index]) / dX, 0)
+        Weight = np.clip(Weight, 0, 1)
 
-@njit
-def NumbaMaxSlope(Xdata, Ydata, WindowWidth, StepSize):
+        Y = YData[..., Index] * (1 - Weight) + YData[..., Index+1] * Weight
 
-    Slopes = []
-    Iterations = round((len(Xdata) - WindowWidth) / StepSize)
-    
-    for i in range(Iterations):
+        return Y
+
+    def Condition(self, X, XData, YData, Sampling, Frequency, Order=2):
+
+        """
+        Resample channels at regular points and low-pass filter them,
+        all channels are processed at once
+        :return Y: Conditioned channels
+                   - Type: numpy array (M) or (C, M)
+        """
+
+        Y = self.Interpolate(X, XData, YData)
+        Y = self.Filter(Y, Sampling, Frequency, Order)
+
+        return Y
+
+    def TimeBase(self, Time, State=None):
+
+        """
+        Build a monotonic time base from time stamps that are reset to 0
+        at junctions between protocols (e.g. MTS records). Samples after
+        a reset are shifted by the time reached before it, any number of
+        resets is handled. Long records can be processed by chunks, the
+        returned state being given with the next chunk
+
+        :param Time: Recorded time stamps
+                     - Type: numpy array (N)
+        :param State: State returned by the previous chunk (None for first)
+        :return Corrected: Monotonic time
+                           - Type: numpy array (N)
+                Junctions: Indices of the last samples before resets
+                           (-1 if it was the last sample of previous chunk)
+                           - Type: numpy array
+                State: Offset and last time stamp to continue on next chunk
+                       - Type: dict
+        """
+
+        Time = np.asarray(Time, float)
+        if State is None:
+            State = {'Offset':0.0, 'Last':None}
+
+        # Prepend last sample of previous chunk to detect resets at boundary
+        Previous = State['Last'] is not None
+        if Previous:
+            Time = np.concatenate([[State['Last']], Time])
+
+        Junctions = np.where(np.diff(Time) < 0)[0]
+        Increment = np.zeros(len(Time))
+        Increment[Junctions+1] = Time[Junctions]
+        Offset = State['Offset'] + np.cumsum(Increment)
+        Corrected = Time + Offset
+
+        State = {'Offset':Offset[-1] if len(Time) > 0 else State['Offset'],
+                 'Last':Time[-1] if len(Time) > 0 else State['Last']}
+
+        if Previous:
+            Corrected = Corrected[1:]
+            Junctions = Junctions - 1
+
+        return Corrected, Junctions, State
+
+    def Align(self, Reference, Signal, MinLag=None, MaxLag=None, MinOverlap=None):
+
+        """
+        Find the lag maximizing the normalized FFT cross-correlation
+        between a reference and a signal, i.e. Signal[n + Lag] best
+        matches Reference[n], refined to sub-sample accuracy by
+        parabolic interpolation of the correlation peak
+        The correlation is the Pearson coefficient over the overlapping
+        part of both signals (each window centred by its own mean), so
+        that offsets of the records do not bias the lag. By default the
+        reference must overlap the signal entirely, partial overlaps of
+        a ramp would otherwise correlate as well as the true position
+
+        :param Reference: Reference signal
+                          - Type: numpy array (N)
+        :param Signal: Signal to align
+                       - Type: numpy array (M)
+        :param MinLag: Smallest lag (samples) considered
+        :param MaxLag: Largest lag (samples) considered
+        :param MinOverlap: Smallest number of overlapping samples
+                           considered (default full overlap)
+        :return Lag: Lag of the signal with respect to the reference
+                     - Type: float
+                Correlation: Normalized correlation at the peak (-1 to 1)
+                Confidence: 1 - highest correlation at least one reference
+                            cycle away from the peak / main peak, close
+                            to 0 when the alignment is ambiguous
+        """
+
+        R = np.asarray(Reference, float)
+        S = np.asarray(Signal, float)
+        R = R - R.mean()
+        S = S - S.mean()
+        nR, nS = len(R), len(S)
+
+        if MinOverlap is None:
+            MinOverlap = max(2, min(nR, nS))
+
+        # Raw cross-products sum over the overlap for each lag
+        Correlation = sig.correlate(S, R, mode='full', method='fft')
+        Lags = sig.correlation_lags(nS, nR, mode='full')
+
+        # Overlapping parts R[RStart:RStop] and S[RStart+Lag:RStop+Lag]
+        RStart = np.clip(-Lags, 0, nR)
+        RStop = np.clip(nS - Lags, 0, nR)
+        SStart = RStart + Lags
+        SStop = RStop + Lags
+        N = RStop - RStart
+
+        # Windows sums and sums of squares from cumulative sums
+        R1 = np.concatenate([[0], np.cumsum(R)])
+        R2 = np.concatenate([[0], np.cumsum(R**2)])
+        S1 = np.concatenate([[0], np.cumsum(S)])
+        S2 = np.concatenate([[0], np.cumsum(S**2)])
+        SumR = R1[RStop] - R1[RStart]
+        SumS = S1[SStop] - S1[SStart]
+
+        # Pearson correlation of the centred windows
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Covariance = Correlation - SumR * SumS / N
+            VarR = R2[RStop] - R2[RStart] - SumR**2 / N
+            VarS = S2[SStop] - S2[SStart] - SumS**2 / N
+            Norm = np.sqrt(np.maximum(VarR, 0) * np.maximum(VarS, 0))
+            Correlation = np.where((N >= MinOverlap) & (Norm > 0), Covariance / Norm, 0)
+
+        Valid = N >= MinOverlap
+        if MinLag is not None:
+            Valid &= Lags >= MinLag
+        if MaxLag is not None:
+            Valid &= Lags <= MaxLag
+        Correlation = np.where(Valid, Correlation, -1)
+
+        i = np.argmax(Correlation)
+        Peak = Correlation[i]
+        Lag = float(Lags[i])
+
+        # Sub-sample refinement
+        if 0 < i < len(Lags) - 1 and Valid[i-1] and Valid[i+1]:
+            a, b, c = Correlation[i-1:i+2]
+            Denominator = a - 2*b + c
+            if Denominator < 0:
+                Lag += 0.5 * (a - c) / Denominator
+
+        # Reference cycle, first autocorrelation maximum or
+        # correlation length for aperiodic signals
+        Auto = sig.correlate(R, R, mode='full', method='fft')[nR-1:]
+        Auto = Auto / Auto[0] if Auto[0] > 0 else Auto
+        Maxima = sig.find_peaks(Auto, prominence=0.1)[0]
+        if len(Maxima) > 0:
+            Cycle = Maxima[0]
+        else:
+            Negative = np.where(Auto <= 0)[0]
+            Cycle = Negative[0] if len(Negative) > 0 else nR
+
+        # Ambiguity with respect to lags at least one cycle away
+        Far = Valid & (np.abs(Lags - Lags[i]) >= Cycle)
+        Second = max(Correlation[Far].max(), 0) if Far.any() else 0
+        Confidence = 1 - Second / Peak if Peak > 0 else 0
+
+        return Lag, Peak, Confidence
+
+    def RollingRegression(self, X, Y, Widths, Step=1):
+
+        """
+        Linear least-squares regression of Y on X over sliding windows,
+        computed for all windows at once from cumulative sums of x, y,
+        x², xy and y² (O(N) per window width)
+
+        :param X: Independent variable
+                  - Type: numpy array (N)
+        :param Y: Dependent variable
+                  - Type: numpy array (N)
+        :param Widths: Window width(s) in number of points
+                       - Type: int or list of int
+        :param Step: Stride between consecutive windows starts
+        :return Results: Start index, width, slope, intercept, R²
+                         and slope standard error of each window
+                         - Type: pandas data frame
+        """
+
+        X = np.asarray(X, float)
+        Y = np.asarray(Y, float)
 
-        Start = i * StepSize
-        Stop = Start + WindowWidth
-        XPoints = Xdata[Start:Stop] 
-        YPoints = Ydata[Start:Stop] 
-        N = len(XPoints)
+        # Center data to limit cancellation in the sums
+        Mx, My = X.mean(), Y.mean()
+        Xc, Yc = X - Mx, Y - My
 
-        X = np.ones((N,2))
-        X[:,1] = XPoints
-        Y = np.reshape(YPoints, (N,1))
+        Sums = []
+        for Values in [Xc, Yc, Xc*Xc, Xc*Yc, Yc*Yc]:
+            Sums.append(np.concatenate([[0], np.cumsum(Values)]))
 
-        X1 = np.linalg.inv(np.dot(X.T, X))
-        Intercept, Coefficient = np.dot(X1, np.dot(X.T, Y))
-        Slopes.append(Coefficient)
+        Results = []
+        for Width in np.atleast_1d(Widths):
 
-    Slope = max(Slopes)[0]
+            Width = int(Width)
+            Start = np.arange(0, len(X) - Width + 1, Step)
+            Stop = Start + Width
+            Sx, Sy, Sxx, Sxy, Syy = [C[Stop] - C[Start] for C in Sums]
 
-    return Slope
+            # Centered sums of squares and products of each window
+            SSxx = Sxx - Sx**2 / Width
+            SSxy = Sxy - Sx * Sy / Width
+            SSyy = Syy - Sy**2 / Width
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                Slope = SSxy / SSxx
+                Intercept = (My + Sy / Width) - Slope * (Mx + Sx / Width)
+                R2 = np.clip(SSxy**2 / (SSxx * SSyy), 0, 1)
+                StdErr = np.sqrt((1 - R2) * SSyy / SSxx / (Width - 2))
+
+            Results.append(pd.DataFrame({'Start':Start, 'Width':Width,
+                                         'Slope':Slope, 'Intercept':Intercept,
+                                         'R2':R2, 'StdErr':StdErr}))
+
+        Results = pd.concat(Results, ignore_index=True)
+
+        return Results
+
+    def MaxSlope(self, X, Y=[], WindowWidth=1, StepSize=1):
+
+        if len(Y) == 0:
+            Y = X.copy()
+            X = np.arange(len(X))
+
+        Results = self.RollingRegression(X, Y, WindowWidth, StepSize)
+        Slope = np.nanmax(Results['Slope'])
+
+        return Slope
 
 Signal = Signal()
 #%% Abaqus functions
@@ -3525,81 +4835,77 @@ class Morphometry():
 
     def __init__(self):
         self.Echo = True
+        self.MILCache = {}
+        self.SphereCache = {}
         pass
 
-    def SplitTriangle(self, Tri):
+    def SplitTriangle(self, Triangles):
 
         """ 
         Used in SphereTriangles for MIL computation
-        Splits one triange into four triangles. 
-        """
-
-        P1 = Tri[0]
-        P2 = Tri[1]
-        P3 = Tri[2]
-        P1x = P1[0]
-        P1y = P1[1]
-        P1z = P1[2]
-        P2x = P2[0]
-        P2y = P2[1]
-        P2z = P2[2]
-        P3x = P3[0]
-        P3y = P3[1]
-        P3z = P3[2]
-        P4 = ((P1x + P2x) / 2, (P1y + P2y) / 2, (P1z + P2z) / 2)
-        P5 = ((P3x + P2x) / 2, (P3y + P2y) / 2, (P3z + P2z) / 2)
-        P6 = ((P1x + P3x) / 2, (P1y + P3y) / 2, (P1z + P3z) / 2)
-        nTri1 = (P1, P4, P6)
-        nTri2 = (P4, P2, P5)
-        nTri3 = (P4, P5, P6)
-        nTri4 = (P5, P3, P6)
-        return nTri1, nTri2, nTri3, nTri4
+        Splits each triange into four triangles. 
+        :param Triangles: Array of triangles (T, 3, 3)
+        :return: Array of triangles (4T, 3, 3), children of a triangle are consecutive
+        """
+
+        P1 = Triangles[:, 0]
+        P2 = Triangles[:, 1]
+        P3 = Triangles[:, 2]
+        P4 = (P1 + P2) / 2
+        P5 = (P3 + P2) / 2
+        P6 = (P1 + P3) / 2
+        nTri1 = np.stack([P1, P4, P6], axis=1)
+        nTri2 = np.stack([P4, P2, P5], axis=1)
+        nTri3 = np.stack([P4, P5, P6], axis=1)
+        nTri4 = np.stack([P5, P3, P6], axis=1)
+
+        return np.stack([nTri1, nTri2, nTri3, nTri4], axis=1).reshape(-1, 3, 3)
     
     def CorrectValues(self, X, Y, Z, Precision=1e-06):
 
         """
         Used in Project2UnitSphere for MIL computation
-        Ensure that current direction do not go through corner or edge  
-        i.e. has an angle of 45 deg.
+        Ensure that directions do not go through corner or edge  
+        i.e. have an angle of 45 deg.
         """
 
-        C1 = abs(int(X / Precision)) == abs(int(Y / Precision))
-        C2 = abs(int(X / Precision)) == abs(int(Z / Precision))
+        iX = np.abs(np.trunc(X / Precision))
+        iY = np.abs(np.trunc(Y / Precision))
+        iZ = np.abs(np.trunc(Z / Precision))
+
+        C1 = iX == iY
+        C2 = iX == iZ
+        C3 = iZ == iY
 
-        if C1 and C2:
-            X += Precision
-            Z += 2.0 * Precision
-        elif abs(int(X / Precision)) == abs(int(Y / Precision)):
-            X += Precision
-        elif abs(int(X / Precision)) == abs(int(Z / Precision)):
-            X += Precision
-        elif abs(int(Z / Precision)) == abs(int(Y / Precision)):
-            Z += Precision
+        X = X + Precision * (C1 | C2)
+        Z = Z + 2.0 * Precision * (C1 & C2) + Precision * (C3 & ~C1 & ~C2)
 
-        return (X, Y, Z)
+        return X, Y, Z
 
-    def Project2UnitSphere(self, PointRS):
+    def Project2UnitSphere(self, PointsRS):
 
         """
         Used in SphereTriangles for MIL computation
-        Projects an equally sided triangle patch to a unit sphere
+        Projects points of an equally sided triangle patch to a unit sphere
+        :param PointsRS: Array of points (..., 3)
+        :return: Projected points (..., 3)
         """
 
         S45 = np.sin(np.pi / 4.0)
-        XYZ = [(0.0, 0.0, 0.0),
-               (1.0, 0.0, 0.0),
-               (0.0, 1.0, 0.0),
-               (0.0, 0.0, 1.0),
-               (0.5, 0.0, 0.0),
-               (S45, S45, 0.0),
-               (0.0, 0.5, 0.0),
-               (S45, 0.0, S45),
-               (0.0, S45, S45),
-               (0.0, 0.0, 0.5)]
-
-        R = PointRS[0]
-        S = PointRS[1]
-        T = PointRS[2]
+        XYZ = np.array([(0.0, 0.0, 0.0),
+                        (1.0, 0.0, 0.0),
+                        (0.0, 1.0, 0.0),
+                        (0.0, 0.0, 1.0),
+                        (0.5, 0.0, 0.0),
+                        (S45, S45, 0.0),
+                        (0.0, 0.5, 0.0),
+                        (S45, 0.0, S45),
+                        (0.0, S45, S45),
+                        (0.0, 0.0, 0.5)])
+
+        R = PointsRS[..., 0]
+        S = PointsRS[..., 1]
+        T = PointsRS[..., 2]
 
         N5 = 4.0 * R * (1.0 - R - S - T)
         N6 = 4.0 * R * S
@@ -3613,20 +4919,13 @@ class Morphometry():
         N3 = S - 0.5 * N6 - 0.5 * N7 - 0.5 * N9
         N4 = T - 0.5 * N8 - 0.5 * N9 - 0.5 * N10
 
-        aN = [N1, N2, N3, N4, N5, N6, N7, N8, N9, N10]
-        X = 0.0
-        Y = 0.0
-        Z = 0.0
-        for Node in range(10):
-            X += XYZ[Node][0] * aN[Node]
-            Y += XYZ[Node][1] * aN[Node]
-            Z += XYZ[Node][2] * aN[Node]
-
+        aN = np.stack([N1, N2, N3, N4, N5, N6, N7, N8, N9, N10], axis=-1)
+        X, Y, Z = np.moveaxis(np.dot(aN, XYZ), -1, 0)
         X, Y, Z = self.CorrectValues(X, Y, Z)
 
-        Factor = 1.0 / np.sqrt(X * X + Y * Y + Z * Z)
+        Points = np.stack([X, Y, Z], axis=-1)
 
-        return (Factor * X, Factor * Y, Factor * Z)
+        return Points / np.linalg.norm(Points, axis=-1, keepdims=True)
 
     def SphereTriangles(self, nDirs):
 
@@ -3637,87 +4936,97 @@ class Morphometry():
                        (No of triangles = 8*4^power). 
                        - TYPE: int          
                       
-         :return: Triangles: List of triangles 
-                  - TYPE: list[ (x1,y1,z1), (x2,y2,z2), (x3,y3,z3) ]
-                  - float xi, yi, zi ... x,y,z coordinates of triangle corner point i                          
-        """
-
-        Triangles = []
-        Triangles.append(((1.0, 0.0, 0.0),
-                          (0.0, 1.0, 0.0),
-                          (0.0, 0.0, 1.0)))
-        for cDir in range(int(nDirs)):
-            NewTriangles = []
-            for Triangle in Triangles:
-                nTri1, nTri2, nTri3, nTri4 = self.SplitTriangle(Triangle)
-                NewTriangles.append(nTri1)
-                NewTriangles.append(nTri2)
-                NewTriangles.append(nTri3)
-                NewTriangles.append(nTri4)
-
-            Triangles = NewTriangles
-
-        NewTriangles = []
-        for Triangle in Triangles:
-            nP1 = self.Project2UnitSphere(Triangle[0])
-            nP2 = self.Project2UnitSphere(Triangle[1])
-            nP3 = self.Project2UnitSphere(Triangle[2])
-            nTr = (nP1, nP2, nP3)
-            NewTriangles.append(nTr)
-
-        Triangles = NewTriangles
-        NewTriangles2 = []
-        for Triangle in Triangles:
-            NewTriangles2.append(Triangle)
-            T1 = (Triangle[0][0], -Triangle[0][1], Triangle[0][2])
-            T2 = (Triangle[1][0], -Triangle[1][1], Triangle[1][2])
-            T3 = (Triangle[2][0], -Triangle[2][1], Triangle[2][2])
-            NewTriangles2.append((T1, T2, T3))
-
-        Triangles = NewTriangles2
-        NewTriangles3 = []
-        for Triangle in Triangles:
-            NewTriangles3.append(Triangle)
-            T1 = (-Triangle[0][0], Triangle[0][1], Triangle[0][2])
-            T2 = (-Triangle[1][0], Triangle[1][1], Triangle[1][2])
-            T3 = (-Triangle[2][0], Triangle[2][1], Triangle[2][2])
-            NewTriangles3.append((T1, T2, T3))
-
-        Triangles = NewTriangles3
-        NewTriangles4 = []
-        for Triangle in Triangles:
-            NewTriangles4.append(Triangle)
-            T1 = (Triangle[0][0], Triangle[0][1], -Triangle[0][2])
-            T2 = (Triangle[1][0], Triangle[1][1], -Triangle[1][2])
-            T3 = (Triangle[2][0], Triangle[2][1], -Triangle[2][2])
-            NewTriangles4.append((T1, T2, T3))
-
-        Triangles = NewTriangles4
-        return Triangles
-
-    def AreaAndCOG(self, Triangle):
+         :return: Triangles: Array of triangles 
+                  - TYPE: float numpy.array[8*4^power, 3, 3]
+                  - Triangles[i, j] ... x,y,z coordinates of triangle i corner j                          
+        """
 
-        """ 
-        Used in NormalAndArea for MIL computation
-        Computes area and center of gravity of a triangle
-        The length of the normal is "1". 
+        return self.Sphere(nDirs)[0]
+
+    def Sphere(self, Power):
+
+        """
+        Geodesic unit sphere obtained by refinement of the first octant
+        triangle and mirroring, computed once per power and cached.
+        Shared by MIL, fabric and stiffness surface computations.
+
+        :param Power: Parameter for number of triangles on unit sphere 
+                      (No of triangles = 8*4^power). 
+                      - TYPE: int
+
+        :return: Triangles: Triangles corners
+                 - TYPE: float numpy.array[T, 3, 3]
+                 Normals: Unit normals at triangles COG
+                 - TYPE: float numpy.array[T, 3]
+                 Areas: Triangles areas (weights) scaled to sum to 4 pi
+                 - TYPE: float numpy.array[T]
+                 COGs: Triangles centers of gravity
+                 - TYPE: float numpy.array[T, 3]
+        """
+
+        Power = int(Power)
+        if Power in self.SphereCache:
+            return self.SphereCache[Power]
+
+        # Refine first octant triangle
+        Triangles = np.array([[[1.0, 0.0, 0.0],
+                               [0.0, 1.0, 0.0],
+                               [0.0, 0.0, 1.0]]])
+        for cDir in range(Power):
+            Triangles = self.SplitTriangle(Triangles)
+
+        Triangles = self.Project2UnitSphere(Triangles)
+
+        # Mirror along y, x and z axes
+        for Axis in [1, 0, 2]:
+            Mirror = Triangles.copy()
+            Mirror[..., Axis] *= -1
+            Triangles = np.stack([Triangles, Mirror], axis=1).reshape(-1, 3, 3)
+
+        COGs, Normals, Areas = self.AreaAndCOG(Triangles)
+        Areas = Areas * 4.0 * np.pi / Areas.sum()
+
+        for Array in [Triangles, Normals, Areas, COGs]:
+            Array.flags.writeable = False
+
+        self.SphereCache[Power] = (Triangles, Normals, Areas, COGs)
+
+        return self.SphereCache[Power]
+
+    def SphereMesh(self, Power):
+
+        """
+        Vertices and faces of the geodesic unit sphere for plotting
+        :param Power: Parameter for number of triangles on unit sphere
+        :return: Vertices: Unique vertices (V, 3)
+                 Faces: Vertices indices of each triangle (T, 3)
         """
-        P1 = np.array(Triangle[0])
-        P2 = np.array(Triangle[1])
-        P3 = np.array(Triangle[2])
 
-        P21 = P2 - P1
-        P31 = P3 - P1
+        Triangles = self.Sphere(Power)[0]
+        Points = np.round(Triangles.reshape(-1, 3), 12)
+        Vertices, Faces = np.unique(Points, axis=0, return_inverse=True)
 
-        A = 0.5 * np.linalg.norm(np.cross(P21, P31))
+        return Vertices, Faces.reshape(-1, 3)
 
-        X = (P1[0] + P2[0] + P3[0]) / 3.0
-        Y = (P1[1] + P2[1] + P3[1]) / 3.0
-        Z = (P1[2] + P2[2] + P3[2]) / 3.0
+    def AreaAndCOG(self, Triangles):
 
-        Factor = 1.0 / np.sqrt(X * X + Y * Y + Z * Z)
+        """ 
+        Used in Sphere for MIL computation
+        Computes area and center of gravity of triangles
+        :param Triangles: Array of triangles (T, 3, 3)
+        :return: COGs: Centers of gravity (T, 3)
+                 Normals: COGs projected on unit sphere (T, 3)
+                 Areas: Triangles areas (T)
+        """
+
+        P21 = Triangles[:, 1] - Triangles[:, 0]
+        P31 = Triangles[:, 2] - Triangles[:, 0]
+        Areas = 0.5 * np.linalg.norm(np.cross(P21, P31), axis=-1)
+
+        COGs = Triangles.mean(axis=1)
+        Normals = COGs / np.linalg.norm(COGs, axis=-1, keepdims=True)
 
-        return (A, (Factor * X, Factor * Y, Factor * Z))
+        return COGs, Normals, Areas
 
     def NormalAndArea(self, Power):
 
@@ -3731,40 +5040,87 @@ class Morphometry():
                       - TYPE: int
                      
         :return: Normals: normals from COG with unit length 
-                 - TYPE: list[ (nix, niy, niz) ]  
-                 - float nix, niy, niz ... components of normal vectors 
+                 - TYPE: float numpy.array[8*4^power, 3]
                                   
                  Area_n: area of triangles which build the surface of sphere    
-                 - TYPE: dict[ (nix, niy, niz) ] = value    
-                 - float nix, niy, niz ... components of normal vectors 
-                 - float value         ... Area for that direction                         
-        """
-        Triangles = self.SphereTriangles(Power)
-        Normals = []
-        Area_n = {}
-        ASum = 0.0
-        for Triangle in Triangles:
-            A, COG = self.AreaAndCOG(Triangle)
-            Normals.append(COG)
-            Area_n[COG] = A
-            ASum += A
-
-        k = 4.0 * np.pi / ASum
-        for n in Area_n:
-            Area_n[n] = Area_n[n] * k
+                 - TYPE: float numpy.array[8*4^power]
+        """
+
+        Triangles, Normals, Area_n, COGs = self.Sphere(Power)
 
         return Normals, Area_n
 
+    def MILTables(self, Power, Shape):
+
+        """
+        Used in OriginalDistribution for MIL computation
+        Setup (and cache) the direction set and the voxel ray templates
+        for a given sphere power and image shape
+
+        :param Power: Power for the number of star directions = 8*4^power
+                      - TYPE: int
+        :param Shape: Image shape
+                      - TYPE: tuple (nZ, nY, nX)
+
+        :return: Directions: Directions seen from the 4 bottom corners
+                             - TYPE: float numpy.array[nDirs, 3]
+                 Viewers: Corner index (swb, seb, neb, nwb) of each direction
+                          - TYPE: int numpy.array[nDirs]
+                 Rays: First octant voxel rays, padded with zeros
+                       - TYPE: int numpy.array[nRays, MaxLength, 3]
+                 RayIndex: Ray of each direction
+                           - TYPE: int numpy.array[nDirs]
+                 RayLength: Number of voxels of each ray
+                            - TYPE: int numpy.array[nRays]
+                 Area: Weight (area of triangle on unit sphere) of each direction
+                       - TYPE: float numpy.array[nDirs]
+        """
+
+        Key = (int(Power), tuple(Shape))
+        if Key in self.MILCache:
+            return self.MILCache[Key]
+
+        nZ, nY, nX = Shape
+        Normals, Area_n = self.NormalAndArea(Power)
+
+        # Voxel rays of first octant normals
+        InOctant = np.all(Normals >= 0.0, axis=1)
+        Octant = Normals[InOctant]
+        OctantRays = [NumbaVoxelRay(n, nX, nY, nZ) for n in Octant]
+        MaxLength = max([len(Ray) for Ray in OctantRays])
+        Rays = np.zeros((len(Octant), MaxLength, 3), 'int64')
+        RayLength = np.zeros(len(Octant), 'int64')
+        for iRay, Ray in enumerate(OctantRays):
+            Rays[iRay, :len(Ray)] = Ray
+            RayLength[iRay] = len(Ray)
+
+        # Directions seen from the corners swb, seb, neb, nwb
+        ViewerAt = np.array([[ 1.0,  1.0, 1.0],
+                             [-1.0,  1.0, 1.0],
+                             [-1.0, -1.0, 1.0],
+                             [ 1.0, -1.0, 1.0]])
+        nRays = len(Octant)
+        Directions = (ViewerAt[:,None,:] * Octant[None,:,:]).reshape(-1, 3)
+        Viewers = np.repeat(np.arange(4), nRays)
+        RayIndex = np.tile(np.arange(nRays), 4)
+        Area = np.tile(Area_n[InOctant], 4)
+
+        Tables = (Directions, Viewers, Rays, RayIndex, RayLength, Area)
+        self.MILCache[Key] = Tables
+
+        return Tables
+
     def OriginalDistribution(self, Array, Step, Power):
 
         """
         Used in step 2 of MIL computation
         Function computes MIL/SLD/SVD distributions for direction vectors "n" 
-        using a voxel ray field going trought the RVE. Normals n = tuple(nix,niy,niz) 
+        using a voxel ray field going trought the RVE. Normals n = (nix,niy,niz) 
         are the directions from the midpoint of a unit sphere to the COG of triangles 
         which build the surface of the sphere. Very similar to 
         self.computeOrigDistribution_STAR(). 
-        A segement voxel model with isotropic resolution is needed.   
+        A segement voxel model with isotropic resolution is needed.
+        Directions are computed in parallel by NumbaMIL.
         
         :param Array: Segmented voxel model
                       - TYPE: numpy.array[kZ, jY, iX] = grayValue 
@@ -3774,15 +5130,11 @@ class Morphometry():
                       - TYPE: int > 0 
         :param Power: Power for the number of star directions = 8*4^power
                       - TYPE: int > 1
-        :param Valid: Smallest valid intersection length.
-                      - TYPE: float
-        :param Echo: Flag for printing the  " ... Threshold Data" on stdout
-                      - TYPE: bool
                                      
-        @return: MIL: Mean Intercept Length 
-                      - TYPE: dict[ (nix, niy, niz) ] = value 
-                      - float nix, niy, niz ... components of normal vectors 
-                      - float value         ... MIL for that direction          
+        @return: Normals: Directions of the distributions
+                      - TYPE: float numpy.array[8*4^power, 3]
+                 MIL: Mean Intercept Length 
+                      - TYPE: float numpy.array[8*4^power]
                  SLD: Star Length Distribution 
                       - TYPE: same as for MIL 
                  SVD: Star Volume Distribution 
@@ -3795,223 +5147,74 @@ class Morphometry():
             Text = 'Compute MIL'
             Time.Process(1, Text)
 
-        MIL = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-        SVD = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-        SLD = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-
-        SumL = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-        SumL2 = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-        SumL4 = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64,)
-
-        Corners = Dict.empty(key_type=types.unicode_type, value_type=types.float64[:],)
-        Corners['swb'] = np.asarray([0.0, 0.0, 0.0], dtype='f8')
-        Corners['seb'] = np.asarray([float(self.nX), 0.0, 0.0], dtype='f8')
-        Corners['neb'] = np.asarray([float(self.nX), float(self.nY), 0.0], dtype='f8')
-        Corners['nwb'] = np.asarray([0.0, float(self.nY), 0.0], dtype='f8')
-        Corners['swt'] = np.asarray([0.0, 0.0, float(self.nZ)], dtype='f8')
-        Corners['set'] = np.asarray([float(self.nX), 0.0, float(self.nZ)], dtype='f8')
-        Corners['net'] = np.asarray([float(self.nX), float(self.nY), float(self.nZ)], dtype='f8')
-        Corners['nwt'] = np.asarray([0.0, float(self.nY), float(self.nZ)], dtype='f8')
-
-
-        sDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        sDict['r-dir'] = (1.0, 0.0, 0.0)
-        sDict['s-dir'] = (0.0, 0.0, 1.0)
-        eDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        eDict['r-dir'] = (0.0, 1.0, 0.0)
-        eDict['s-dir'] = (0.0, 0.0, 1.0)
-        nDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        nDict['r-dir'] = (1.0, 0.0, 0.0)
-        nDict['s-dir'] = (0.0, 0.0, 1.0)
-        wDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        wDict['r-dir'] = (0.0, 1.0, 0.0)
-        wDict['s-dir'] = (0.0, 0.0, 1.0)
-        bDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        bDict['r-dir'] = (1.0, 0.0, 0.0)
-        bDict['s-dir'] = (0.0, 1.0, 0.0)
-        tDict = Dict.empty(key_type=types.unicode_type, value_type=types.UniTuple(types.float64, 3),)
-        tDict['r-dir'] = (1.0, 0.0, 0.0)
-        tDict['s-dir'] = (0.0, 1.0, 0.0)
-
-
-        InnerDict = types.DictType(types.unicode_type, types.UniTuple(types.float64, 3))
-        ModelPlanes = Dict.empty(key_type=types.unicode_type, value_type=InnerDict,)
-        ModelPlanes['s'] = sDict
-        ModelPlanes['e'] = eDict
-        ModelPlanes['n'] = nDict
-        ModelPlanes['w'] = wDict
-        ModelPlanes['b'] = bDict
-        ModelPlanes['t'] = tDict
-        
-        BaseModel = Dict.empty(key_type=types.unicode_type, value_type=types.unicode_type,)
-        BaseModel['s'] = 'swb'
-        BaseModel['e'] = 'seb'
-        BaseModel['n'] = 'nwb'
-        BaseModel['w'] = 'swb'
-        BaseModel['b'] = 'swb'
-        BaseModel['t'] = 'swt'
-        
-        ViewerAt = {}
-        ViewerAt['swb'] = (1.0, 1.0, 1.0)
-        ViewerAt['seb'] = (-1.0, 1.0, 1.0)
-        ViewerAt['neb'] = (-1.0, -1.0, 1.0)
-        ViewerAt['nwb'] = (1.0, -1.0, 1.0)
-
-        ViewerTo = {}
-        ViewerTo['swb'] = 'net'
-        ViewerTo['seb'] = 'nwt'
-        ViewerTo['neb'] = 'swt'
-        ViewerTo['nwb'] = 'set'
-
-        Normals, Area = self.NormalAndArea(Power)
-        Dict1 = {}
-        Direction = ''
-        for n in Normals:
-            nX = n[0]
-            nY = n[1]
-            nZ = n[2]
-            if nX >= 0.0 and nY >= 0.0 and nZ >= 0.0:
-                VoxX = 1
-                VoxY = 1
-                VoxZ = 1
-                StepX = 1
-                StepY = 1
-                StepZ = 1
-                VoxelRay = []
-                VoxelRay.append((VoxX, VoxY, VoxZ))
-                if abs(nX) > abs(nY):
-                    if abs(nZ) > abs(nX):
-                        Direction = 'Z'
-                    else:
-                        Direction = 'X'
-                elif abs(nZ) > abs(nY):
-                    Direction = 'Z'
-                else:
-                    Direction = 'Y'
-                PreVoxX = 1
-                PreVoxY = 1
-                PreVoxZ = 1
-                C1 = abs(VoxX) <= self.nX
-                C2 = abs(VoxY) <= self.nY
-                C3 = abs(VoxZ) <= self.nZ
-                while C1 and C2 and C3:
-                    TMaxX = VoxX / nX
-                    TMaxY = VoxY / nY
-                    TMaxZ = VoxZ / nZ
-                    if abs(TMaxX) < abs(TMaxY):
-                        if abs(TMaxX) < abs(TMaxZ):
-                            VoxX = VoxX + StepX
-                        else:
-                            VoxZ = VoxZ + StepZ
-                    elif abs(TMaxY) < abs(TMaxZ):
-                        VoxY = VoxY + StepY
-                    else:
-                        VoxZ = VoxZ + StepZ
-
-                    Cc1 = abs(VoxX) <= self.nX
-                    Cc2 = abs(VoxY) <= self.nY
-                    Cc3 = abs(VoxZ) <= self.nZ
-                    if Cc1 and Cc2 and Cc3:
-                        if Direction == 'X':
-                            if VoxX > PreVoxX:
-                                VoxelRay.append((VoxX, VoxY, VoxZ))
-                        if Direction == 'Y':
-                            if VoxY > PreVoxY:
-                                VoxelRay.append((VoxX, VoxY, VoxZ))
-                        if Direction == 'Z':
-                            if VoxZ > PreVoxZ:
-                                VoxelRay.append((VoxX, VoxY, VoxZ))
-                    PreVoxX = VoxX
-                    PreVoxY = VoxY
-                    PreVoxZ = VoxZ
-
-                    C1 = abs(VoxX) <= self.nX
-                    C2 = abs(VoxY) <= self.nY
-                    C3 = abs(VoxZ) <= self.nZ
-
-                Dict1[n] = VoxelRay
-
-        i = 0
-        Sum = len(ViewerAt) * 4.0 ** float(Power)
-        for v in ViewerAt:
-            Dict2 = Dict.empty(key_type=types.UniTuple(types.float64, 3), value_type=types.float64[:,:],)
-            CornVoxX = int(Corners[v][0])
-            CornVoxY = int(Corners[v][1])
-            CornVoxZ = int(Corners[v][2])
-            if CornVoxX == 0:
-                CornVoxX = 1
-            if CornVoxY == 0:
-                CornVoxY = 1
-            if CornVoxZ == 0:
-                CornVoxZ = 1
-            StepX = int(ViewerAt[v][0])
-            StepY = int(ViewerAt[v][1])
-            StepZ = int(ViewerAt[v][2])
-            for n in Dict1:
-                VoxelRay = Dict1[n]
-                NewVoxelRay = []
-                for Voxel in VoxelRay:
-                    VoxelX = CornVoxX + StepX * Voxel[0] - StepX
-                    VoxelY = CornVoxY + StepY * Voxel[1] - StepY
-                    VoxelZ = CornVoxZ + StepZ * Voxel[2] - StepZ
-                    NewVoxelRay.append((VoxelX, VoxelY, VoxelZ))
-
-                D = n[0] * ViewerAt[v][0], n[1] * ViewerAt[v][1], n[2] * ViewerAt[v][2]
-                Dict2[tuple(D)] = np.asarray(NewVoxelRay, dtype='f8')
-
-            EntryPlanes = List([v[0], v[1], v[2]])
+        nZ, nY, nX = Array.shape
+        Tables = self.MILTables(Power, Array.shape)
+        Directions, Viewers, Rays, RayIndex, RayLength, Area = Tables
 
-            if self.Echo:
-                Time.Update(i/Sum, 'Setup Data')
+        if self.Echo:
+            Time.Update(1/3, 'Setup Data')
 
-            CVx = List([CornVoxX, CornVoxY, CornVoxZ])
-            Ns = List([self.nX, self.nY, self.nZ])
-            Vars = List([MIL, SVD, SLD])
-            Sums = List([SumL, SumL2, SumL4])
-            i, MIL, SVD, SLD = NumbaSetupMILData(i, v, Step, Array,
-                                                 CVx, Ns, Vars, Sums,
-                                                 Dict2, Corners, EntryPlanes,
-                                                 ModelPlanes, BaseModel)
+        Corners = np.array([[0.0, 0.0, 0.0],
+                            [nX, 0.0, 0.0],
+                            [nX, nY, 0.0],
+                            [0.0, nY, 0.0],
+                            [0.0, 0.0, nZ],
+                            [nX, 0.0, nZ],
+                            [nX, nY, nZ],
+                            [0.0, nY, nZ]])
+
+        SumL, SumL2, SumL4, nL = NumbaMIL(Array, Step, Directions, Viewers, Rays,
+                                          RayIndex, RayLength, Corners)
+
+        if self.Echo:
+            Time.Update(2/3, 'Compute MIL')
+
+        # Directions and opposite directions share the same values
+        MIL = SumL / nL
+        SLD = SumL2 / SumL
+        SVD = np.pi / 3.0 * SumL4 / SumL
+
+        Normals = np.concatenate([Directions, -Directions])
+        MIL = np.concatenate([MIL, MIL])
+        SLD = np.concatenate([SLD, SLD])
+        SVD = np.concatenate([SVD, SVD])
+        Area = np.concatenate([Area, Area])
 
         if self.Echo:
             Time.Process(0, Text)
         
-        return MIL, SVD, SLD, Area
+        return Normals, MIL, SVD, SLD, Area
 
-    def FabricTensor(self, OrgMIL):
+    def FabricTensor(self, Normals, Values):
 
         """ 
         Used in ApproximalDistribution for MIL computation
         Compute the fabric tensors using an ellipsoidal fit
         
-         :param OrgMIL: Original distribution 
-                - TYPE: dict[ (nix, niy, niz) ] = value 
-                - float nix, niy, niz ... components of normal vector 
-                - float value         ... value for that direction             
+         :param Normals: Directions of the distribution
+                - TYPE: float numpy.array[nDir, 3]
+         :param Values: Original distribution value for each direction
+                - TYPE: float numpy.array[nDir]
                       
          :return: M: fabric tensor from ellipsoidal fit 
                   - TYPE: float numpy.array[3,3]            
         """
 
-        nDir = len(OrgMIL)
-        nHat = np.array(np.zeros((nDir, 6), float))
-        An = np.array(np.zeros(nDir, float))
-        H = np.array(np.zeros((3, 3), float))
-        d = 0
-        for n in OrgMIL:
-            nHat[d, 0] = n[0] * n[0]
-            nHat[d, 1] = n[1] * n[1]
-            nHat[d, 2] = n[2] * n[2]
-            nHat[d, 3] = np.sqrt(2.0) * n[1] * n[2]
-            nHat[d, 4] = np.sqrt(2.0) * n[2] * n[0]
-            nHat[d, 5] = np.sqrt(2.0) * n[0] * n[1]
-            MILn = np.array(OrgMIL[n], dtype=float)
-            An[d] = 1.0 / MILn * (1.0 / MILn)
-            d += 1
+        n = np.asarray(Normals, float)
+        nHat = np.zeros((len(n), 6), float)
+        nHat[:, 0] = n[:, 0] * n[:, 0]
+        nHat[:, 1] = n[:, 1] * n[:, 1]
+        nHat[:, 2] = n[:, 2] * n[:, 2]
+        nHat[:, 3] = np.sqrt(2.0) * n[:, 1] * n[:, 2]
+        nHat[:, 4] = np.sqrt(2.0) * n[:, 2] * n[:, 0]
+        nHat[:, 5] = np.sqrt(2.0) * n[:, 0] * n[:, 1]
+        An = 1.0 / np.asarray(Values, float) ** 2
 
         N1 = np.dot(np.transpose(nHat), nHat)
         N2 = np.dot(np.transpose(nHat), An)
         VM = np.dot(np.linalg.inv(N1), N2)
+
+        H = np.zeros((3, 3), float)
         H[(0, 0)] = VM[0]
         H[(1, 1)] = VM[1]
         H[(2, 2)] = VM[2]
@@ -4024,16 +5227,16 @@ class Morphometry():
 
         return H
 
-    def EigenValuesAndVectors(self, orgMIL):
+    def EigenValuesAndVectors(self, Normals, Values):
         
         """
         Used in step 4 of MIL computation
         computes the eigenvalueS and eigenvectors by fitting an ellipsoid 
         
-        :param  orgMIL: Original distribution 
-                - TYPE: dict[ (nix, niy, niz) ] = value 
-                - float nix, niy, niz ... components of normal vector 
-                - float value         ... value for that direction             
+        :param Normals: Directions of the distribution
+                - TYPE: float numpy.array[nDir, 3]
+        :param Values: Original distribution value for each direction
+                - TYPE: float numpy.array[nDir]
             
         :return: evalue: Eigenvalues of fabric tensor 
                  - TYPE: numpy.array[evalID] = eval
@@ -4046,46 +5249,302 @@ class Morphometry():
                  - float evect ... component of eigenvectors, e.g. evector[0,2] = ev1_z
         """
 
-        M = self.FabricTensor(orgMIL)
-        eValue, eVector = np.linalg.eig(M)
-        eValue[0] = 1.0 / np.sqrt(eValue[0])
-        eValue[1] = 1.0 / np.sqrt(eValue[1])
-        eValue[2] = 1.0 / np.sqrt(eValue[2])
+        M = self.FabricTensor(Normals, Values)
+        eValue, eVector = np.linalg.eig(M)
+        eValue[0] = 1.0 / np.sqrt(eValue[0])
+        eValue[1] = 1.0 / np.sqrt(eValue[1])
+        eValue[2] = 1.0 / np.sqrt(eValue[2])
+
+
+        Norm = (eValue[0] + eValue[1] + eValue[2]) / 3.0
+
+        eValue[0] = eValue[0] / Norm
+        eValue[1] = eValue[1] / Norm
+        eValue[2] = eValue[2] / Norm
+
+        return eValue, eVector
+
+    def GST(self, Image, Sigma=1.0, Mask=None, Factor=None, SlabSize=64):
+
+        """
+        Gray-level (gradient) structure tensor, alternative to MIL for fabric
+        Gaussian derivatives are computed with separable filters in float32
+        slab by slab (with halo) and their outer products are averaged over
+        the (masked) image or over blocks of Factor voxels (e.g. FE elements)
+
+        :param Image: Gray level or segmented image
+                      - Type: sitkImage or numpy array (Z, Y, X)
+        :param Sigma: Scale of the Gaussian derivatives in voxels
+        :param Mask: Region where the tensor is accumulated
+                     - Type: sitkImage or numpy array (Z, Y, X)
+        :param Factor: Block size for element-level tensors (None for whole image)
+        :param SlabSize: Number of slices filtered at once
+        :return GST: Mean structure tensor in x,y,z coordinates
+                     - Type: numpy array (3, 3) or (nZ, nY, nX, 3, 3) if Factor
+        """
+
+        if self.Echo:
+            Text = 'Compute GST'
+            Time.Process(1, Text)
+
+        if hasattr(Image, 'GetSize'):
+            Array = sitk.GetArrayViewFromImage(Image)
+        else:
+            Array = Image
+
+        if Mask is not None and hasattr(Mask, 'GetSize'):
+            Mask = sitk.GetArrayViewFromImage(Mask)
+
+        # Gaussian filter radius (scipy default truncation at 4 sigma)
+        Halo = int(4.0 * Sigma + 0.5)
+        nZ = Array.shape[0]
+        Components = [(0, 0), (1, 1), (2, 2), (1, 2), (0, 2), (0, 1)]
+
+        if Factor:
+            SlabSize = int(np.ceil(SlabSize / Factor) * Factor)
+            GST = np.zeros(tuple(np.array(Array.shape) // Factor) + (3, 3), 'float32')
+        else:
+            GST = np.zeros((3, 3))
+            Count = 0
+
+        for Start in range(0, nZ, SlabSize):
+
+            Stop = min(Start + SlabSize, nZ)
+            Low, High = max(Start - Halo, 0), min(Stop + Halo, nZ)
+            Slab = np.asarray(Array[Low:High], 'float32')
+
+            # Gaussian gradients along x, y, z (array axes 2, 1, 0)
+            Gradients = []
+            for Axis in [2, 1, 0]:
+                G = Slab
+                for iAxis in range(3):
+                    G = ndi.gaussian_filter1d(G, Sigma, axis=iAxis, order=int(iAxis == Axis), mode='nearest')
+                Gradients.append(G[Start-Low:Stop-Low])
+
+            if Mask is not None:
+                Weights = np.asarray(Mask[Start:Stop]) > 0
+
+            # Accumulate outer products
+            for i, j in Components:
+                Product = Gradients[i] * Gradients[j]
+                if Mask is not None:
+                    Product *= Weights
+
+                if Factor:
+                    Block = BlockReduce(Product, Factor, 'mean').astype('float32')
+                    Slice = slice(Start // Factor, Start // Factor + len(Block))
+                    GST[Slice, ..., i, j] = Block
+                    GST[Slice, ..., j, i] = Block
+                else:
+                    GST[i, j] += Product.sum(dtype='float64')
+                    GST[j, i] = GST[i, j]
+
+            if not Factor:
+                Count += Weights.sum() if Mask is not None else Product.size
+
+            if self.Echo:
+                Time.Update(Stop / nZ, Text)
+
+        if not Factor:
+            GST = GST / max(Count, 1)
+
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return GST
+
+    def GSTFabric(self, GST, MinRatio=1e-3):
+
+        """
+        Fabric eigenvalues and eigenvectors from gradient structure tensor(s)
+        Eigenvalues are inverted (power -1/2) as done in medtool
+        computeFabricTensorGST and normalized to a mean of 1 (trace)
+        like EigenValuesAndVectors. Eigenvalues smaller than MinRatio times
+        the largest one (e.g. along rods or within plates) are clamped
+        before inversion, only tensors with a null trace give isotropic fabric.
+
+        :param GST: Structure tensor(s)
+                    - Type: numpy array (..., 3, 3)
+        :param MinRatio: Smallest eigenvalue relative to the largest one
+        :return: eValues: Eigenvalues (..., 3), in decreasing order
+                 eVectors: Eigenvectors as columns (..., 3, 3)
+        """
+
+        GST = np.array(GST, float)
+        Trace = np.trace(GST, axis1=-2, axis2=-1)
+        Degenerated = Trace <= 1e-12 * np.abs(Trace).max(initial=0)
+        GST[Degenerated] = np.eye(3)
+
+        eValues, eVectors = np.linalg.eigh(GST)
+        Minimum = MinRatio * eValues[..., -1:]
+        eValues = np.maximum(eValues, Minimum) ** -0.5
+        eValues = eValues / eValues.mean(axis=-1, keepdims=True)
+
+        return eValues, eVectors
+
+    def MIL(self, Image, Power2=4, Step=5, Power=2):
+
+        """
+        Compute Mean Intercept Length of image
+        Based on mia.py from medtool from D. H. Pahr
+        """
+
+        if hasattr(Image, 'GetSize'):
+            self.nX, self.nY, self.nZ = Image.GetSize()
+            Array = sitk.GetArrayFromImage(Image)
+        elif hasattr(Image, 'shape'):
+            self.nZ, self.nY, self.nX = Image.shape
+            Array = Image
+        else:
+            print('Image must be either numpy array or sitk image')
+
+        # Step 1: Compute original distribution
+        Normals, OrgMIL, OrgSVD, OrgSLD, Area = self.OriginalDistribution(Array, Step, Power)
+
+        # Step 2: Compute eigen values and eigen vectors
+        eValMIL, eVectMIL = self.EigenValuesAndVectors(Normals, OrgMIL)
+
+        return eValMIL, eVectMIL
+
+    def LocalThickness(self, Array, Mask=None, SlabSize=16, ChunkSize=None, Halo=16):
+
+        """
+        Local thickness (diameter of the largest sphere fitting inside the
+        structure and containing the voxel) based on Euclidean distance
+        transform, distance ridge and sphere stamping in parallel Z slabs
+        The volume can be processed by chunks along Z with halos enlarged
+        until the distance transform and the spheres reaching the chunk are
+        exact, so results do not depend on the chunk size.
+        Isotropic voxels are assumed, thickness is given in voxels
+
+        :param Array: Structure to analyse (non zero voxels)
+                      - Type: numpy array (Z, Y, X)
+        :param Mask: Optional region of interest, voxels outside are background
+        :param SlabSize: Number of slices stamped by each parallel task
+        :param ChunkSize: Number of slices processed at once (None for all)
+        :param Halo: Initial halo size (slices) around each chunk
+        :return Thickness: Local thickness of structure voxels
+                           - Type: float32 numpy array (Z, Y, X)
+        """
+
+        Structure = np.asarray(Array) > 0
+        if Mask is not None:
+            Structure &= np.asarray(Mask) > 0
+
+        nZ = Structure.shape[0]
+        if not ChunkSize:
+            ChunkSize = nZ
+
+        Thickness = np.zeros(Structure.shape, 'float32')
+        for Start in range(0, nZ, ChunkSize):
+
+            Stop = min(Start + ChunkSize, nZ)
+
+            # Exact Euclidean distance to background, enlarge halo if
+            # the largest sphere around the chunk is larger than the halo
+            H = Halo
+            while True:
+                Low, High = max(Start - 2*H - 1, 0), min(Stop + 2*H + 1, nZ)
+                Distance = ndi.distance_transform_edt(Structure[Low:High]).astype('float32')
+                Inner = Distance[max(Start - H - 1, 0) - Low:min(Stop + H + 1, nZ) - Low]
+                DMax = Inner.max() if Inner.size else 0
+                if DMax <= H or (Low == 0 and High == nZ):
+                    break
+                H = int(np.ceil(DMax)) + 1
+
+            # Centers of maximal spheres reaching the chunk, sorted along Z
+            Ridge = NumbaDistanceRidge(Distance)
+            Centers = np.argwhere(Ridge)
+            Radii2 = np.rint(Distance[Ridge].astype('float64') ** 2).astype('int64')
+            del Ridge, Distance
+
+            Centers[:, 0] += Low - Start
+            Keep = (Centers[:, 0] >= -H) & (Centers[:, 0] < Stop - Start + H)
+            Centers, Radii2 = Centers[Keep], Radii2[Keep]
+
+            Thickness[Start:Stop] = NumbaLocalThickness(Structure[Start:Stop], Centers, Radii2, SlabSize)
+
+            if self.Echo and ChunkSize < nZ:
+                Time.Update(Stop / nZ, 'Local thickness')
+
+        return Thickness
+
+    def Thickness(self, Image, Mask=None, ChunkSize=64):
+
+        """
+        3D local thickness map and summary statistics of a segmented image
+        :param Image: Segmented image (non zero is structure)
+                      - Type: sitkImage
+        :param Mask: Optional region of interest
+                     - Type: sitkImage
+        :param ChunkSize: Number of slices processed at once
+        :return ThicknessImage: Local thickness (mm) of each structure voxel
+                                - Type: float32 sitkImage
+                Stats: Mean, standard deviation, median and max thickness (mm)
+                       - Type: dict
+        """
+
+        if self.Echo:
+            Text = 'Local thickness'
+            Time.Process(1, Text)
 
+        Spacing = Image.GetSpacing()[0]
+        Array = sitk.GetArrayViewFromImage(Image)
+        if Mask is not None:
+            Mask = sitk.GetArrayViewFromImage(Mask)
 
-        Norm = (eValue[0] + eValue[1] + eValue[2]) / 3.0
+        Echo = self.Echo
+        self.Echo = False
+        Thickness = self.LocalThickness(Array, Mask, ChunkSize=ChunkSize) * Spacing
+        self.Echo = Echo
 
-        eValue[0] = eValue[0] / Norm
-        eValue[1] = eValue[1] / Norm
-        eValue[2] = eValue[2] / Norm
+        Values = Thickness[Thickness > 0]
+        if Values.size == 0:
+            Values = np.zeros(1)
+        Stats = {'Mean':Values.mean(), 'Std':Values.std(),
+                 'Median':np.median(Values), 'Max':Values.max()}
 
-        return eValue, eVector
+        ThicknessImage = sitk.GetImageFromArray(Thickness)
+        ThicknessImage.CopyInformation(Image)
 
-    def MIL(self, Image, Power2=4, Step=5, Power=2):
+        if self.Echo:
+            Time.Process(0, Text)
+
+        return ThicknessImage, Stats
+
+    def NativeTrabecular(self, Array, Mask, Spacing):
 
         """
-        Compute Mean Intercept Length of image
-        Based on mia.py from medtool from D. H. Pahr
+        Trabecular morphometry without external library
+        Tb.Th and Tb.Sp are mean local thicknesses of bone and marrow
+        and Tb.N = 1 / (Tb.Th + Tb.Sp)
+
+        :param Array: Segmented trabecular bone (non zero is bone)
+                      - Type: numpy array (Z, Y, X)
+        :param Mask: Region of interest (non zero inside)
+                     - Type: numpy array (Z, Y, X)
+        :param Spacing: Isotropic voxel size (mm)
+        :return Measures: BV/TV, Tb.Th, Tb.N, Tb.Sp
         """
 
-        if hasattr(Image, 'GetSize'):
-            self.nX, self.nY, self.nZ = Image.GetSize()
-            Array = sitk.GetArrayFromImage(Image)
-        elif hasattr(Image, 'shape'):
-            self.nZ, self.nY, self.nX = Image.shape
-            Array = Image
-        else:
-            print('Image must be either numpy array or sitk image')
+        Bone = (np.asarray(Array) > 0) & (np.asarray(Mask) > 0)
+        Marrow = (np.asarray(Mask) > 0) & ~Bone
 
-        # Step 1: Compute original distribution
-        OrgMIL, OrgSVD, OrgSLD, Area = self.OriginalDistribution(Array, Step, Power)
+        BVTV = Bone.sum() / max((np.asarray(Mask) > 0).sum(), 1)
 
-        # Step 2: Compute eigen values and eigen vectors
-        eValMIL, eVectMIL = self.EigenValuesAndVectors(OrgMIL)
+        Thickness = self.LocalThickness(Bone)
+        TbTh = Thickness[Bone].mean() * Spacing
+        del Thickness
 
-        return eValMIL, eVectMIL
+        Separation = self.LocalThickness(Marrow)
+        TbSp = Separation[Marrow].mean() * Spacing
+        del Separation
+
+        TbN = 1 / (TbTh + TbSp)
+
+        return BVTV, TbTh, TbN, TbSp
 
-    def Trabecular(self, Image, Mask=None, DA=True):
+    def Trabecular(self, Image, Mask=None, DA=True, Fabric='MIL', Backend='PyPore3D'):
 
         """
         Perform trabecular morphological analysis
@@ -4094,80 +5553,137 @@ class Morphometry():
         :param Mask : Mask for region of interest selection
                       - Type: binary 0-255 sitkImage
         :param DA   : Compute or not the degree of anisotropy
-                      using mean intercept length
+        :param Fabric: Fabric used for the degree of anisotropy,
+                       'MIL' (mean intercept length) or 'GST'
+                       (gradient structure tensor)
+        :param Backend: 'PyPore3D' or 'Native' (in memory distance
+                        transform based local thickness)
         :return Data: Pandas data frame with computed parameters
         """
 
         Data = pd.DataFrame()
 
-        # Write temporary images to disk
         dX, dY, dZ = Image.GetSize()
         Spacing = Image.GetSpacing()[0]
-        sitk.WriteImage(Image, 'TempROI.mhd')
-        sitk.WriteImage(Mask, 'TempMask.mhd')
+        if Mask is None:
+            Mask = sitk.Image(Image.GetSize(), sitk.sitkUInt8) + 255
+            Mask.CopyInformation(Image)
 
-        # Perform morphometric analysis
-        ROI = ReadRaw8('TempROI.raw', dX, dY, dimz=dZ)
-        ROIMask = ReadRaw8('TempMask.raw', dX, dY, dimz=dZ)
-        MS = MA(ROI, ROIMask, dX, dY, dimz=dZ, resolution=Spacing)
+        if Backend == 'Native':
+            Array = sitk.GetArrayViewFromImage(Image)
+            MaskArray = sitk.GetArrayViewFromImage(Mask)
+            Measures = self.NativeTrabecular(Array, MaskArray, Spacing)
 
-        # Remove temporary files and write data to disk
-        for F in ['TempROI','TempMask']:
-            os.remove(F + '.mhd')
-            os.remove(F + '.raw')
+        else:
+            # Write temporary images to a private directory
+            TempDir = tempfile.mkdtemp()
+            ROIFile = os.path.join(TempDir, 'TempROI')
+            MaskFile = os.path.join(TempDir, 'TempMask')
+            sitk.WriteImage(Image, ROIFile + '.mhd')
+            sitk.WriteImage(Mask, MaskFile + '.mhd')
+
+            # Perform morphometric analysis
+            ROI = ReadRaw8(ROIFile + '.raw', dX, dY, dimz=dZ)
+            ROIMask = ReadRaw8(MaskFile + '.raw', dX, dY, dimz=dZ)
+            MS = MA(ROI, ROIMask, dX, dY, dimz=dZ, resolution=Spacing)
+            Measures = [MS.BvTv, MS.TbTh, MS.TbN, MS.TbSp]
+
+            # Remove temporary files
+            shutil.rmtree(TempDir)
 
         # Store data
         Props = ['BV/TV (-)', 'Tb.Th. (mm)', 'Tb.N. (-)', 'Tb.Sp. (mm)']
-        Measures = [MS.BvTv, MS.TbTh, MS.TbN, MS.TbSp]
         for Prop, Stat in zip(Props, Measures):
             Data.loc[0,Prop] = Stat
 
-        # Compute MIL for degree of anisotropy assessment
-        if DA:
+        # Compute fabric for degree of anisotropy assessment
+        if DA and Fabric == 'GST':
+            GST = self.GST(Image, Mask=Mask)
+            eVal, eVect = self.GSTFabric(GST)
+            Data.loc[0,'DA (-)'] = max(eVal) / min(eVal)
+
+        elif DA:
             Masked = sitk.Mask(Image, Mask)
             eVal, eVect = self.MIL(Masked)
             Data.loc[0,'DA (-)'] = max(eVal) / min(eVal)
 
         return Data
 
-    def Cortical(self, Image):
+    def Cortical(self, Image, Method='2D', Processes=None):
 
         """
         Compute morphology standard parameters for cortical bone
+        Slice area moments are computed at once from the foreground voxel
+        coordinates and diameters are obtained by a batched algebraic
+        (Kasa) circle fit of all slices
         :param Image: Segmented image of trabecular bone
                       - Type: binary sitkImage
+        :param Method: Cortical thickness computation, '2D' slice-wise
+                       medial axis (default, as in previous results)
+                       or '3D' local thickness
+        :param Processes: Number of processes for the slice-wise medial axis
+                          (1 to run in the current process, e.g. batch workers)
         :return Data: Pandas data frame with computed parameters
         """
 
         Data = pd.DataFrame()
         Spacing = Image.GetSpacing()[0]
-        Size = Image.GetSize()
-
-        T = []
-        I = []
-        D = []
-        Circle = measure.CircleModel()
-        for S in range(Size[2]):
-            Slice = sitk.Slice(Image, (0, 0, S), (Size[0], Size[1], S+1))
-            Pad = sitk.ConstantPad(Slice, (1, 1, 0), (1, 1, 0))
-            Array = sitk.GetArrayFromImage(Pad)
-
-            if Array.sum() > 0:
-                # Cortical thickness
-                Skeleton, Distance = morphology.medial_axis(Array[0], return_distance=True)
-                T.append(2 * np.mean(Distance[Skeleton]) * Spacing)
-
-                # Inertia
-                Properties = measure.regionprops(Array)[0]
-                I.append(Properties.inertia_tensor[0,0] * Properties.area * Spacing**2)
-
-                # Fitted diameter
-                Circle.estimate(Properties.coords[:,1:])
-                D.append(Circle.params[2] * Spacing * 2)
 
-        
+        Array = sitk.GetArrayViewFromImage(Image) > 0
+        nZ = Array.shape[0]
+
+        # Per-slice moments from foreground coordinates
+        Z, Y, X = np.nonzero(Array)
+        N = np.bincount(Z, minlength=nZ).astype('float')
+        Slices = N > 0
+        Nz = np.maximum(N, 1)
+        Yc = np.bincount(Z, Y, nZ) / Nz
+        Xc = np.bincount(Z, X, nZ) / Nz
+        U = X - Xc[Z]
+        V = Y - Yc[Z]
+        del X, Y
+
+        Suu = np.bincount(Z, U*U, nZ)
+        Svv = np.bincount(Z, V*V, nZ)
+        Suv = np.bincount(Z, U*V, nZ)
+        Suuu = np.bincount(Z, U*U*U, nZ)
+        Svvv = np.bincount(Z, V*V*V, nZ)
+        Suvv = np.bincount(Z, U*V*V, nZ)
+        Svuu = np.bincount(Z, V*U*U, nZ)
+        del U, V, Z
+
+        # Inertia (same definition as inertia_tensor[0,0] * area)
+        I = (Suu + Svv)[Slices] * Spacing**2
+
+        # Batched algebraic circle fit x² + y² + A x + B y + C = 0
+        M = np.zeros((nZ, 3, 3))
+        M[:,0,0], M[:,0,1], M[:,1,0], M[:,1,1] = Suu, Suv, Suv, Svv
+        M[:,2,2] = Nz
+        R = -np.stack([Suuu + Suvv, Svuu + Svvv, Suu + Svv], axis=-1)
+        M, R = M[Slices], R[Slices]
+        Singular = np.abs(np.linalg.det(M)) < 1E-12
+        M[Singular] = np.eye(3)
+        A, B, C = np.linalg.solve(M, R[..., None])[..., 0].T
+        Radius = np.sqrt(np.maximum((A**2 + B**2) / 4 - C, 0))
+        D = Radius * Spacing * 2
+        D[Singular] = np.nan
+
+        # Cortical thickness
+        if Method == '2D':
+            Indices = np.where(Slices)[0]
+            if Processes == 1:
+                T = [SliceMedialAxis(Array[S]) for S in Indices]
+            else:
+                with Pool(Processes) as P:
+                    T = P.map(SliceMedialAxis, [Array[S] for S in Indices])
+            T = np.array(T) * Spacing
+
+        elif Method == '3D':
+            ThicknessImage, Stats = self.Thickness(Image)
+            T = [Stats['Mean']]
+
         Props = ['C.Th (mm)', 'I (mm4)', 'D (mm)']
-        Measures = [np.median(T), np.median(I), np.median(D)]
+        Measures = [np.median(T), np.median(I), np.nanmedian(D)]
         for Prop, Stat in zip(Props, Measures):
             Data.loc[0,Prop] = Stat
         
@@ -4183,7 +5699,7 @@ class Morphometry():
         Step 4: Pad to avoid border contacts
         Optional
         Step 5: Close contour for further hole filling
-        Step 6: Mask generation by filling holes in consecutive z slices
+        Step 6: Mask generation by filling in-plane holes of all z slices
 
         :param Image: Gray value image
                       - Type: sitkImage
@@ -4216,16 +5732,10 @@ class Morphometry():
 
         else:
             # Segment image by thresholding using Otsu's method
-            Otsu = sitk.OtsuMultipleThresholdsImageFilter()
-            Otsu.SetNumberOfThresholds(nThresholds)
-            Seg = Otsu.Execute(Smooth)
-
-            # Binarize image to keep bone only
-            Binarize = sitk.BinaryThresholdImageFilter()
-            Binarize.SetUpperThreshold(nThresholds-1)
-            Binarize.SetOutsideValue(255)
-            Binarize.SetInsideValue(0)
-            Bin = Binarize.Execute(Seg)
+            # and keep bone (upper class) only
+            Echo, Histogram.Echo = Histogram.Echo, False
+            Bin = Histogram.Binarize(Smooth, nThresholds, Value=255)
+            Histogram.Echo = Echo
 
         # Crop image to bone
         Array = sitk.GetArrayFromImage(Bin)
@@ -4241,31 +5751,23 @@ class Morphometry():
         GrayCrop = sitk.ConstantPad(GrayCrop, (1,1,1), (1,1,1))
 
         if Mask:
-            # Close contour
-            Close = sitk.BinaryMorphologicalClosingImageFilter()
-            Close.SetForegroundValue(255)
-            Close.SetKernelRadius(CloseSize)
-            Closed = Close.Execute(BinCrop)
-
-            # Generate mask slice by slice
-            Size = BinCrop.GetSize()
-            Mask = BinCrop
-            for Start in range(Size[2]):
-                Slice = sitk.Slice(Closed, (0, 0, Start), (Size[0], Size[1], Start+1))
-
-                # Pad slice in z direction to "close" holes
-                Pad = sitk.ConstantPad(Slice, (0,0,1), (0,0,1), 255)
-
-                # Fill holes
-                Fill = sitk.BinaryFillholeImageFilter()
-                Fill.SetForegroundValue(255)
-                Filled = Fill.Execute(Pad)
+            # Close contour once for the whole stack
+            if CloseSize:
+                Close = sitk.BinaryMorphologicalClosingImageFilter()
+                Close.SetForegroundValue(255)
+                Close.SetKernelRadius(CloseSize)
+                Closed = Close.Execute(BinCrop)
+            else:
+                Closed = BinCrop
 
-                # Get center slice
-                Slice = sitk.Slice(Filled, (0, 0, 1), (Size[0], Size[1], 2))
+            # Fill in-plane holes of all slices at once (no connection along z)
+            Structure = np.zeros((3,3,3), bool)
+            Structure[1] = ndi.generate_binary_structure(2, 1)
+            Array = sitk.GetArrayViewFromImage(Closed) > 0
+            Filled = ndi.binary_fill_holes(Array, Structure)
 
-                # Paste slice into original image
-                Mask = sitk.Paste(Mask, Slice, Slice.GetSize(), destinationIndex=(0,0,Start+1))
+            Mask = sitk.GetImageFromArray(Filled.astype('uint8') * 255)
+            Mask.CopyInformation(BinCrop)
 
             return GrayCrop, BinCrop, Mask
         
@@ -4275,169 +5777,285 @@ class Morphometry():
 Morphometry = Morphometry()
 
 @njit
-def NumbaSetupMILData(i, v, Step, Array,
-                      CVx, Ns, Vars, Sums,
-                      Dict2, Corners, EntryPlanes,
-                      ModelPlanes, BaseModel):
-    
-    # Unpack variables
-    CornVoxX, CornVoxY, CornVoxZ = CVx
-    nX, nY, nZ = Ns
-    MIL, SVD, SLD = Vars
-    SumL, SumL2, SumL4 = Sums
-    
-    for n in Dict2:
-        i += 1
-        nL = 0
-        nNotValid0 = 0
-        nValid0 = 0
-        nNotValid1 = 0
-        nValid1 = 0
-        nNotValid3 = 0
-        nValid3 = 0
-        SumL[n] = 0.0
-        SumL2[n] = 0.0
-        SumL4[n] = 0.0
-        NewVoxelRay = Dict2[n]
-        nn = np.array([n[0], n[1], n[2]])
+def NumbaVoxelRay(n, nX, nY, nZ):
+
+    """
+    Used in MILTables for MIL computation
+    Voxels crossed by a ray of first octant direction n starting
+    at voxel (1,1,1), only the voxels where the ray progresses along
+    its main direction are kept
+    """
+
+    # Main direction of the ray
+    if abs(n[0]) > abs(n[1]):
+        if abs(n[2]) > abs(n[0]):
+            Direction = 2
+        else:
+            Direction = 0
+    elif abs(n[2]) > abs(n[1]):
+        Direction = 2
+    else:
+        Direction = 1
+
+    Ray = np.zeros((nX + nY + nZ + 1, 3), np.int64)
+    Vox = np.ones(3, np.int64)
+    PreVox = np.ones(3, np.int64)
+    Ray[0] = Vox
+    Length = 1
+
+    while Vox[0] <= nX and Vox[1] <= nY and Vox[2] <= nZ:
+        TMaxX = Vox[0] / n[0]
+        TMaxY = Vox[1] / n[1]
+        TMaxZ = Vox[2] / n[2]
+        if abs(TMaxX) < abs(TMaxY):
+            if abs(TMaxX) < abs(TMaxZ):
+                Vox[0] += 1
+            else:
+                Vox[2] += 1
+        elif abs(TMaxY) < abs(TMaxZ):
+            Vox[1] += 1
+        else:
+            Vox[2] += 1
+
+        if Vox[0] <= nX and Vox[1] <= nY and Vox[2] <= nZ:
+            if Vox[Direction] > PreVox[Direction]:
+                Ray[Length] = Vox
+                Length += 1
+        PreVox[:] = Vox
+
+    return Ray[:Length]
+
+@njit(parallel=True)
+def NumbaMIL(Array, Step, Directions, Viewers, Rays, RayIndex, RayLength, Corners):
+
+    """
+    Used in OriginalDistribution for MIL computation
+    Sums of intercepts lengths (L, L^2, L^4) and number of intercepts
+    for each direction, computed in parallel over directions
+    Corners order: swb, seb, neb, nwb, swt, set, net, nwt
+    """
+
+    nZ, nY, nX = Array.shape
+    nDirs = len(Directions)
+
+    # Model planes (s, e, n, w, b, t): r and s directions, base corner
+    PlaneR = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 0.0, 0.0],
+                       [0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+    PlaneS = np.array([[0.0, 0.0, 1.0], [0.0, 0.0, 1.0], [0.0, 0.0, 1.0],
+                       [0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [0.0, 1.0, 0.0]])
+    PlaneBase = np.array([0, 1, 3, 0, 0, 4])
+
+    # Entry planes and ray steps of each viewer corner (swb, seb, neb, nwb)
+    EntryPlanes = np.array([[0, 3, 4], [0, 1, 4], [2, 1, 4], [2, 3, 4]])
+    ViewerSteps = np.array([[1, 1, 1], [-1, 1, 1], [-1, -1, 1], [1, -1, 1]])
+
+    SumL = np.zeros(nDirs)
+    SumL2 = np.zeros(nDirs)
+    SumL4 = np.zeros(nDirs)
+    nL = np.zeros(nDirs)
+
+    for d in prange(nDirs):
+
+        v = Viewers[d]
+        Ray = Rays[RayIndex[d]]
+        Length = RayLength[RayIndex[d]]
+        StepX = ViewerSteps[v, 0]
+        StepY = ViewerSteps[v, 1]
+        StepZ = ViewerSteps[v, 2]
+
+        nn = Directions[d].copy()
         nb = np.array((0.0, 0.0, 1.0))
         ng = np.cross(nn, nb)
         ns = np.cross(ng, nn)
         nr = np.cross(ns, nn)
-        ng = ng / np.linalg.norm(ng)
         ns = ns / np.linalg.norm(ns)
         nr = nr / np.linalg.norm(nr)
+
+        # Extent of the projected model in the plane normal to the direction
         rmax = 0.0
         rmin = 0.0
         smax = 0.0
         smin = 0.0
         r1c = Corners[v]
-        for c in Corners:
-            r0c = Corners[c]
-            b = r0c - r1c
-            a11 = nr[0]
-            a12 = ns[0]
-            a13 = -nn[0]
-            a21 = nr[1]
-            a22 = ns[1]
-            a23 = -nn[1]
-            a31 = nr[2]
-            a32 = ns[2]
-            a33 = -nn[2]
+        for c in range(8):
+            b = Corners[c] - r1c
+            a11, a12, a13 = nr[0], ns[0], -nn[0]
+            a21, a22, a23 = nr[1], ns[1], -nn[1]
+            a31, a32, a33 = nr[2], ns[2], -nn[2]
             DET = a11 * (a33 * a22 - a32 * a23) - a21 * (a33 * a12 - a32 * a13) + a31 * (a23 * a12 - a22 * a13)
-            x = [0.0, 0.0, 0.0]
-            x[0] = 1.0 / DET * ((a33 * a22 - a32 * a23) * b[0] - (a33 * a12 - a32 * a13) * b[1] + (a23 * a12 - a22 * a13) * b[2])
-            x[1] = 1.0 / DET * (-(a33 * a21 - a31 * a23) * b[0] + (a33 * a11 - a31 * a13) * b[1] - (a23 * a11 - a21 * a13) * b[2])
-            if (x[0] > rmax):
-                rmax = x[0]
-            if x[0] < rmin:
-                rmin = x[0]
-            if x[1] > smax:
-                smax = x[1]
-            if x[1] < smin:
-                smin = x[1]
+            x0 = 1.0 / DET * ((a33 * a22 - a32 * a23) * b[0] - (a33 * a12 - a32 * a13) * b[1] + (a23 * a12 - a22 * a13) * b[2])
+            x1 = 1.0 / DET * (-(a33 * a21 - a31 * a23) * b[0] + (a33 * a11 - a31 * a13) * b[1] - (a23 * a11 - a21 * a13) * b[2])
+            rmax = max(rmax, x0)
+            rmin = min(rmin, x0)
+            smax = max(smax, x1)
+            smin = min(smin, x1)
 
         for curR in range(int(rmin), int(rmax + 1), Step):
             for curS in range(int(smin), int(smax + 1), Step):
-                for Plane in EntryPlanes:
-                    CutPlane = ModelPlanes[Plane]
-                    r1 = Corners[BaseModel[Plane]]
-                    r0 = curR * nr + curS * ns + r1c
-                    at = nn
-                    br = np.array(CutPlane['r-dir'])
-                    cs = np.array(CutPlane['s-dir'])
+                r0 = curR * nr + curS * ns + r1c
+                for Plane in EntryPlanes[v]:
+
+                    # Intersection of the ray with the entry plane
+                    br = PlaneR[Plane]
+                    cs = PlaneS[Plane]
+                    r1 = Corners[PlaneBase[Plane]]
                     b = r0 - r1
-                    a11 = br[0]
-                    a12 = cs[0]
-                    a13 = -at[0]
-                    a21 = br[1]
-                    a22 = cs[1]
-                    a23 = -at[1]
-                    a31 = br[2]
-                    a32 = cs[2]
-                    a33 = -at[2]
+                    a11, a12, a13 = br[0], cs[0], -nn[0]
+                    a21, a22, a23 = br[1], cs[1], -nn[1]
+                    a31, a32, a33 = br[2], cs[2], -nn[2]
                     DET = a11 * (a33 * a22 - a32 * a23) - a21 * (a33 * a12 - a32 * a13) + a31 * (a23 * a12 - a22 * a13)
-                    x = [0.0, 0.0, 0.0]
-                    x[0] = 1.0 / DET * ((a33 * a22 - a32 * a23) * b[0] - (a33 * a12 - a32 * a13) * b[1] + (a23 * a12 - a22 * a13) * b[2])
-                    x[1] = 1.0 / DET * (-(a33 * a21 - a31 * a23) * b[0] + (a33 * a11 - a31 * a13) * b[1] - (a23 * a11 - a21 * a13) * b[2])
-                    ipt = x[0] * br + x[1] * cs + r1
-                    C1 = ipt[0] >= 0.0
-                    C2 = ipt[1] >= 0.0
-                    C3 = ipt[2] >= 0.0
-                    C4 = ipt[0] <= nX
-                    C5 = ipt[1] <= nY
-                    C6 = ipt[2] <= nZ
-                    if C1 and C2 and C3 and C4 and C5 and C6:
-                        EntryVoxX = int(ipt[0] + 0.5)
-                        EntryVoxY = int(ipt[1] + 0.5)
-                        EntryVoxZ = int(ipt[2] + 0.5)
-                        if EntryVoxX == 0:
-                            EntryVoxX = 1
-                        if EntryVoxY == 0:
-                            EntryVoxY = 1
-                        if EntryVoxZ == 0:
-                            EntryVoxZ = 1
-                        StartBone = (1, 1, 1)
-                        EndBone = (1, 1, 1)
-                        PrevVox = (1, 1, 1)
-                        StartFlag = False
-                        for StartRayVox in NewVoxelRay:
-                            VoxX = StartRayVox[0] - (CornVoxX - EntryVoxX)
-                            VoxY = StartRayVox[1] - (CornVoxY - EntryVoxY)
-                            VoxZ = StartRayVox[2] - (CornVoxZ - EntryVoxZ)
-                            Xv = int(VoxX - 1)
-                            Yv = int(VoxY - 1)
-                            Zv = int(VoxZ - 1)
-                            Cc1 = VoxX < 1
-                            Cc2 = VoxY < 1
-                            Cc3 = VoxZ < 1
-                            Cc4 = VoxX > nX
-                            Cc5 = VoxY > nY
-                            Cc6 = VoxZ > nZ
-                            if Cc1 or Cc2 or Cc3 or Cc4 or Cc5 or Cc6:
-                                if StartFlag == True:
-                                    if VoxX > nX or VoxY > nY or VoxZ > nZ:
-                                        StartFlag = False
-                                        EndBone = PrevVox[0],PrevVox[1], PrevVox[2]
-                                        lx = StartBone[0] - EndBone[0]
-                                        ly = StartBone[1] - EndBone[1]
-                                        lz = StartBone[2] - EndBone[2]
-                                        L2 = lx * lx + ly * ly + lz * lz
-                                        if L2 > 0.0:
-                                            nL += 1
-                                            SumL[n] += L2 ** 0.5
-                                            SumL2[n] += L2
-                                            SumL4[n] += L2 * L2
-                            elif Array[Zv, Yv, Xv] == 0:
-                                if StartFlag == True:
-                                    StartFlag = False
-                                    EndBone = PrevVox[0], PrevVox[1], PrevVox[2]
-                                    lx = StartBone[0] - EndBone[0]
-                                    ly = StartBone[1] - EndBone[1]
-                                    lz = StartBone[2] - EndBone[2]
-                                    L2 = lx * lx + ly * ly + lz * lz
-                                    Text2 = L2
-                                    if L2 > 0.0:
-                                        nL += 1
-                                        SumL[n] += L2 ** 0.5
-                                        SumL2[n] += L2
-                                        SumL4[n] += L2 * L2
-                            elif StartFlag == False:
-                                StartBone = (VoxX, VoxY, VoxZ)
-                                StartFlag = True
-                            PrevVox = (VoxX, VoxY, VoxZ)
+                    x0 = 1.0 / DET * ((a33 * a22 - a32 * a23) * b[0] - (a33 * a12 - a32 * a13) * b[1] + (a23 * a12 - a22 * a13) * b[2])
+                    x1 = 1.0 / DET * (-(a33 * a21 - a31 * a23) * b[0] + (a33 * a11 - a31 * a13) * b[1] - (a23 * a11 - a21 * a13) * b[2])
+                    ipt = x0 * br + x1 * cs + r1
+
+                    if ipt[0] < 0.0 or ipt[1] < 0.0 or ipt[2] < 0.0:
+                        continue
+                    if ipt[0] > nX or ipt[1] > nY or ipt[2] > nZ:
+                        continue
+
+                    EntryVoxX = max(int(ipt[0] + 0.5), 1)
+                    EntryVoxY = max(int(ipt[1] + 0.5), 1)
+                    EntryVoxZ = max(int(ipt[2] + 0.5), 1)
+
+                    # Walk along the ray template and collect intercepts
+                    StartX, StartY, StartZ = 1, 1, 1
+                    PrevX, PrevY, PrevZ = 1, 1, 1
+                    StartFlag = False
+                    for iVox in range(Length):
+                        VoxX = EntryVoxX + StepX * (Ray[iVox, 0] - 1)
+                        VoxY = EntryVoxY + StepY * (Ray[iVox, 1] - 1)
+                        VoxZ = EntryVoxZ + StepZ * (Ray[iVox, 2] - 1)
+                        Outside = VoxX < 1 or VoxY < 1 or VoxZ < 1 or VoxX > nX or VoxY > nY or VoxZ > nZ
+                        Record = False
+                        if Outside:
+                            if StartFlag and (VoxX > nX or VoxY > nY or VoxZ > nZ):
+                                Record = True
+                        elif Array[VoxZ - 1, VoxY - 1, VoxX - 1] == 0:
+                            if StartFlag:
+                                Record = True
+                        elif not StartFlag:
+                            StartX, StartY, StartZ = VoxX, VoxY, VoxZ
+                            StartFlag = True
+
+                        if Record:
+                            StartFlag = False
+                            lx = StartX - PrevX
+                            ly = StartY - PrevY
+                            lz = StartZ - PrevZ
+                            L2 = float(lx * lx + ly * ly + lz * lz)
+                            if L2 > 0.0:
+                                nL[d] += 1
+                                SumL[d] += L2 ** 0.5
+                                SumL2[d] += L2
+                                SumL4[d] += L2 * L2
+
+                        PrevX, PrevY, PrevZ = VoxX, VoxY, VoxZ
 
-                        break
+                    break
+
+    return SumL, SumL2, SumL4, nL
+
+@njit(parallel=True)
+def NumbaDistanceRidge(Distance):
+
+    """
+    Used in LocalThickness
+    Distance ridge: voxels whose inscribed sphere is not contained
+    in the sphere of one of their 26 neighbours
+    """
+
+    nZ, nY, nX = Distance.shape
+    Ridge = np.zeros(Distance.shape, np.bool_)
+
+    for z in prange(nZ):
+        for y in range(nY):
+            for x in range(nX):
+
+                d = Distance[z, y, x]
+                if d <= 0:
+                    continue
+
+                IsRidge = True
+                for dz in range(-1, 2):
+                    zz = z + dz
+                    if zz < 0 or zz >= nZ or not IsRidge:
+                        continue
+                    for dy in range(-1, 2):
+                        yy = y + dy
+                        if yy < 0 or yy >= nY:
+                            continue
+                        for dx in range(-1, 2):
+                            xx = x + dx
+                            if xx < 0 or xx >= nX or (dz == 0 and dy == 0 and dx == 0):
+                                continue
+                            Step = np.sqrt(dz * dz + dy * dy + dx * dx)
+                            if Distance[zz, yy, xx] >= d + Step - 1e-6:
+                                IsRidge = False
+
+                Ridge[z, y, x] = IsRidge
+
+    return Ridge
+
+@njit(parallel=True)
+def NumbaLocalThickness(Structure, Centers, Radii2, SlabSize):
+
+    """
+    Used in LocalThickness
+    Stamp maximal spheres diameters into the structure voxels they cover,
+    each parallel task owns a slab of SlabSize slices (no write conflicts)
+    Centers must be sorted along Z (first coordinate)
+    Squared radii are exact integers (squared EDT) so that voxels lying
+    exactly on the sphere surface are not lost by rounding
+    """
+
+    nZ, nY, nX = Structure.shape
+    Thickness = np.zeros(Structure.shape, np.float32)
+    if len(Radii2) == 0:
+        return Thickness
+
+    RMax = int(np.ceil(np.sqrt(Radii2.max())))
+    nSlabs = (nZ + SlabSize - 1) // SlabSize
+
+    for s in prange(nSlabs):
+
+        Start = s * SlabSize
+        Stop = min(Start + SlabSize, nZ)
+
+        # Spheres which may intersect the slab
+        First = np.searchsorted(Centers[:, 0], Start - RMax)
+        Last = np.searchsorted(Centers[:, 0], Stop + RMax)
+
+        for k in range(First, Last):
+
+            cz, cy, cx = Centers[k, 0], Centers[k, 1], Centers[k, 2]
+            r2 = Radii2[k]
+            r = np.sqrt(r2)
+            T = np.float32(2 * r)
+            R = int(r)
+
+            for z in range(max(Start, cz - R), min(Stop, cz + R + 1)):
+                dz2 = (z - cz) ** 2
+                Ry = int(np.sqrt(max(r2 - dz2, 0.0)))
+                for y in range(max(0, cy - Ry), min(nY, cy + Ry + 1)):
+                    dzy2 = dz2 + (y - cy) ** 2
+                    Rx = int(np.sqrt(max(r2 - dzy2, 0.0)))
+                    for x in range(max(0, cx - Rx), min(nX, cx + Rx + 1)):
+                        if Structure[z, y, x] and Thickness[z, y, x] < T:
+                            Thickness[z, y, x] = T
+
+    return Thickness
+
+def SliceMedialAxis(Slice):
+
+    """
+    Mean thickness (pixels) of a 2D structure from its medial axis,
+    defined at module level to be used by process pools
+    """
 
-        n2 = (-n[0], -n[1], -n[2])
-        MIL[n] = SumL[n] / float(nL)
-        MIL[n2] = SumL[n] / float(nL)
-        SLD[n] = SumL2[n] / SumL[n]
-        SLD[n2] = SumL2[n] / SumL[n]
-        SVD[n] = np.pi / 3.0 * SumL4[n] / SumL[n]
-        SVD[n2] = np.pi / 3.0 * SumL4[n] / SumL[n]
+    Pad = np.pad(Slice, 1)
+    Skeleton, Distance = morphology.medial_axis(Pad, return_distance=True)
 
-    return i, MIL, SVD, SLD
+    return 2 * np.mean(Distance[Skeleton])
 
 #%% Tensor algebra function
 class Tensor():
@@ -4479,495 +6097,229 @@ class Tensor():
                         MinorSymmetry = False
                         break
 
+    def IsNumeric(self, A):
+
+        """
+        Check if a tensor holds numbers (numpy backend) or
+        symbolic expressions (sympy path)
+        """
+
+        if isinstance(A, sp.MatrixBase):
+            return False
+
+        return np.asarray(A).dtype != object
+
+    def Orders(self, A, B, Orders):
+
+        """
+        Tensors orders, leading axes in addition to the
+        orders are batch axes (broadcasted)
+        """
+
+        if Orders is None:
+            Orders = (np.ndim(A), np.ndim(B))
+
+        return Orders
+
     def Length(self, a):
-        c = np.sqrt(a[0] * a[0] + a[1] * a[1] + a[2] * a[2])
+        a = np.asarray(a)
+        c = np.sqrt(np.sum(a * a, axis=-1))
         return c
 
     def UnitVector(self, a):
         l = self.Length(a)
-        c = a / l
+        c = a / np.expand_dims(l, -1)
         return c
 
     def UnitMatrix(self, n):
-        I = np.zeros((n, n), float)
-        for row in range(n):
-            for col in range(n):
-                if row == col:
-                    I[col, row] = 1.0
-
+        I = np.eye(n)
         return I
 
     def CrossProduct(self, a, b):
-        c1 = a[1] * b[2] - a[2] * b[1]
-        c2 = a[2] * b[0] - a[0] * b[2]
-        c3 = a[0] * b[1] - a[1] * b[0]
-        c = np.array([c1, c2, c3])
+        c = np.cross(a, b)
         return c
 
-    def DyadicProduct(self, A, B):
-
-        self.CheckShape(A)
-        self.CheckShape(B)
-        self.CheckPosition(A, B)
+    def DyadicProduct(self, A, B, Orders=None):
 
-        type = 10 * len(A.shape) + len(B.shape)
-        C = np.array([])
-        if type == 11:
-            C = np.zeros((3, 3), float)
-            for i in range(3):
-                for j in range(3):
-                    C[i, j] = A[i] * B[j]
+        """
+        Dyadic product of tensors of any order, batched over leading axes
+        :param A: First tensor
+                  - Type: numpy array (..., 3, ...)
+        :param B: Second tensor
+                  - Type: numpy array (..., 3, ...)
+        :param Orders: Orders of A and B if batched, e.g. (1, 1) for
+                       vectors of shape (N, 3)
+        :return C: Tensor of order sum of A and B orders
+        """
 
-        elif type == 21:
-            C = np.zeros((3, 3, 3), float)
-            for i in range(3):
-                for j in range(3):
-                    for k in range(3):
-                        C[i, j, k] = A[i, j] * B[k]
+        oA, oB = self.Orders(A, B, Orders)
 
-        elif type == 22:
-            C = np.zeros((3, 3, 3, 3), float)
-            for i in range(3):
-                for j in range(3):
-                    for k in range(3):
-                        for l in range(3):
-                            C[i, j, k, l] = A[i, j] * B[k, l]
+        if self.IsNumeric(A) and self.IsNumeric(B):
+            a, b = 'ijkl'[:oA], 'mnop'[:oB]
+            C = np.einsum('...' + a + ',...' + b + '->...' + a + b, A, B)
 
         else:
-           print('Dyadic product not supported')
+            C = np.multiply.outer(np.array(A), np.array(B))
 
         return C
 
-    def FrobeniusProduct(self, A, B):
-
-        self.CheckShape(A)
-        self.CheckShape(B)
-
-        s = 0
-
-        if A.size == 9 and B.size == 9:
-            for i in range(3):
-                for j in range(3):
-                    s += A[i, j] * B[i, j]
+    def FrobeniusProduct(self, A, B, Order=None):
 
-        elif A.size == 36 and B.size == 36:
-            for i in range(6):
-                for j in range(6):
-                    s = s + A[i, j] * B[i, j]
-
-        elif A.shape == (9,9) and B.shape == (9,9):
-            for i in range(9):
-                for j in range(9):
-                    s = s + A[i, j] * B[i, j]
+        """
+        Sum of the element-wise product over the last Order axes
+        (all axes by default), e.g. batched (N, 3, 3) with Order=2
+        """
 
-        elif A.shape == (3,3,3,3) and B.shape == (3,3,3,3):
-            for i in range(3):
-                for j in range(3):
-                    for k in range(3):
-                        for l in range(3):
-                            s = s + A[i, j, k, l] * B[i, j, k, l]
+        if Order is None:
+            Order = np.ndim(A)
 
-        else:
-            print('Matrices sizes mismatch')
+        Product = np.asarray(A) * np.asarray(B)
+        s = np.sum(Product, axis=tuple(range(-Order, 0)))
 
         return s
 
     def SymmetricProduct(self, A, B):
 
-        if isinstance(A[0, 0], np.float):
-            C = np.zeros((3, 3, 3, 3))
-        else:
-            C = sp.zeros(9)
+        if self.IsNumeric(A) and self.IsNumeric(B):
+            C = np.einsum('...ik,...jl->...ijkl', A, B)
+            C = (C + np.einsum('...il,...jk->...ijkl', A, B)) / 2
+            return C
 
+        C = sp.zeros(9)
         for i in range(3):
             for j in range(3):
                 for k in range(3):
                     for l in range(3):
-                        if isinstance(A[0, 0], np.float):
-                            C[i,j,k,l] = (1/2)*(A[i,k]*B[j,l]+A[i,l]*B[j,k])
-                        else:
-                            C[3*i+j,3*k+l] = (1/2)*(A[i,k]*B[j,l]+A[i,l]*B[j,k])
+                        C[3*i+j,3*k+l] = (1/2)*(A[i,k]*B[j,l]+A[i,l]*B[j,k])
 
-        if not isinstance(A[0,0], np.float):
-            C = self.IsoMorphism99_3333(C)
+        C = self.IsoMorphism99_3333(C)
 
         return C
 
-    def DoubleContraction(self, A, B):
+    def DoubleContraction(self, A, B, Orders=None):
 
-        self.CheckShape(A)
-        self.CheckShape(B)
-        self.CheckPosition(A, B)
-
-        type = 10 * len(A.shape) + len(B.shape)
-        C = np.array([])
-        if type == 22:
-            C = np.zeros((1, ), float)
-            for i in range(3):
-                for j in range(3):
-                    C[(0, )] = C[(0, )] + A[i, j] * B[i, j]
+        """
+        Double contraction of 2nd and 4th order tensors,
+        batched over leading axes
+        :param Orders: Orders of A and B if batched, e.g. (4, 2)
+        """
 
-        elif type == 42:
-            C = np.zeros((3, 3), float)
-            for i in range(3):
-                for j in range(3):
-                    for m in range(3):
-                        for n in range(3):
-                            C[i, j] = C[i, j] + A[i, j, m, n] * B[m, n]
+        oA, oB = self.Orders(A, B, Orders)
+        type = 10 * oA + oB
 
-        elif type == 44:
-            C = np.zeros((1, ), float)
-            for i in range(3):
-                for j in range(3):
-                    for m in range(3):
-                        for n in range(3):
-                            C[(0, )] = C[(0, )] + A[i, j, m, n] * B[i, j, m, n]
+        Subscripts = {22:'...ij,...ij->...',
+                      24:'...ij,...ijkl->...kl',
+                      42:'...ijmn,...mn->...ij',
+                      44:'...ijmn,...ijmn->...'}
 
-        else:
+        if type not in Subscripts:
             print('Double contraction not supported')
+            return np.array([])
 
-        if C.shape[0] == 1:
-            return C[0]
-            
-        else:
-            return C
-
-    def Transform(self, A, B):
+        C = np.einsum(Subscripts[type], A, B)
 
-        self.CheckShape(A)
-        self.CheckShape(B)
+        return C
 
-        if A.size == 9 and B.size == 3:
+    def Transform(self, A, B, Orders=None):
 
-            if isinstance(A[0,0], np.float):
-                c = np.zeros(3)
-            else:
-                c = sp.Matrix([0,0,0])
+        """
+        Apply tensor A to tensor B (contraction over B axes), batched
+        over leading axes, e.g. a stiffness tensor (3,3,3,3) applied to
+        strain tensors (N,3,3) with Orders=(4,2)
+        Sympy matrices are computed by the symbolic path
+        """
 
-            for i in range(3):
-                for j in range(3):
-                    c[i] += A[i,j] * B[j]
+        oA, oB = self.Orders(A, B, Orders)
+        type = 10 * oA + oB
 
-            if not isinstance(A[0,0], np.float):
-                c = np.array(c)
+        Subscripts = {21:'...ij,...j->...i',
+                      32:'...ijk,...jk->...i',
+                      42:'...ijkl,...kl->...ij'}
 
-            return c
+        if type not in Subscripts:
+            print('Matrices sizes mismatch')
+            return
 
-        elif A.size == 27 and B.size == 9:
+        if self.IsNumeric(A) and self.IsNumeric(B):
+            return np.einsum(Subscripts[type], A, B)
 
-            if isinstance(A[0,0,0], np.float):
-                c = np.zeros(3)
-            else:
-                c = sp.Matrix([0,0,0])
+        # Symbolic path
+        A, B = np.array(A), np.array(B)
+        if type == 21:
+            c = sp.Matrix([0,0,0])
+            for i in range(3):
+                for j in range(3):
+                    c[i] += A[i,j] * B[j]
 
+        elif type == 32:
+            c = sp.Matrix([0,0,0])
             for i in range(3):
                 for j in range(3):
                     for k in range(3):
                         c[i] += A[i,j,k] * B[j,k]
 
-            if not isinstance(A[0,0,0], np.float):
-                c = np.array(c)
-
-            return c
-
-        elif A.size == 81 and B.size == 9:
-
-            if isinstance(A[0,0,0,0], np.float):
-                c = np.zeros((3,3))
-            else:
-                c = sp.zeros(3)
-
+        elif type == 42:
+            c = sp.zeros(3)
             for i in range(3):
                 for j in range(3):
                     for k in range(3):
                         for l in range(3):
                             c[i,j] += A[i,j,k,l] * B[k,l]
 
-            if not isinstance(A[0,0,0,0], np.float):
-                c = np.array(c)
+        return np.array(c)
 
-            return c
+    def IsoMorphism99_3333(self, A):
 
-        else:
-            print('Matrices sizes mismatch')
+        A = np.array(A)
+        B = A.reshape(A.shape[:-2] + (3,3,3,3))
 
-    def IsoMorphism99_3333(self, A):
+        return B
 
-        if isinstance(A[0, 0], np.float):
-            B = np.zeros((3, 3, 3, 3))
+    def Mandel(self):
 
-        else:
-            B = sp.zeros(9)
-            B = np.array(B).reshape((3,3,3,3))
+        """
+        Indices and weights of the Mandel (6x6) notation
+        """
 
-        for i in range(3):
-            for j in range(3):
-                for k in range(3):
-                    for l in range(3):
-                        B[i,j,k,l] = A[3*i+j,3*k+l]
+        I = np.array([0, 1, 2, 1, 2, 0])
+        J = np.array([0, 1, 2, 2, 0, 1])
+        W = np.array([1, 1, 1, np.sqrt(2), np.sqrt(2), np.sqrt(2)])
 
-        return B
+        return I, J, W
     
     def IsoMorphism3333_66(self, A):
 
-        if self.CheckMinorSymmetry(A) == False:
+        A = np.array(A)
+        if A.ndim == 4 and self.CheckMinorSymmetry(A) == False:
             print('Tensor does not present minor symmetry')
-        else:
+            return
 
-            if isinstance(A[0, 0, 0, 0], np.float):
-                B = np.zeros((6,6))
-            else:
-                B = sp.zeros(6)
-
-            B[0, 0] = A[0, 0, 0, 0]
-            B[1, 0] = A[1, 1, 0, 0]
-            B[2, 0] = A[2, 2, 0, 0]
-            B[3, 0] = np.sqrt(2) * A[1, 2, 0, 0]
-            B[4, 0] = np.sqrt(2) * A[2, 0, 0, 0]
-            B[5, 0] = np.sqrt(2) * A[0, 1, 0, 0]
-
-            B[0, 1] = A[0, 0, 1, 1]
-            B[1, 1] = A[1, 1, 1, 1]
-            B[2, 1] = A[2, 2, 1, 1]
-            B[3, 1] = np.sqrt(2) * A[1, 2, 1, 1]
-            B[4, 1] = np.sqrt(2) * A[2, 0, 1, 1]
-            B[5, 1] = np.sqrt(2) * A[0, 1, 1, 1]
-
-            B[0, 2] = A[0, 0, 2, 2]
-            B[1, 2] = A[1, 1, 2, 2]
-            B[2, 2] = A[2, 2, 2, 2]
-            B[3, 2] = np.sqrt(2) * A[1, 2, 2, 2]
-            B[4, 2] = np.sqrt(2) * A[2, 0, 2, 2]
-            B[5, 2] = np.sqrt(2) * A[0, 1, 2, 2]
-
-            B[0, 3] = np.sqrt(2) * A[0, 0, 1, 2]
-            B[1, 3] = np.sqrt(2) * A[1, 1, 1, 2]
-            B[2, 3] = np.sqrt(2) * A[2, 2, 1, 2]
-            B[3, 3] = 2 * A[1, 2, 1, 2]
-            B[4, 3] = 2 * A[2, 0, 1, 2]
-            B[5, 3] = 2 * A[0, 1, 1, 2]
-
-            B[0, 4] = np.sqrt(2) * A[0, 0, 2, 0]
-            B[1, 4] = np.sqrt(2) * A[1, 1, 2, 0]
-            B[2, 4] = np.sqrt(2) * A[2, 2, 2, 0]
-            B[3, 4] = 2 * A[1, 2, 2, 0]
-            B[4, 4] = 2 * A[2, 0, 2, 0]
-            B[5, 4] = 2 * A[0, 1, 2, 0]
-
-            B[0, 5] = np.sqrt(2) * A[0, 0, 0, 1]
-            B[1, 5] = np.sqrt(2) * A[1, 1, 0, 1]
-            B[2, 5] = np.sqrt(2) * A[2, 2, 0, 1]
-            B[3, 5] = 2 * A[1, 2, 0, 1]
-            B[4, 5] = 2 * A[2, 0, 0, 1]
-            B[5, 5] = 2 * A[0, 1, 0, 1]
-
-            return B
+        I, J, W = self.Mandel()
+        B = A[..., I[:,None], J[:,None], I[None,:], J[None,:]] * np.outer(W, W)
+
+        if not self.IsNumeric(A) and A.ndim == 4:
+            B = sp.Matrix(B)
+
+        return B
     
     def IsoMorphism66_3333(self, A):
 
+        A = np.array(A)
+
         # Check symmetry
-        Symmetry = True
-        for i in range(6):
-            for j in range(6):
-                if not A[i,j] == A[j,i]:
-                    Symmetry = False
-                    break
-        if Symmetry == False:
+        if not np.all(A == np.swapaxes(A, -1, -2)):
             print('Matrix is not symmetric!')
             return
 
-        if isinstance(A[0, 0], np.float):
-            B = np.zeros((3,3,3,3))
-        else:
-            B = sp.zeros((3,3,3,3))
-
-        # Build 4th tensor
-        B[0, 0, 0, 0] = A[0, 0]
-        B[1, 1, 0, 0] = A[1, 0]
-        B[2, 2, 0, 0] = A[2, 0]
-        B[1, 2, 0, 0] = A[3, 0] / np.sqrt(2)
-        B[2, 0, 0, 0] = A[4, 0] / np.sqrt(2)
-        B[0, 1, 0, 0] = A[5, 0] / np.sqrt(2)
-
-        B[0, 0, 1, 1] = A[0, 1]
-        B[1, 1, 1, 1] = A[1, 1]
-        B[2, 2, 1, 1] = A[2, 1]
-        B[1, 2, 1, 1] = A[3, 1] / np.sqrt(2)
-        B[2, 0, 2, 1] = A[4, 1] / np.sqrt(2)
-        B[0, 1, 2, 1] = A[5, 1] / np.sqrt(2)
-
-        B[0, 0, 2, 2] = A[0, 2]
-        B[1, 1, 2, 2] = A[1, 2]
-        B[2, 2, 2, 2] = A[2, 2]
-        B[1, 2, 2, 2] = A[3, 2] / np.sqrt(2)
-        B[2, 0, 2, 2] = A[4, 2] / np.sqrt(2)
-        B[0, 1, 2, 2] = A[5, 2] / np.sqrt(2)
-
-        B[0, 0, 1, 2] = A[0, 3] / np.sqrt(2)
-        B[1, 1, 1, 2] = A[1, 3] / np.sqrt(2)
-        B[2, 2, 1, 2] = A[2, 3] / np.sqrt(2)
-        B[1, 2, 1, 2] = A[3, 3] / 2
-        B[2, 0, 1, 2] = A[4, 3] / 2
-        B[0, 1, 1, 2] = A[5, 3] / 2
-
-        B[0, 0, 2, 0] = A[0, 4] / np.sqrt(2)
-        B[1, 1, 2, 0] = A[1, 4] / np.sqrt(2)
-        B[2, 2, 2, 0] = A[2, 4] / np.sqrt(2)
-        B[1, 2, 2, 0] = A[3, 4] / 2
-        B[2, 0, 2, 0] = A[4, 4] / 2
-        B[0, 1, 2, 0] = A[5, 4] / 2
-
-        B[0, 0, 0, 1] = A[0, 5] / np.sqrt(2)
-        B[1, 1, 0, 1] = A[1, 5] / np.sqrt(2)
-        B[2, 2, 0, 1] = A[2, 5] / np.sqrt(2)
-        B[1, 2, 0, 1] = A[3, 5] / 2
-        B[2, 0, 0, 1] = A[4, 5] / 2
-        B[0, 1, 0, 1] = A[5, 5] / 2
-
-
-
-        # Add minor symmetries ijkl = ijlk and ijkl = jikl
-
-        B[0, 0, 0, 0] = B[0, 0, 0, 0]
-        B[0, 0, 0, 0] = B[0, 0, 0, 0]
-
-        B[0, 0, 1, 0] = B[0, 0, 0, 1]
-        B[0, 0, 0, 1] = B[0, 0, 0, 1]
-
-        B[0, 0, 1, 1] = B[0, 0, 1, 1]
-        B[0, 0, 1, 1] = B[0, 0, 1, 1]
-
-        B[0, 0, 2, 1] = B[0, 0, 1, 2]
-        B[0, 0, 1, 2] = B[0, 0, 1, 2]
-
-        B[0, 0, 2, 2] = B[0, 0, 2, 2]
-        B[0, 0, 2, 2] = B[0, 0, 2, 2]
-
-        B[0, 0, 0, 2] = B[0, 0, 2, 0]
-        B[0, 0, 2, 0] = B[0, 0, 2, 0]
-
-
-
-        B[0, 1, 0, 0] = B[0, 1, 0, 0]
-        B[1, 0, 0, 0] = B[0, 1, 0, 0]
-
-        B[0, 1, 1, 0] = B[0, 1, 0, 1]
-        B[1, 0, 0, 1] = B[0, 1, 0, 1]
-
-        B[0, 1, 1, 1] = B[0, 1, 1, 1]
-        B[1, 0, 1, 1] = B[0, 1, 1, 1]
-
-        B[0, 1, 2, 1] = B[0, 1, 1, 2]
-        B[1, 0, 1, 2] = B[0, 1, 1, 2]
-
-        B[0, 1, 2, 2] = B[0, 1, 2, 2]
-        B[1, 0, 2, 2] = B[0, 1, 2, 2]
-
-        B[0, 1, 0, 2] = B[0, 1, 2, 0]
-        B[1, 0, 2, 0] = B[0, 1, 2, 0]
-
-
-
-        B[1, 1, 0, 0] = B[1, 1, 0, 0]
-        B[1, 1, 0, 0] = B[1, 1, 0, 0]
-
-        B[1, 1, 1, 0] = B[1, 1, 0, 1]
-        B[1, 1, 0, 1] = B[1, 1, 0, 1]
-
-        B[1, 1, 1, 1] = B[1, 1, 1, 1]
-        B[1, 1, 1, 1] = B[1, 1, 1, 1]
-
-        B[1, 1, 2, 1] = B[1, 1, 1, 2]
-        B[1, 1, 1, 2] = B[1, 1, 1, 2]
-
-        B[1, 1, 2, 2] = B[1, 1, 2, 2]
-        B[1, 1, 2, 2] = B[1, 1, 2, 2]
-
-        B[1, 1, 0, 2] = B[1, 1, 2, 0]
-        B[1, 1, 2, 0] = B[1, 1, 2, 0]
-
-
-
-        B[1, 2, 0, 0] = B[1, 2, 0, 0]
-        B[2, 1, 0, 0] = B[1, 2, 0, 0]
-
-        B[1, 2, 1, 0] = B[1, 2, 0, 1]
-        B[2, 1, 0, 1] = B[1, 2, 0, 1]
-
-        B[1, 2, 1, 1] = B[1, 2, 1, 1]
-        B[2, 1, 1, 1] = B[1, 2, 1, 1]
-
-        B[1, 2, 2, 1] = B[1, 2, 1, 2]
-        B[2, 1, 1, 2] = B[1, 2, 1, 2]
-
-        B[1, 2, 2, 2] = B[1, 2, 2, 2]
-        B[2, 1, 2, 2] = B[1, 2, 2, 2]
-
-        B[1, 2, 0, 2] = B[1, 2, 2, 0]
-        B[2, 1, 2, 0] = B[1, 2, 2, 0]
-
-
-
-        B[2, 2, 0, 0] = B[2, 2, 0, 0]
-        B[2, 2, 0, 0] = B[2, 2, 0, 0]
-
-        B[2, 2, 1, 0] = B[2, 2, 0, 1]
-        B[2, 2, 0, 1] = B[2, 2, 0, 1]
-
-        B[2, 2, 1, 1] = B[2, 2, 1, 1]
-        B[2, 2, 1, 1] = B[2, 2, 1, 1]
-
-        B[2, 2, 2, 1] = B[2, 2, 1, 2]
-        B[2, 2, 1, 2] = B[2, 2, 1, 2]
-
-        B[2, 2, 2, 2] = B[2, 2, 2, 2]
-        B[2, 2, 2, 2] = B[2, 2, 2, 2]
-
-        B[2, 2, 0, 2] = B[2, 2, 2, 0]
-        B[2, 2, 2, 0] = B[2, 2, 2, 0]
-
-
-
-        B[2, 0, 0, 0] = B[2, 0, 0, 0]
-        B[0, 2, 0, 0] = B[2, 0, 0, 0]
-
-        B[2, 0, 1, 0] = B[2, 0, 0, 1]
-        B[0, 2, 0, 1] = B[2, 0, 0, 1]
-
-        B[2, 0, 1, 1] = B[2, 0, 1, 1]
-        B[0, 2, 1, 1] = B[2, 0, 1, 1]
-
-        B[2, 0, 2, 1] = B[2, 0, 1, 2]
-        B[0, 2, 1, 2] = B[2, 0, 1, 2]
-
-        B[2, 0, 2, 2] = B[2, 0, 2, 2]
-        B[0, 2, 2, 2] = B[2, 0, 2, 2]
-
-        B[2, 0, 0, 2] = B[2, 0, 2, 0]
-        B[0, 2, 2, 0] = B[2, 0, 2, 0]
-
-
-        # Complete minor symmetries
-        B[0, 2, 1, 0] = B[0, 2, 0, 1]
-        B[0, 2, 0, 2] = B[0, 2, 2, 0]
-        B[0, 2, 2, 1] = B[0, 2, 1, 2]
-
-        B[1, 0, 1, 0] = B[1, 0, 0, 1]
-        B[1, 0, 0, 2] = B[1, 0, 2, 0]
-        B[1, 0, 2, 1] = B[1, 0, 1, 2]
-
-        B[2, 1, 1, 0] = B[2, 1, 0, 1]
-        B[2, 1, 0, 2] = B[2, 1, 2, 0]
-        B[2, 1, 2, 1] = B[2, 1, 1, 2]
-
-
-        # Add major symmetries ijkl = klij
-        B[0, 1, 1, 1] = B[1, 1, 0, 1]
-        B[1, 0, 1, 1] = B[1, 1, 1, 0]
-
-        B[0, 2, 1, 1] = B[1, 1, 0, 2]
-        B[2, 0, 1, 1] = B[1, 1, 2, 0]
+        # Mandel index of each (i,j) pair, with minor symmetries
+        V = np.array([[0, 5, 4],
+                      [5, 1, 3],
+                      [4, 3, 2]])
+        W = self.Mandel()[2]
 
+        # Build 4th tensor, minor and major symmetries follow from V
+        B = A[..., V[:,:,None,None], V[None,None,:,:]]
+        B = B / (W[V][:,:,None,None] * W[V][None,None,:,:])
 
         return B
 
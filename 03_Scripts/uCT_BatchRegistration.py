@@ -0,0 +1,83 @@
+#%% #!/usr/bin/env python3
+# Initialization
+
+Version = '01'
+
+Description = """
+    Script used to run the pre/post-test registration of all samples
+    in parallel. Samples are distributed over a pool of processes, each
+    limited to a given number of elastix/ITK threads. Status of each
+    sample is stored to resume failed or interrupted batches and timing
+    and memory usage are aggregated into a report.
+
+    Version Control:
+        01 - Original script
+
+    Author: Mathieu Simon
+            ARTORG Center for Biomedical Engineering Research
+            SITEM Insel, University of Bern
+
+    Date: October 2026
+    """
+
+#%% Imports
+# Modules import
+
+import argparse
+from Utils import *
+from uCT_Registration import RegisterSample
+
+
+#%% Main
+# Main code
+
+def Main(Arguments):
+
+    # Set directories
+    WD, DD, SD, RD = SetDirectories(Arguments.Folder)
+    SampleList = pd.read_csv(str(DD / 'SampleList.csv'))
+    StatusDir = RD / '04_Registration' / 'Batch'
+
+    # Select samples
+    if Arguments.Samples:
+        Samples = Arguments.Samples
+    else:
+        Samples = list(SampleList['Internal ID'])
+
+    # Run registrations
+    Batch.Threads = Arguments.Threads
+    Batch.Processes = Arguments.Processes
+    Report = Batch.Run(RegisterSample, Samples, Arguments, StatusDir, Resume=not Arguments.Restart)
+
+    print(Report)
+    if Report['Time'].notna().any():
+        print('\nTotal time: %.0f s, peak memory per sample: %.0f MB' % (Report['Time'].sum(), Report['Memory'].max()))
+
+    return
+
+#%% Execution part
+# Execution as main
+if __name__ == '__main__':
+
+    # Initiate the parser with a description
+    FC = argparse.RawDescriptionHelpFormatter
+    Parser = argparse.ArgumentParser(description=Description, formatter_class=FC)
+
+    # Add long and short argument
+    SV = Parser.prog + ' version ' + Version
+    Parser.add_argument('-V', '--Version', help='Show script version', action='version', version=SV)
+
+    # Add defaults arguments
+    Parser.add_argument('Samples', help='Samples to register (default all)', type=str, nargs='*')
+    Parser.add_argument('-F', '--Folder', help='Root folder name', type=str, default='FRACTIB')
+    Parser.add_argument('-T','--Type', help='Registration type', type=str, default='Rigid')
+    Parser.add_argument('-E','--Engine', help='B-spline registration engine (Elastix or ITK)', type=str, default='Elastix')
+    Parser.add_argument('-J','--Jac', help='Compute deformation Jacobian', type=bool, default=False)
+    Parser.add_argument('-N','--Threads', help='Number of threads per sample', type=int, default=4)
+    Parser.add_argument('-P','--Processes', help='Number of samples in parallel (default cores/threads)', type=int, default=None)
+    Parser.add_argument('-R','--Restart', help='Recompute samples already done', action='store_true')
+
+    # Read arguments from the command line
+    Arguments = Parser.parse_args()
+
+    Main(Arguments)
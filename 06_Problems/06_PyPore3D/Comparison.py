@@ -1,14 +1,16 @@
 #%% #!/usr/bin/env python3
 # Initialization
 
-Version = '01'
+Version = '02'
 
 Description = """
     Script used to compare trabecular morphometry results
-    from medtool, scanco, and pypore3d.
+    from medtool, scanco, pypore3d, and the native (distance
+    transform based) backend of Utils.Morphometry.
 
     Version Control:
         01 - Original script
+        02 - Add native backend validation
 
     Author: Mathieu Simon
             ARTORG Center for Biomedical Engineering Research
@@ -21,6 +23,7 @@ Description = """
 # Modules import
 
 import os
+import sys
 import vtk
 import time
 import struct
@@ -36,6 +39,10 @@ from vtk.util.numpy_support import vtk_to_numpy # type: ignore
 from pypore3d.p3dSITKPy import py_p3dReadRaw8 as ReadRaw8
 from pypore3d.p3dBlobPy import py_p3dMorphometricAnalysis as MA
 
+# Native morphometry backend from main scripts utils
+sys.path.append(str(Path(__file__).resolve().parents[2] / '03_Scripts'))
+from Utils import Morphometry
+
 
 #%% Functions
 # Define functions
@@ -471,6 +478,7 @@ def Main():
 
     Columns = pd.MultiIndex.from_product([['Medtool', 'Scanco'],Props])
     PyPore = pd.DataFrame(columns=Columns, index=SampleList['Internal ID'])
+    Native = pd.DataFrame(columns=Columns, index=SampleList['Internal ID'])
     Medtool = pd.DataFrame(columns=Props)
     Scanco = pd.DataFrame(columns=Props)
 
@@ -490,7 +498,11 @@ def Main():
         MHD = sitk.ReadImage(str(WD / 'Medtool' / (uCT[:-4] + '.mhd')))
         Trab = Trabecular((MHD == 2) * 255)
         for P in Props:
-            PyPore.loc[Sample,'Medtool'][P] = Trab.loc[0,P]
+            PyPore.loc[Sample,('Medtool', P)] = Trab.loc[0,P]
+
+        Trab = Morphometry.Trabecular((MHD == 2) * 255, DA=False, Backend='Native')
+        for P in Props:
+            Native.loc[Sample,('Medtool', P)] = Trab.loc[0,P]
 
         # Read and store Scanco values
         uCT = uCT[:8] + '_DOWNSCALED_BONE_MORPHO.TXT'
@@ -525,7 +537,11 @@ def Main():
         Time.Update(5/6, 'Scanco')
         Trab = Trabecular(Bin, Mask=Seg)
         for P in Props:
-            PyPore.loc[Sample,'Scanco'][P] = Trab.loc[0,P]
+            PyPore.loc[Sample,('Scanco', P)] = Trab.loc[0,P]
+
+        Trab = Morphometry.Trabecular(Bin, Mask=Seg, DA=False, Backend='Native')
+        for P in Props:
+            Native.loc[Sample,('Scanco', P)] = Trab.loc[0,P]
 
         Time.Process(0, Sample)
 
@@ -540,6 +556,11 @@ def Main():
         Fit = OLS(Scanco[P].astype('float'), Medtool[P].astype('float'),
                 Labels=['Scanco', 'Medtool'])
 
+        # Validate native backend against pypore3d
+        for Source in ['Medtool', 'Scanco']:
+            Fit = OLS(PyPore[Source, P].astype('float'), Native[Source, P].astype('float'),
+                    Labels=['Pypore3D', 'Native'])
+
 
 
     return
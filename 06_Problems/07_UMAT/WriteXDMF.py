@@ -57,16 +57,18 @@ with h5py.File(file_hdf5, "w") as file, xh.TimeSeries(file_xdmf) as xdmf:
 
     file["coor"] = coor
     file["conn"] = conn
+    xh.create_timeseries(file, "stress", stress.shape)
+    xh.create_timeseries(file, "disp", [disp.shape[0], 3])
 
     for i in range(4):
 
-        file[f"/stress/{i:d}"] = float(i) * stress
-        file[f"/disp/{i:d}"] = float(i) * xh.as3d(disp)
+        xh.append(file["stress"], float(i) * stress)
+        xh.append(file["disp"], float(i) * xh.as3d(disp))
 
         xdmf += xh.TimeStep()
         xdmf += xh.Unstructured(file["coor"], file["conn"], xh.ElementType.Hexahedron)
-        xdmf += xh.Attribute(file[f"/disp/{i:d}"], xh.AttributeCenter.Node, name="Displacement")
-        xdmf += xh.Attribute(file[f"/stress/{i:d}"], xh.AttributeCenter.Cell, name="Stress")
+        xdmf += xh.Attribute(file["disp"], xh.AttributeCenter.Node, name="Displacement", index=i)
+        xdmf += xh.Attribute(file["stress"], xh.AttributeCenter.Cell, name="Stress", index=i)
 
 
 
@@ -81,6 +81,61 @@ def as3d(arg: ArrayLike) -> ArrayLike:
     return ret
 
 
+def create_timeseries(
+    file: h5py.File,
+    path: str,
+    shape: tuple[int, ...],
+    dtype: np.dtype = np.float64,
+    compression: str = "gzip",
+    compression_opts: int = 4,
+    chunk_bytes: int = 2**20,
+) -> h5py.Dataset:
+    r"""
+    Create a resizable dataset with a leading time axis, chunked and compressed,
+    to which time steps are appended with :py:func:`append`.
+
+    :param file: Opened HDF5-file.
+    :param path: Path of the dataset in the file.
+    :param shape: Shape of one time step (e.g. ``[N, 3]`` for nodal vectors).
+    :param dtype: Data-type.
+    :param compression: HDF5 compression filter (``"gzip"``, ``"lzf"``, or ``None``).
+    :param compression_opts: Compression level (``"gzip"`` only).
+    :param chunk_bytes: Approximative size of the chunks (one time step, split along the first axis).
+    :return: The ``[0, *shape]`` dataset with ``maxshape=(None, *shape)``.
+    """
+
+    shape = tuple(int(i) for i in shape)
+    row = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+    rows = max(1, min(shape[0], chunk_bytes // max(row, 1))) if len(shape) > 0 else None
+    chunks = (1,) if rows is None else (1, rows, *shape[1:])
+
+    return file.create_dataset(
+        path,
+        shape=(0, *shape),
+        maxshape=(None, *shape),
+        chunks=chunks,
+        dtype=dtype,
+        compression=compression,
+        compression_opts=compression_opts if compression == "gzip" else None,
+        shuffle=compression is not None,
+    )
+
+
+def append(dataset: h5py.Dataset, data: ArrayLike) -> int:
+    r"""
+    Append one time step to a dataset created by :py:func:`create_timeseries`.
+
+    :param dataset: Resizable dataset.
+    :param data: Data of the time step, shape ``dataset.shape[1:]``.
+    :return: Index of the time step (to use in :py:class:`Attribute`).
+    """
+
+    index = dataset.shape[0]
+    dataset.resize(index + 1, axis=0)
+    dataset[index] = data
+    return index
+
+
 class Field:
     """
     Base class of XDMF-fields.
@@ -110,6 +165,24 @@ class Field:
         """
         self.filename = os.path.relpath(self.filename, pathlib.Path(path).parent)
 
+    def data_item(self, name: str = None) -> str:
+        """
+        :param name: Name of the DataItem, to reference it from elsewhere in the file.
+        :return: XDMF DataItem reading the full dataset.
+        """
+        name = "" if name is None else f'Name="{name}" '
+        return (
+            f'<DataItem {name}Dimensions="{self.shape_str}" Format="HDF"> '
+            f"{self.filename}:{self.path} </DataItem>"
+        )
+
+    def reference(self) -> str:
+        """
+        :return: XDMF DataItem referencing the DataItem defined once in the Domain
+            (see :py:meth:`data_item`).
+        """
+        return f'<DataItem Reference="XML">/Xdmf/Domain/DataItem[@Name="{self.path}"]</DataItem>'
+
     def __str__(self) -> str:
         """
         Return XML snippet.
@@ -126,6 +199,7 @@ class Geometry(Field):
 
     def __init__(self, dataset: h5py.Group):
         super().__init__(dataset, "Geometry")
+        self.shared = False
         assert len(self.shape) == 2
 
     def __list__(self) -> list[str]:
@@ -144,12 +218,7 @@ class Geometry(Field):
         else:
             raise OSError("Illegal number of dimensions.")
 
-        ret += [
-            (
-                f'<DataItem Dimensions="{self.shape_str}" Format="HDF"> '
-                f"{self.filename}:{self.path} </DataItem>"
-            )
-        ]
+        ret += [self.reference() if self.shared else self.data_item()]
         ret += ["</Geometry>"]
 
         return ret
@@ -166,6 +235,7 @@ class Topology(Field):
     def __init__(self, dataset: h5py.Group, element_type: ElementType):
         super().__init__(dataset, "Topology")
         self.element_type = element_type
+        self.shared = False
 
         if not shape_is_correct(self.shape, self.element_type):
             raise OSError("Incorrect dimensions for type")
@@ -179,12 +249,7 @@ class Topology(Field):
         ret += [
             f'<Topology NumberOfElements="{self.shape[0]:d}" TopologyType="{self.element_type}">'
         ]
-        ret += [
-            (
-                f'<DataItem Dimensions="{self.shape_str}" Format="HDF"> '
-                f"{self.filename}:{self.path} </DataItem>"
-            )
-        ]
+        ret += [self.reference() if self.shared else self.data_item()]
         ret += ["</Topology>"]
 
         return ret
@@ -193,18 +258,56 @@ class Topology(Field):
 class Attribute(Field):
     """
     Interpret a dataset as an Attribute.
+    For a dataset with a time axis (see :py:func:`create_timeseries`),
+    ``index`` selects one time step through a HyperSlab.
 
     :param dataset: Dataset.
     :param center: How to center the Attribute (see :py:class:`AttributeCenter`).
     :param name: Name to use in the XDMF-file [default: same as dataset]
+    :param index: Time step to select along the first axis of the dataset [default: full dataset].
     """
 
-    def __init__(self, dataset: h5py.File, center: str, name: str = None):
+    def __init__(self, dataset: h5py.File, center: str, name: str = None, index: int = None):
         super().__init__(dataset, name)
         self.center = center
+        self.index = index
+
+        if self.index is not None:
+            assert 0 <= self.index < self.shape[0]
+            self.dataset = dataset
+            self.shape = self.shape[1:]
+            self.shape_str = " ".join(str(i) for i in self.shape)
+
         assert len(self.shape) > 0
         assert len(self.shape) < 3
 
+    def hyperslab(self) -> list[str]:
+        """
+        The Dimensions of the HDF5 source are read when the file is serialized,
+        such that they match the final shape of a dataset to which time steps
+        are still appended after the Attribute is added.
+
+        :return: XDMF HyperSlab DataItem selecting time step ``index`` of the dataset.
+        """
+
+        rank = len(self.shape) + 1
+        start = " ".join(str(i) for i in [self.index] + [0] * (rank - 1))
+        stride = " ".join(["1"] * rank)
+        count = " ".join(str(i) for i in [1, *self.shape])
+
+        ret = []
+        ret += [f'<DataItem Dimensions="{self.shape_str}" ItemType="HyperSlab" Type="HyperSlab">']
+        ret += [f'<DataItem Dimensions="3 {rank:d}" Format="XML"> {start} {stride} {count} </DataItem>']
+        ret += [
+            (
+                f'<DataItem Dimensions="{" ".join(str(i) for i in self.dataset.shape)}" Format="HDF"> '
+                f"{self.filename}:{self.path} </DataItem>"
+            )
+        ]
+        ret += ["</DataItem>"]
+
+        return ret
+
     def __list__(self) -> list[str]:
         """
         :return: XDMF code snippet.
@@ -219,26 +322,38 @@ class Attribute(Field):
 
         ret = []
         ret += [f'<Attribute AttributeType="{t}" Center="{self.center}" Name="{self.name}">']
-        ret += [
-            (
-                f'<DataItem Dimensions="{self.shape_str}" Format="HDF"> '
-                f"{self.filename}:{self.path} </DataItem>"
-            )
-        ]
+        if self.index is None:
+            ret += [self.data_item()]
+        else:
+            ret += self.hyperslab()
         ret += ["</Attribute>"]
 
         return ret
 
 
-def _asfile(lines: list[str]) -> str:
+def _expand(lines: list) -> list[str]:
+    """
+    Render the fields stored in a list of lines.
+    :param lines: List of lines and :py:class:`Field` (rendered at this point).
+    :return: List of lines.
+    """
+    ret = []
+    for line in lines:
+        ret += list(line) if isinstance(line, Field) else [line]
+    return ret
+
+
+def _asfile(lines: list[str], items: list[str] = []) -> str:
     """
     Convert a list of lines to an XDMF-file.
     :param lines: List of lines.
+    :param items: DataItems defined once in the Domain and referenced in the grids.
     :return: XDMF-file.
     """
     ret = []
     ret += ['<Xdmf Version="3.0">']
     ret += ["<Domain>"]
+    ret += items
     ret += lines
     ret += ["</Domain>"]
     ret += ["</Xdmf>"]
@@ -266,7 +381,7 @@ class File:
         return minidom.parseString("\n".join(self.__list__())).toprettyxml(newl="")
 
     def __list__(self) -> list[str]:
-        return _asfile(self.lines)
+        return _asfile(_expand(self.lines))
 
     def __add__(self, content: Field):
         """
@@ -280,7 +395,7 @@ class File:
 
         if isinstance(content, Field):
             content.relpath(self.filename)  # todo: operation that does not modify "content"
-            self.lines += list(content)
+            self.lines += [content]
             return self
 
         self.lines += [content]
@@ -333,7 +448,7 @@ class Grid(File):
         ret = []
         ret += [f'<Grid CollectionType="Temporal" GridType="Collection" Name="{self.name}">']
         ret += [f'<Grid Name="{self.name}">']
-        ret += self.lines
+        ret += _expand(self.lines)
         ret += ["</Grid>"]
         ret += ["</Grid>"]
 
@@ -351,22 +466,28 @@ class TimeSeries(File):
     -   :py:class:`Structured`.
     -   :py:class:`Unstructured`.
 
+    The geometry and topology of the grids are written once in the Domain and
+    referenced by each time step. Time steps are best stored in resizable datasets
+    (see :py:func:`create_timeseries`) and selected with ``index``.
+
     Usage::
 
         with h5py.File("my.h5", "w") as file, xh.TimeSeries("my.xdmf") as xdmf:
 
             file["coor"] = coor
             file["conn"] = conn
+            xh.create_timeseries(file, "stress", stress.shape)
+            xh.create_timeseries(file, "disp", [disp.shape[0], 3])
 
             for i in range(4):
 
-                file[f"/stress/{i:d}"] = float(i) * stress
-                file[f"/disp/{i:d}"] = float(i) * xh.as3d(disp)
+                xh.append(file["stress"], float(i) * stress)
+                xh.append(file["disp"], float(i) * xh.as3d(disp))
 
                 xdmf += xh.TimeStep()
                 xdmf += xh.Unstructured(file["coor"], file["conn"], xh.ElementType.Quadrilateral)
-                xdmf += xh.Attribute(file[f"/disp/{i:d}"], xh.AttributeCenter.Node, name="Disp")
-                xdmf += xh.Attribute(file[f"/stress/{i:d}"], xh.AttributeCenter.Cell, name="Stress")
+                xdmf += xh.Attribute(file["disp"], xh.AttributeCenter.Node, name="Disp", index=i)
+                xdmf += xh.Attribute(file["stress"], xh.AttributeCenter.Cell, name="Stress", index=i)
 
     :param name: Name of the TimeSeries.
     """
@@ -376,6 +497,7 @@ class TimeSeries(File):
         self.name = name
         self.start = []
         self.settings = []
+        self.items = {}
 
     def __add__(self, other: TimeStep):
 
@@ -384,6 +506,14 @@ class TimeSeries(File):
             self.settings += [other]
             return self
 
+        if isinstance(other, _Grid):
+            other.relpath(self.filename)
+            for field in [other.geometry, other.topology]:
+                self.items.setdefault(field.path, field.data_item(name=field.path))
+                field.shared = True
+            self.lines += [other]
+            return self
+
         super().__add__(other)
         return self
 
@@ -408,11 +538,11 @@ class TimeSeries(File):
 
             ret += [f'<Grid Name="{name}">']
             ret += [f'<Time Value="{str(t)}"/>']
-            ret += self.lines[start[i] : start[i + 1]]  # noqa: E203
+            ret += _expand(self.lines[start[i] : start[i + 1]])  # noqa: E203
             ret += ["</Grid>"]
 
         ret += ["</Grid>"]
-        return _asfile(ret)
+        return _asfile(ret, list(self.items.values()))
 
 
 class _Grid(Field):